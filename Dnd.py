@@ -1,10 +1,79 @@
 import streamlit as st
-from typing import List, Dict, Optional
+from streamlit.errors import StreamlitAPIException
+from typing import Iterable, List, Dict, Optional, Tuple
 from datetime import datetime
+import itertools
+import contextlib
+import functools
+import io
+import json
+import os
 import time
 
+from catalog import MAX_LEVEL, SpellCatalog, load_catalog
+from codec import ElementCodec
+from engine import GameEngine, REQUEST_NEW
+from journal import JournalPersistence
+from metrics import BLOCKS, COMBOS, PENDING, PROCESSED, REJECTED_DUPLICATE, REJECTED_RATE, SOLVED
+from persistence import SQLitePersistence
+from presence import ONLINE_WINDOW, new_session_id
+from profiling import RerunProfiler, capture_profile
+from ratelimit import TokenBucketLimiter
+from records import format_time
+from rooms import DEFAULT_ROOM, RoomRegistry, normalize_code, room_db_path
+from render import BlockRenderer, HOST_VIEW, PLAYER_VIEW
+from scheduler import CooldownPolicy
+from store import (SharedStore, STATUS_PENDING,
+                   ORDER_CREATED, ORDER_RECENT, ORDER_LEVEL, ORDER_STATUS)
+from transfer import (KINDS, KIND_BLOCK, KIND_COMBO, KIND_REQUEST, RecordValidator,
+                      export_records, import_records, read_file, spool, to_csv, to_jsonl)
+
 # ========== КОНФИГУРАЦИЯ ==========
 HOST_PASSWORD = "IamDM"  # Секретный пароль
+# Файл базы SQLite с общими данными. Пустая строка - хранить только в памяти
+DB_PATH = os.environ.get("DND_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dnd_state.sqlite3"))
+# Файл каталога заклинаний (JSON или CSV). Пустая строка - встроенный список
+SPELLS_PATH = os.environ.get("DND_SPELLS_PATH", "")
+# Способ хранения: "sqlite" - база SQLite, "journal" - журнал событий со снимками
+# в каталоге рядом с базой (dnd_state.journal), журнал заодно служит историей изменений
+STORAGE = os.environ.get("DND_STORAGE", "sqlite")
+# Несколько процессов Streamlit (реплик) работают с одним файлом базы
+MULTI_PROCESS = os.environ.get("DND_MULTI_PROCESS", "") == "1"
+if STORAGE == "journal" and MULTI_PROCESS:
+    raise ValueError("Журнал событий не поддерживает несколько процессов: используйте DND_STORAGE=sqlite")
+# Через сколько секунд без активности сессия пользователя забывается
+PRESENCE_HORIZON = float(os.environ.get("DND_PRESENCE_HORIZON", 3600))
+# Как часто фоновый поток ищет такие сессии
+PRESENCE_SWEEP_INTERVAL = 60
+# Замеры секций rerun, виджетов и обращений к хранилищу для панели мастера
+PROFILING = os.environ.get("DND_PROFILING", "") == "1"
+# Как часто (в секундах) сессия проверяет, изменились ли общие данные
+REFRESH_INTERVAL = 1
+# Через сколько секунд использованная попытка возвращается сама (мастер меняет это в своей панели).
+# Пустая строка - только по запросу мастеру, как раньше
+RETRY_COOLDOWN = os.environ.get("DND_RETRY_COOLDOWN", "60")
+RETRY_COOLDOWN = float(RETRY_COOLDOWN) if RETRY_COOLDOWN else None
+# Сколько запросов мастеру игрок может отправить в минуту и сколько подряд без ожидания
+REQUEST_RATE = float(os.environ.get("DND_REQUEST_RATE", 6))
+REQUEST_BURST = int(os.environ.get("DND_REQUEST_BURST", 5))
+REQUEST_REJECTED_MESSAGE = "⏳ Запрос не отправлен: такой уже ожидает или запросы идут слишком часто. Подождите немного"
+# Сколько элементов списка показывать сразу и добавлять по кнопке "Показать еще"
+PAGE_SIZE = 20
+# Сколько результатов поиска показывать максимум
+SEARCH_LIMIT = 100
+# Источники заклинаний для массовой генерации комбинаций
+BULK_ALL_SPELLS = "📚 Все заклинания каталога"
+BULK_PENDING = "📨 Ожидающие запросы"
+# Импорт и экспорт таблицы
+TRANSFER_KIND_LABELS = {KIND_COMBO: "🧩 Комбинации", KIND_BLOCK: "📦 Игровые блоки", KIND_REQUEST: "📨 Запросы"}
+FORMAT_JSONL = "JSON Lines"
+FORMAT_CSV = "CSV"
+BLOCK_SORT_OPTIONS = {
+    "🆕 По созданию": ORDER_CREATED,
+    "🕒 Недавняя активность": ORDER_RECENT,
+    "📊 По уровню": ORDER_LEVEL,
+    "🎯 По статусу": ORDER_STATUS,
+}
 ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
 ELEMENT_SYMBOLS = {
     "Огонь": "🔥",
@@ -27,51 +96,113 @@ ELEMENT_COLORS = {
     "Щит": "#118AB2"
 }
 
-# ========== БАЗА ДАННЫХ ЗАКЛИНАНИЙ ==========
-SPELLS_DB = [
-    {"id": 1, "name": "Огненный шар", "level": 3},
-    {"id": 2, "name": "Лечение ран", "level": 1},
-    {"id": 3, "name": "Магическая защита", "level": 2},
-    {"id": 4, "name": "Молния", "level": 3},
-    {"id": 5, "name": "Невидимость", "level": 2},
-    {"id": 6, "name": "Телепортация", "level": 4},
-    {"id": 7, "name": "Воскрешение", "level": 5},
-    {"id": 8, "name": "Метеоритный дождь", "level": 5},
-    {"id": 9, "name": "Шаровая молния", "level": 3},
-    {"id": 10, "name": "Щит мага", "level": 2},
-    {"id": 11, "name": "Призыв элементаля", "level": 4},
-    {"id": 12, "name": "Рассеивание магии", "level": 3},
-    {"id": 13, "name": "Магический снаряд", "level": 1},
-    {"id": 14, "name": "Огненная стена", "level": 4},
-    {"id": 15, "name": "Ледяная буря", "level": 4},
-    {"id": 16, "name": "Полёт", "level": 3},
-    {"id": 17, "name": "Каменная кожа", "level": 3},
-    {"id": 18, "name": "Планарные врата", "level": 5},
-    {"id": 19, "name": "Слово силы", "level": 5},
-    {"id": 20, "name": "Пожирающая туча", "level": 4},
-]
+# ========== ПРОФИЛИРОВАНИЕ ==========
+# Функции streamlit, вызовы которых считаются выведенными элементами
+WIDGET_FUNCTIONS = ["button", "selectbox", "text_input", "checkbox", "download_button",
+                    "metric", "markdown", "write", "caption", "progress", "code",
+                    "title", "header", "subheader", "success", "info", "warning", "error",
+                    "columns", "expander", "dataframe", "bar_chart"]
+# Методы хранилища, вызовы которых считаются обращениями к общим данным
+LOOKUP_METHODS = ["get_block", "get_request", "find_request", "requests_with_status",
+                  "user_requests", "count_requests", "iter_blocks", "online_counts"]
+
+@st.cache_resource
+def get_profiler() -> RerunProfiler:
+    """Профайлер rerun, общий для всех сессий; счетчики подключаются, только если он включен"""
+    profiler = RerunProfiler(PROFILING)
+    if PROFILING:
+        profiler.count_widgets(st, WIDGET_FUNCTIONS)
+    return profiler
+
+profiler = get_profiler()
 
 # ========== ГЛОБАЛЬНЫЕ ДАННЫЕ ДЛЯ ВСЕХ ПОЛЬЗОВАТЕЛЕЙ ==========
-@st.cache_resource(ttl=600)
-def get_shared_data():
-    """Создает общие данные для ВСЕХ пользователей"""
-    return {
-        "spell_combinations": {},
-        "client_requests": [],
-        "game_blocks": [],
-        "last_request_id": 0,
-        "last_block_id": 0,
-        "users": {},
-        "last_global_update": time.time()
-    }
+def room_storage_path(room_code: str) -> str:
+    """Файл базы или каталог журнала комнаты; пустая строка - хранить только в памяти"""
+    if not DB_PATH:
+        return ""
+    path = room_db_path(DB_PATH, room_code)
+    if STORAGE == "journal":
+        return os.path.splitext(path)[0] + ".journal"
+    return path
+
+def create_room_store(room_code: str) -> SharedStore:
+    """Создает общие данные комнаты и загружает их из ее файла базы или журнала"""
+    path = room_storage_path(room_code)
+    if not path:
+        persistence = None
+    elif STORAGE == "journal":
+        persistence = JournalPersistence(path)
+    else:
+        persistence = SQLitePersistence(path, shared=MULTI_PROCESS)
+    store = SharedStore(persistence, presence_horizon=PRESENCE_HORIZON)
+    store.start_sweeper(PRESENCE_SWEEP_INTERVAL)
+    if profiler.enabled:
+        profiler.count_lookups(store, LOOKUP_METHODS)
+    return store
+
+@st.cache_resource
+def get_room_registry() -> RoomRegistry:
+    """Реестр комнат; комната по умолчанию - общий стол для всех"""
+    exists = (lambda code: os.path.exists(room_storage_path(code))) if DB_PATH else None
+    return RoomRegistry(create_room_store, exists)
+
+room_registry = get_room_registry()
+
+def get_shared_data() -> SharedStore:
+    """Общие данные комнаты текущей сессии (у каждой комнаты свое хранилище)"""
+    store = room_registry.get(st.session_state.get("room_code", DEFAULT_ROOM))
+    if store is None:
+        # Комната пропала (например, сервер без базы перезапустился) - возвращаемся за общий стол
+        st.session_state.room_code = DEFAULT_ROOM
+        store = room_registry.get(DEFAULT_ROOM)
+    return store
 
 shared_data = get_shared_data()
 
+@st.cache_resource
+def get_block_renderer(room_code: str) -> BlockRenderer:
+    """Кэш HTML кружков и строк блоков, общий для сессий комнаты (id блоков свои в каждой комнате)"""
+    return BlockRenderer(ELEMENTS, ELEMENT_SYMBOLS, ELEMENT_COLORS)
+
+block_renderer = get_block_renderer(st.session_state.get("room_code", DEFAULT_ROOM))
+
+@st.cache_resource
+def get_element_codec() -> ElementCodec:
+    """Кодирование комбинаций в счетчики элементов, общее для всех сессий"""
+    return ElementCodec(ELEMENTS)
+
+element_codec = get_element_codec()
+
+@st.cache_resource
+def get_rate_limiter() -> TokenBucketLimiter:
+    """Лимит частоты запросов игрока, общий для всех комнат процесса"""
+    return TokenBucketLimiter(REQUEST_RATE / 60, REQUEST_BURST)
+
+@st.cache_resource
+def get_game_engine(room_code: str) -> GameEngine:
+    """Правила игры поверх хранилища комнаты; перерывы попыток у каждой комнаты свои"""
+    engine = GameEngine(room_registry.get(room_code), element_codec, ELEMENT_SYMBOLS,
+                        retry_policy=CooldownPolicy(RETRY_COOLDOWN), rate_limiter=get_rate_limiter())
+    # Попытки, закончившиеся до перезапуска, тоже вернутся
+    engine.reschedule_retries()
+    return engine
+
+game_engine = get_game_engine(st.session_state.get("room_code", DEFAULT_ROOM))
+
+# ========== КАТАЛОГ ЗАКЛИНАНИЙ ==========
+@st.cache_resource
+def get_spell_catalog() -> SpellCatalog:
+    """Каталог заклинаний с индексами, загружается один раз на процесс"""
+    return load_catalog(SPELLS_PATH)
+
+spell_catalog = get_spell_catalog()
+
 # ========== ИНИЦИАЛИЗАЦИЯ СЕССИИ ПОЛЬЗОВАТЕЛЯ ==========
 def init_user_session():
     """Инициализация сессии для текущего пользователя"""
     if "user_id" not in st.session_state:
-        st.session_state.user_id = str(time.time()) + str(hash(str(time.time())))
+        st.session_state.user_id = new_session_id()
     
     if "user_name" not in st.session_state:
         st.session_state.user_name = f"Игрок_{int(time.time()) % 10000}"
@@ -85,17 +216,48 @@ def init_user_session():
     if "selected_spell" not in st.session_state:
         st.session_state.selected_spell = None
     
-    if st.session_state.user_id not in shared_data["users"]:
-        shared_data["users"][st.session_state.user_id] = {
-            "name": st.session_state.user_name,
-            "type": st.session_state.user_type,
-            "last_active": time.time()
-        }
+    shared_data.register_user(st.session_state.user_id, st.session_state.user_name,
+                              st.session_state.user_type, overwrite=False)
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def watch_shared_updates():
+    """
+    Легкий опрос: перезапускает страницу, только если версия общих данных
+    отличается от той, что была при последней отрисовке
+    """
+    shared_data.sync()
+    if shared_data.version != st.session_state.get("rendered_version"):
+        st.rerun(scope="app")
+
+def shared_fragment(func):
+    """
+    st.fragment для панелей, меняющих общие данные. Отдельный rerun фрагмента не доходит
+    до main(), поэтому изменения сохраняются при каждом выходе из фрагмента, в том числе через st.rerun().
+    Версию, созданную собственным действием фрагмента, считаем уже показанной, чтобы
+    watch_shared_updates не перерисовывал ради нее всю страницу; если до действия были
+    чужие изменения, отметка не сдвигается и страница обновится полностью
+    """
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        before = shared_data.version
+        try:
+            return func(*args, **kwargs)
+        finally:
+            shared_data.flush()
+            if before == st.session_state.get("rendered_version"):
+                st.session_state.rendered_version = shared_data.version
+    return st.fragment(run)
+
+def rerun_fragment():
+    """Перезапускает только текущий фрагмент; вне фрагментного запуска - всю страницу"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
 def update_user_activity():
     """Обновляет время активности пользователя"""
-    if st.session_state.user_id in shared_data["users"]:
-        shared_data["users"][st.session_state.user_id]["last_active"] = time.time()
+    shared_data.touch_user(st.session_state.user_id)
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 def format_element_option(element: str) -> str:
@@ -111,7 +273,38 @@ def parse_element_option(option: str) -> str:
 
 def create_element_display(elements: List[str]) -> str:
     """Создает строку для отображения комбинации элементов"""
-    return " + ".join([ELEMENT_SYMBOLS.get(e, "❓") for e in elements])
+    return game_engine.display(elements)
+
+def take_page(items: Iterable, list_key: str) -> Tuple[List, bool]:
+    """
+    Берет из ленивого списка только видимую порцию.
+    Возвращает элементы и признак, что за ними есть еще
+    """
+    limit = st.session_state.get(f"{list_key}_limit", PAGE_SIZE)
+    page = list(itertools.islice(items, limit + 1))
+    return page[:limit], len(page) > limit
+
+def show_more_button(list_key: str, has_more: bool):
+    """Кнопка "Показать еще" под списком: увеличивает порцию на PAGE_SIZE"""
+    if has_more and st.button("⬇️ Показать еще", key=f"{list_key}_more", use_container_width=True):
+        st.session_state[f"{list_key}_limit"] = st.session_state.get(f"{list_key}_limit", PAGE_SIZE) + PAGE_SIZE
+        st.rerun()
+
+def search_blocks(query: str) -> Iterable[Dict]:
+    """Блоки, подходящие под поиск, в порядке релевантности"""
+    for spell_name in shared_data.block_index.search(query, limit=SEARCH_LIMIT):
+        block = shared_data.get_block(spell_name)
+        if block:
+            yield block
+
+def block_search_controls(search_label: str, placeholder: str, key_prefix: str) -> Tuple[str, str]:
+    """Поле поиска и выбор сортировки для списков игровых блоков"""
+    col_search, col_sort = st.columns([2, 1])
+    with col_search:
+        search = st.text_input(search_label, placeholder=placeholder, key=f"{key_prefix}_search")
+    with col_sort:
+        sort_label = st.selectbox("Сортировка", list(BLOCK_SORT_OPTIONS), key=f"{key_prefix}_sort")
+    return search, BLOCK_SORT_OPTIONS[sort_label]
 
 def check_guessed_elements(player_guesses: List[str], actual_elements: List[str]) -> List[str]:
     """
@@ -124,84 +317,30 @@ def check_guessed_elements(player_guesses: List[str], actual_elements: List[str]
         Игрок: 🔥+🔥 → откроет 2 🔥
         Игрок: 🔥+❄️+🔥 → откроет 2 🔥
     """
-    guessed = []
-    
-    # Создаем копии для работы
-    player_copy = player_guesses.copy()
-    actual_copy = actual_elements.copy()
-    
-    # Проходим по каждому элементу игрока
-    for player_element in player_copy:
-        # Проверяем, есть ли такой элемент в оставшихся правильных элементах
-        if player_element in actual_copy:
-            guessed.append(player_element)
-            # Удаляем угаданный элемент из правильных
-            actual_copy.remove(player_element)
-    
-    return guessed
+    return game_engine.match(player_guesses, actual_elements)
 
 def get_or_create_game_block(spell_name: str, level: int, user_name: str = "Система") -> Dict:
     """Создает игровой блок. Всегда создает новый или возвращает существующий"""
-    # Ищем существующий блок
-    for block in shared_data["game_blocks"]:
-        if block['spell_name'] == spell_name:
-            return block
-    
-    # Получаем комбинацию
-    spell_combo = shared_data["spell_combinations"].get(spell_name, {})
-    
-    # Создаем новый блок
-    new_block = {
-        "id": shared_data["last_block_id"] + 1,
-        "spell_name": spell_name,
-        "level": level,
-        "combination": create_element_display(spell_combo.get('elements', ['?'] * level)),
-        "elements": spell_combo.get('elements', ['?'] * level),
-        "guessed": [],
-        "attempts": 0,
-        "max_attempts": 1,
-        "is_active": True,
-        "created_by": user_name,
-        "created_at": datetime.now().strftime("%H:%M:%S"),
-        "last_played": None
-    }
-    shared_data["last_block_id"] += 1
-    shared_data["game_blocks"].append(new_block)
-    return new_block
+    return game_engine.start_game(spell_name, level, user_name)
 
 def create_repeat_request(spell_name: str, level: int, user_name: str, user_id: str):
-    """Создает запрос на повторную попытку"""
-    new_request = {
-        "id": shared_data["last_request_id"] + 1,
-        "user_name": user_name,
-        "user_id": user_id,
-        "spell_name": spell_name,
-        "level": level,
-        "timestamp": datetime.now().strftime("%H:%M:%S"),
-        "status": "ожидает",
-        "type": "повтор"
-    }
-    shared_data["last_request_id"] += 1
-    shared_data["client_requests"].append(new_request)
-    return new_request
+    """Создает запрос на повторную попытку; None, если он уже отправлен или превышен лимит частоты"""
+    return game_engine.request_retry(user_id, user_name, spell_name)
 
 def create_new_request(spell_name: str, level: int, user_name: str, user_id: str):
-    """Создает новый запрос на заклинание"""
-    new_request = {
-        "id": shared_data["last_request_id"] + 1,
-        "user_name": user_name,
-        "user_id": user_id,
-        "spell_name": spell_name,
-        "level": level,
-        "timestamp": datetime.now().strftime("%H:%M:%S"),
-        "status": "ожидает",
-        "type": "новый"
-    }
-    shared_data["last_request_id"] += 1
-    shared_data["client_requests"].append(new_request)
-    return new_request
+    """Создает новый запрос на заклинание; None, если комбинация есть, запрос ожидает или превышен лимит частоты"""
+    return game_engine.request_combo(user_id, user_name, spell_name, level)
 
 # ========== РЕГИСТРАЦИЯ И ВХОД ==========
+def enter_room(room_code: str, room_store: SharedStore, user_name: str, user_type: str):
+    """Переводит сессию в комнату: пользователь регистрируется в ее хранилище"""
+    if room_store is not shared_data:
+        shared_data.remove_user(st.session_state.user_id)
+    st.session_state.room_code = room_code
+    st.session_state.user_name = user_name
+    st.session_state.user_type = user_type
+    room_store.register_user(st.session_state.user_id, user_name, user_type)
+
 def registration_interface():
     """Интерфейс регистрации и входа"""
     st.title("⚔️ D&D Spell Caster - Выберите роль")
@@ -211,39 +350,54 @@ def registration_interface():
     with col1:
         st.markdown("### 🎮 Стать Игроком")
         player_name = st.text_input("Введите имя персонажа", key="reg_player_name")
+        room_code = st.text_input("Код комнаты (пусто - общий стол)", key="reg_room_code")
         
         if st.button("🎮 **Войти как Игрок**", 
                     use_container_width=True, 
                     type="primary"):
             if player_name:
-                st.session_state.user_name = player_name
-                st.session_state.user_type = "player"
-                shared_data["users"][st.session_state.user_id] = {
-                    "name": player_name,
-                    "type": "player",
-                    "last_active": time.time()
-                }
-                st.rerun()
+                try:
+                    room_code = normalize_code(room_code)
+                except ValueError as error:
+                    st.error(f"❌ {error}")
+                else:
+                    room_store = room_registry.get(room_code)
+                    if room_store is None:
+                        st.error("❌ Комната не найдена")
+                    else:
+                        enter_room(room_code, room_store, player_name, "player")
+                        st.rerun()
     
     with col2:
         st.markdown("### 👑 Стать Мастером")
         host_name = st.text_input("Введите имя Мастера", key="reg_host_name")
         host_password = st.text_input("Секретный пароль", type="password", key="reg_host_pass")
+        new_room = st.checkbox("🆕 Создать отдельную комнату", key="reg_new_room")
+        # Мастер возвращается в созданную раньше комнату по ее коду (после выхода или в другом браузере)
+        host_room_code = st.text_input("Код своей комнаты (пусто - общий стол)", key="reg_host_room_code",
+                                       disabled=new_room)
         
         if st.button("👑 **Войти как Мастер**", 
                     use_container_width=True):
             if host_name and host_password:
-                if host_password == HOST_PASSWORD:
-                    st.session_state.user_name = host_name
-                    st.session_state.user_type = "host"
-                    shared_data["users"][st.session_state.user_id] = {
-                        "name": host_name,
-                        "type": "host",
-                        "last_active": time.time()
-                    }
+                if host_password != HOST_PASSWORD:
+                    st.error("❌ Неверные данные доступа")
+                elif new_room:
+                    room_code = room_registry.create(host_name)
+                    enter_room(room_code, room_registry.get(room_code), host_name, "host")
                     st.rerun()
                 else:
-                    st.error("❌ Неверные данные доступа")
+                    try:
+                        room_code = normalize_code(host_room_code)
+                    except ValueError as error:
+                        st.error(f"❌ {error}")
+                    else:
+                        room_store = room_registry.get(room_code)
+                        if room_store is None:
+                            st.error("❌ Комната не найдена")
+                        else:
+                            enter_room(room_code, room_store, host_name, "host")
+                            st.rerun()
     
     st.markdown("---")
     st.markdown("""
@@ -263,6 +417,32 @@ def registration_interface():
     """)
 
 # ========== ФУНКЦИИ ДЛЯ ХОСТА ==========
+def show_profiling_panel():
+    """Замеры rerun (если включены через DND_PROFILING=1) и cProfile одного rerun"""
+    st.markdown("---")
+    st.write("**⏱️ Профилирование**")
+    
+    if profiler.enabled:
+        summary = profiler.summary()
+        if summary:
+            st.dataframe(summary, hide_index=True)
+            metric = st.selectbox("Гистограмма", profiler.metrics(), key="profiling_metric")
+            histogram = profiler.histogram(metric)
+            st.bar_chart({"замеров": {label: count for label, count in histogram}})
+            st.download_button("💾 Экспорт в JSON", json.dumps(profiler.export(), ensure_ascii=False),
+                               file_name="dnd_profile.json", mime="application/json")
+        else:
+            st.caption("Замеров пока нет")
+    else:
+        st.caption("Замеры секций выключены (DND_PROFILING=1 включает их)")
+    
+    if st.button("📸 cProfile следующего rerun", key="capture_profile_btn"):
+        st.session_state.capture_profile = True
+        st.rerun()
+    last_profile = st.session_state.get("last_profile")
+    if last_profile and last_profile.get("text"):
+        st.code(last_profile["text"], language=None)
+
 def host_interface():
     """Интерфейс хоста"""
     update_user_activity()
@@ -273,13 +453,15 @@ def host_interface():
     with st.expander("📡 Онлайн-статистика", expanded=False):
         col1, col2, col3 = st.columns(3)
         with col1:
-            active_users = [u for u in shared_data["users"].values() 
-                          if time.time() - u["last_active"] < 300]
-            st.metric("👥 Онлайн", len(active_users))
+            online = shared_data.online_counts(ONLINE_WINDOW)
+            st.metric("👥 Онлайн", sum(online.values()))
         with col2:
-            st.metric("🎮 Игроков", len([u for u in active_users if u["type"] == "player"]))
+            st.metric("🎮 Игроков", online.get("player", 0))
         with col3:
             st.metric("🕒 Обновление", datetime.now().strftime("%H:%M:%S"))
+        st.caption(f"Открыто комнат на сервере: {len(room_registry.rooms())}")
+        
+        show_profiling_panel()
     
     # Переключение режимов
     col_view1, col_view2 = st.columns(2)
@@ -295,186 +477,372 @@ def host_interface():
             st.rerun()
     
     if st.session_state.get("show_client_table", False):
-        display_client_table_for_host()
+        with profiler.section("client_table"):
+            display_client_table_for_host()
         return
     
     # Основная панель мастера
     st.header("🔮 Управление комбинациями")
     
-    # Общая статистика
-    col1, col2, col3 = st.columns(3)
+    # Общая статистика - готовые счетчики хранилища
+    stats = shared_data.metrics.snapshot()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("📦 Игровых блоков", stats.get(BLOCKS, 0))
+    with col2:
+        st.metric("📨 Ожидают", stats.get(PENDING, 0))
+    with col3:
+        st.metric("✅ Обработано", stats.get(PROCESSED, 0))
+    with col4:
+        st.metric("🧩 Комбинаций", stats.get(COMBOS, 0))
+    
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("📦 Игровых блоков", len(shared_data["game_blocks"]))
+        st.metric("🏆 Решено заклинаний", stats.get(SOLVED, 0))
     with col2:
-        active_requests = len([r for r in shared_data["client_requests"] if r['status'] == 'ожидает'])
-        st.metric("📨 Ожидают", active_requests)
+        average = stats["average_attempts"]
+        st.metric("🎯 Попыток на решение", "—" if average is None else f"{average:.1f}")
     with col3:
-        st.metric("🧩 Комбинаций", len(shared_data["spell_combinations"]))
+        st.metric("⏱️ Запросов в минуту", f"{stats['requests_per_minute']:.1f}")
+    with col4:
+        st.metric("⛔ Отклонено запросов", stats.get(REJECTED_RATE, 0) + stats.get(REJECTED_DUPLICATE, 0),
+                  help=f"Сверх лимита: {stats.get(REJECTED_RATE, 0)}, повторы ожидающих: {stats.get(REJECTED_DUPLICATE, 0)}")
+    
+    offenders = shared_data.metrics.top_rejected(5)
+    if offenders:
+        names = []
+        for user_id, count in offenders:
+            user = shared_data.presence.get(user_id)
+            names.append(f"{user['name'] if user else user_id[:8]} - {count}")
+        st.caption(f"⛔ Больше всего отклонено: {', '.join(names)}")
+    
+    host_bulk_panel()
+    host_retry_panel()
+    host_transfer_panel()
     
     # Разделение на две колонки
     requests_col, combos_col = st.columns(2)
     
-    with requests_col:
+    with requests_col, profiler.section("host_requests"):
         st.subheader("📨 Запросы игроков")
         
-        pending_requests = [r for r in shared_data["client_requests"] if r['status'] == 'ожидает']
-        
-        if not pending_requests:
+        if not stats.get(PENDING, 0):
             st.info("Нет ожидающих запросов")
         else:
-            for req in pending_requests[:]:
-                with st.expander(f"{'🔄' if req['type'] == 'повтор' else '🔔'} {req['spell_name']} (Ур. {req['level']})", expanded=True):
-                    
-                    if req['type'] == 'повтор':
-                        st.warning(f"**ПОВТОРНЫЙ ЗАПРОС** от {req['user_name']}")
-                    else:
-                        st.write(f"**Игрок:** {req['user_name']}")
-                    
-                    st.write(f"**Тип:** {'Повторная попытка' if req['type'] == 'повтор' else 'Новый запрос'}")
-                    st.write(f"**Время:** {req['timestamp']}")
-                    
-                    existing_combo = shared_data["spell_combinations"].get(req['spell_name'])
-                    
-                    if existing_combo:
-                        st.success(f"✅ Комбинация существует: {create_element_display(existing_combo['elements'])}")
-                        
-                        if st.button("✅ Отметить как обработанный", key=f"process_{req['id']}", use_container_width=True):
-                            req['status'] = 'обработан'
-                            st.rerun()
-                    else:
-                        st.warning("❌ Комбинация не найдена")
-                        
-                        st.write("**Создать комбинацию:**")
-                        
-                        num_elements = req['level']
-                        combo_cols = st.columns(min(4, num_elements))
-                        new_combo = []
-                        
-                        for i in range(num_elements):
-                            with combo_cols[i % 4]:
-                                formatted_elements = [format_element_option(e) for e in ELEMENTS]
-                                element_option = st.selectbox(
-                                    f"Элемент {i+1}",
-                                    formatted_elements,
-                                    key=f"host_new_{req['id']}_{i}"
-                                )
-                                element = parse_element_option(element_option)
-                                new_combo.append(element)
-                        
-                        col_save, col_reject = st.columns(2)
-                        with col_save:
-                            if st.button("💾 Сохранить комбинацию", key=f"save_{req['id']}", use_container_width=True, type="primary"):
-                                shared_data["spell_combinations"][req['spell_name']] = {
-                                    "combination": create_element_display(new_combo),
-                                    "elements": new_combo
-                                }
-                                
-                                # Обновляем существующий блок
-                                for block in shared_data["game_blocks"]:
-                                    if block['spell_name'] == req['spell_name']:
-                                        block['combination'] = create_element_display(new_combo)
-                                        block['elements'] = new_combo
-                                        break
-                                
-                                req['status'] = 'обработан'
-                                st.rerun()
-                        
-                        with col_reject:
-                            if st.button("❌ Удалить запрос", key=f"reject_{req['id']}", use_container_width=True):
-                                shared_data["client_requests"] = [r for r in shared_data["client_requests"] if r['id'] != req['id']]
-                                st.rerun()
+            pending_requests, has_more = take_page(iter(shared_data.requests_with_status(STATUS_PENDING)),
+                                                   "host_requests")
+            for req in pending_requests:
+                host_request_panel(req)
+            show_more_button("host_requests", has_more)
     
-    with combos_col:
+    with combos_col, profiler.section("host_combos"):
         st.subheader("🧩 Существующие комбинации")
         
-        if not shared_data["spell_combinations"]:
+        if not shared_data.spell_combinations:
             st.info("Нет созданных комбинаций")
         else:
             search_combo = st.text_input("🔍 Поиск комбинации", placeholder="Введите название заклинания...", key="host_combo_search")
             
-            filtered_combos = list(shared_data["spell_combinations"].items())
+            filtered_combos = iter(list(shared_data.spell_combinations))
             if search_combo:
-                filtered_combos = [(k, v) for k, v in filtered_combos if search_combo.lower() in k.lower()]
+                filtered_combos = iter(shared_data.combo_index.search(search_combo, limit=SEARCH_LIMIT))
             
-            for spell_name, combo_data in filtered_combos:
-                with st.expander(f"🔮 {spell_name} - {combo_data['combination']}", expanded=False):
-                    block = None
-                    for b in shared_data["game_blocks"]:
-                        if b['spell_name'] == spell_name:
-                            block = b
-                            break
-                    
-                    if block:
-                        st.write(f"**Статус:** {'🎮 Активна' if block['attempts'] < block['max_attempts'] else '⏳ Ожидает повторного запроса'}")
-                        st.write(f"**Угадано:** {len(block['guessed'])}/{block['level']} элементов")
-                        st.write(f"**Создал:** {block['created_by']}")
-                    else:
-                        st.warning("⚠️ Игровой блок не создан")
-                    
-                    st.write("**Редактировать комбинацию:**")
-                    
-                    num_elements = len(combo_data['elements'])
-                    edit_cols = st.columns(min(4, num_elements))
-                    edited_combo = []
-                    
-                    for i in range(num_elements):
-                        with edit_cols[i % 4]:
-                            current_element = combo_data['elements'][i]
-                            formatted_elements = [format_element_option(e) for e in ELEMENTS]
-                            element_option = st.selectbox(
-                                f"Эл. {i+1}",
-                                formatted_elements,
-                                index=ELEMENTS.index(current_element) if current_element in ELEMENTS else 0,
-                                key=f"edit_combo_{spell_name}_{i}"
-                            )
-                            element = parse_element_option(element_option)
-                            edited_combo.append(element)
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        if st.button("💾 Обновить", key=f"update_{spell_name}", use_container_width=True):
-                            shared_data["spell_combinations"][spell_name] = {
-                                "combination": create_element_display(edited_combo),
-                                "elements": edited_combo
-                            }
-                            
-                            if block:
-                                block['combination'] = create_element_display(edited_combo)
-                                block['elements'] = edited_combo
-                            
-                            st.rerun()
-                    
-                    with col2:
-                        if st.button("🔄 Сбросить прогресс", key=f"reset_{spell_name}", use_container_width=True):
-                            if block:
-                                block['attempts'] = 0
-                                block['guessed'] = []
-                            st.rerun()
-                    
-                    with col3:
-                        if st.button("🗑️ Удалить всё", key=f"delete_{spell_name}", use_container_width=True):
-                            del shared_data["spell_combinations"][spell_name]
-                            shared_data["game_blocks"] = [b for b in shared_data["game_blocks"] 
-                                                          if b['spell_name'] != spell_name]
-                            shared_data["client_requests"] = [r for r in shared_data["client_requests"] 
-                                                            if r['spell_name'] != spell_name]
-                            st.rerun()
+            combo_page, has_more = take_page(filtered_combos, "host_combos")
+            for spell_name in combo_page:
+                host_combo_panel(spell_name)
+            show_more_button("host_combos", has_more)
+
+@shared_fragment
+def host_bulk_panel():
+    """Массовая генерация: параметры собраны в форму, генерация и предпросмотр перезапускают только панель"""
+    preview = st.session_state.get("bulk_preview")
+    with st.expander("🎲 Массовая генерация комбинаций", expanded=preview is not None):
+        if st.session_state.get("bulk_message"):
+            st.success(st.session_state.pop("bulk_message"))
+        
+        with st.form("bulk_generate"):
+            source = st.radio("Для чего создать комбинации", [BULK_ALL_SPELLS, BULK_PENDING], horizontal=True)
+            seed = st.number_input("🎲 Зерно генератора", min_value=0, value=0, step=1)
+            allowed = st.multiselect("Разрешенные элементы", ELEMENTS, default=ELEMENTS,
+                                     format_func=format_element_option)
+            st.caption("Сколько раз один элемент может повторяться в комбинации каждого уровня:")
+            repeats = st.data_editor([{"Уровень": level, "Повторов": level} for level in range(1, MAX_LEVEL + 1)],
+                                     disabled=["Уровень"], hide_index=True, key="bulk_repeats",
+                                     column_config={"Повторов": st.column_config.NumberColumn(
+                                         min_value=1, max_value=MAX_LEVEL, step=1, required=True)})
+            unique = st.checkbox("Без одинаковых комбинаций у разных заклинаний", value=True)
+            overwrite = st.checkbox("Перезаписать существующие комбинации", value=False)
+            generate = st.form_submit_button("🎲 Сгенерировать", type="primary", use_container_width=True)
+        
+        if generate:
+            if source == BULK_ALL_SPELLS:
+                spells = [(spell['name'], spell['level']) for spell in spell_catalog.spells()]
+            else:
+                spells = [(req['spell_name'], req['level']) for req in shared_data.requests_with_status(STATUS_PENDING)
+                          if req['type'] == REQUEST_NEW]
+            if not allowed:
+                st.error("Выберите хотя бы один элемент")
+            else:
+                preview = game_engine.generate_combos(
+                    spells, int(seed), allowed, {row["Уровень"]: int(row["Повторов"]) for row in repeats},
+                    unique, overwrite)
+                st.session_state.bulk_preview = preview
+        
+        if preview is None:
+            return
+        if preview.skipped:
+            st.warning(f"Не удалось подобрать уникальную комбинацию: {', '.join(preview.skipped)}")
+        if not preview.combos:
+            st.info("Нет заклинаний без комбинации")
+            return
+        st.dataframe([{"Заклинание": name, "Ур.": preview.levels[name],
+                       "Комбинация": create_element_display(elements)}
+                      for name, elements in preview.combos.items()], hide_index=True)
+        
+        col_commit, col_cancel = st.columns(2)
+        with col_commit:
+            if st.button(f"✅ Сохранить все ({len(preview.combos)})", key="bulk_commit",
+                         use_container_width=True, type="primary"):
+                processed = game_engine.commit_combos(preview.combos)
+                del st.session_state.bulk_preview
+                st.session_state.bulk_message = (f"Сохранено комбинаций: {len(preview.combos)}, "
+                                                 f"обработано запросов: {processed}")
+                # Комбинации и запросы видны во всей панели мастера - перерисовываем страницу один раз
+                st.rerun()
+        with col_cancel:
+            if st.button("✖️ Отменить", key="bulk_cancel", use_container_width=True):
+                del st.session_state.bulk_preview
+                rerun_fragment()
+
+def cooldown_overrides(rows: Iterable[Dict], key: str) -> Dict:
+    """Строки редактора перерывов -> {ключ: секунды или None (только по запросу)}; пустые строки пропускаются"""
+    overrides = {}
+    for row in rows:
+        name, seconds = row.get(key), row.get("Перерыв, с")
+        if name is None or name == "":
+            continue
+        if row.get("Только по запросу"):
+            overrides[name] = None
+        elif seconds is not None and seconds == seconds:    # пустая ячейка может прийти как NaN
+            overrides[name] = float(seconds)
+    return overrides
+
+@shared_fragment
+def host_retry_panel():
+    """Перерывы автоматического возврата попыток для комнаты; сохранение перезапускает только панель"""
+    policy = game_engine.retries.policy
+    with st.expander("⏱️ Автоматические попытки", expanded=False):
+        if st.session_state.get("retry_message"):
+            st.success(st.session_state.pop("retry_message"))
+        st.caption(f"Ожидают возврата попытки: {game_engine.retries.pending()}")
+        
+        with st.form("retry_policy"):
+            automatic = st.checkbox("Возвращать попытки автоматически", value=policy.default is not None)
+            default = st.number_input("Перерыв по умолчанию, секунд", min_value=0.0, step=10.0,
+                                      value=float(policy.default if policy.default is not None else RETRY_COOLDOWN or 60))
+            st.caption("Свой перерыв для уровня (пустая ячейка - по умолчанию):")
+            cooldown_column = st.column_config.NumberColumn(min_value=0, step=10)
+            levels = st.data_editor([{"Уровень": level, "Перерыв, с": policy.per_level.get(level),
+                                      "Только по запросу": level in policy.per_level and policy.per_level[level] is None}
+                                     for level in range(1, MAX_LEVEL + 1)],
+                                    disabled=["Уровень"], hide_index=True, key="retry_levels",
+                                    column_config={"Перерыв, с": cooldown_column})
+            st.caption("Свой перерыв для заклинания (важнее уровня):")
+            blocks = st.data_editor([{"Заклинание": name, "Перерыв, с": seconds, "Только по запросу": seconds is None}
+                                     for name, seconds in policy.per_block.items()]
+                                    or [{"Заклинание": "", "Перерыв, с": None, "Только по запросу": False}],
+                                    num_rows="dynamic", hide_index=True, key="retry_blocks",
+                                    column_config={"Заклинание": st.column_config.TextColumn(),
+                                                   "Перерыв, с": cooldown_column})
+            save = st.form_submit_button("💾 Сохранить", type="primary", use_container_width=True)
+        
+        if save:
+            game_engine.set_retry_policy(CooldownPolicy(
+                float(default) if automatic else None,
+                cooldown_overrides(levels, "Уровень"),
+                cooldown_overrides(blocks, "Заклинание")))
+            st.session_state.retry_message = f"Сохранено, запланировано возвратов: {game_engine.retries.pending()}"
+            rerun_fragment()
+
+@shared_fragment
+def host_transfer_panel():
+    """Импорт и экспорт: файл выгрузки собирается только по нажатию, загрузка читается построчно"""
+    with st.expander("💾 Импорт и экспорт", expanded=False):
+        report = st.session_state.pop("import_report", None)
+        if report is not None:
+            imported = ", ".join(f"{TRANSFER_KIND_LABELS[kind]}: {count}" for kind, count in report.imported.items())
+            st.success(f"Импортировано - {imported}")
+            if report.rejected:
+                st.warning(f"Отклонено записей: {report.rejected}")
+                st.code("\n".join(report.errors), language=None)
+        
+        export_col, import_col = st.columns(2)
+        with export_col:
+            st.write("**Экспорт**")
+            file_format = st.radio("Формат", [FORMAT_JSONL, FORMAT_CSV], horizontal=True, key="export_format")
+            store = shared_data
+            if file_format == FORMAT_JSONL:
+                kinds = st.multiselect("Что выгрузить", KINDS, default=list(KINDS),
+                                       format_func=TRANSFER_KIND_LABELS.get, key="export_kinds")
+                # Функция вызывается только при скачивании и в отдельном потоке, rerun ее не ждет.
+                # Выгрузка пишется во временный файл по записи, но готовый файл Streamlit
+                # отдает из памяти, поэтому его размер ограничен памятью сервера
+                data = lambda: spool(to_jsonl(export_records(store, kinds)))
+                file_name, mime = "dnd_table.jsonl", "application/jsonl"
+            else:
+                kind = st.selectbox("Что выгрузить (в CSV - один вид на файл)", KINDS,
+                                    format_func=TRANSFER_KIND_LABELS.get, key="export_csv_kind")
+                data = lambda: spool(to_csv(export_records(store, [kind]), kind))
+                file_name, mime = f"dnd_{kind}.csv", "text/csv"
+            st.download_button("⬇️ Скачать", data, file_name=file_name, mime=mime,
+                               use_container_width=True, key="export_download")
+        
+        with import_col:
+            st.write("**Импорт**")
+            uploaded = st.file_uploader("Файл JSON Lines или CSV", type=["jsonl", "csv"], key="import_file")
+            kind = None
+            if uploaded is not None and uploaded.name.lower().endswith(".csv"):
+                kind = st.selectbox("Что в файле", KINDS, format_func=TRANSFER_KIND_LABELS.get, key="import_csv_kind")
+            if uploaded is not None and st.button("⬆️ Импортировать", key="import_run",
+                                                  use_container_width=True, type="primary"):
+                lines = io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline="")
+                validator = RecordValidator(ELEMENTS, spell_catalog)
+                st.session_state.import_report = import_records(
+                    game_engine, read_file(lines, uploaded.name, kind), validator, uploaded.name)
+                # Новые комбинации, блоки и запросы видны во всей панели мастера
+                st.rerun()
+
+@shared_fragment
+def host_request_panel(req: Dict):
+    """Панель запроса игрока: выбор элементов и кнопки перезапускают только ее"""
+    # Запрос мог быть обработан или удален, пока панель была на экране
+    if shared_data.get_request(req['id']) is None or req['status'] != STATUS_PENDING:
+        return
+    
+    with st.expander(f"{'🔄' if req['type'] == 'повтор' else '🔔'} {req['spell_name']} (Ур. {req['level']})", expanded=True):
+        
+        if req['type'] == 'повтор':
+            st.warning(f"**ПОВТОРНЫЙ ЗАПРОС** от {req['user_name']}")
+        else:
+            st.write(f"**Игрок:** {req['user_name']}")
+        
+        st.write(f"**Тип:** {'Повторная попытка' if req['type'] == 'повтор' else 'Новый запрос'}")
+        st.write(f"**Время:** {format_time(req['timestamp'])}")
+        
+        existing_combo = shared_data.spell_combinations.get(req['spell_name'])
+        
+        if existing_combo:
+            st.success(f"✅ Комбинация существует: {create_element_display(existing_combo['elements'])}")
+            
+            if st.button("✅ Отметить как обработанный", key=f"process_{req['id']}", use_container_width=True):
+                game_engine.process_request(req)
+                rerun_fragment()
+        else:
+            st.warning("❌ Комбинация не найдена")
+            
+            st.write("**Создать комбинацию:**")
+            
+            num_elements = req['level']
+            combo_cols = st.columns(min(4, num_elements))
+            new_combo = []
+            
+            for i in range(num_elements):
+                with combo_cols[i % 4]:
+                    formatted_elements = [format_element_option(e) for e in ELEMENTS]
+                    element_option = st.selectbox(
+                        f"Элемент {i+1}",
+                        formatted_elements,
+                        key=f"host_new_{req['id']}_{i}"
+                    )
+                    element = parse_element_option(element_option)
+                    new_combo.append(element)
+            
+            col_save, col_reject = st.columns(2)
+            with col_save:
+                if st.button("💾 Сохранить комбинацию", key=f"save_{req['id']}", use_container_width=True, type="primary"):
+                    # Сохраняем и обновляем существующий блок
+                    game_engine.process_request(req, new_combo)
+                    rerun_fragment()
+            
+            with col_reject:
+                if st.button("❌ Удалить запрос", key=f"reject_{req['id']}", use_container_width=True):
+                    game_engine.reject_request(req)
+                    rerun_fragment()
+
+@shared_fragment
+def host_combo_panel(spell_name: str):
+    """Редактор комбинации: выбор элементов и кнопки перезапускают только его"""
+    combo_data = shared_data.spell_combinations.get(spell_name)
+    if combo_data is None:
+        return
+    
+    with st.expander(f"🔮 {spell_name} - {combo_data['combination']}", expanded=False):
+        block = shared_data.get_block(spell_name)
+        
+        if block:
+            retry_at = game_engine.retry_due(spell_name)
+            if retry_at is not None:
+                st.write(f"**Статус:** ⏳ Попытка вернется в {format_time(retry_at)}")
+            else:
+                st.write(f"**Статус:** {'🎮 Активна' if block['attempts'] < block['max_attempts'] else '⏳ Ожидает повторного запроса'}")
+            st.write(f"**Угадано:** {len(block['guessed'])}/{block['level']} элементов")
+            st.write(f"**Создал:** {block['created_by']}")
+        else:
+            st.warning("⚠️ Игровой блок не создан")
+        
+        st.write("**Редактировать комбинацию:**")
+        
+        num_elements = len(combo_data['elements'])
+        edit_cols = st.columns(min(4, num_elements))
+        edited_combo = []
+        
+        for i in range(num_elements):
+            with edit_cols[i % 4]:
+                current_element = combo_data['elements'][i]
+                formatted_elements = [format_element_option(e) for e in ELEMENTS]
+                element_option = st.selectbox(
+                    f"Эл. {i+1}",
+                    formatted_elements,
+                    index=ELEMENTS.index(current_element) if current_element in ELEMENTS else 0,
+                    key=f"edit_combo_{spell_name}_{i}"
+                )
+                element = parse_element_option(element_option)
+                edited_combo.append(element)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("💾 Обновить", key=f"update_{spell_name}", use_container_width=True):
+                game_engine.save_combo(spell_name, edited_combo)
+                
+                rerun_fragment()
+        
+        with col2:
+            if st.button("🔄 Сбросить прогресс", key=f"reset_{spell_name}", use_container_width=True):
+                game_engine.reset_progress(spell_name)
+                rerun_fragment()
+        
+        with col3:
+            if st.button("🗑️ Удалить всё", key=f"delete_{spell_name}", use_container_width=True):
+                game_engine.delete_spell(spell_name)
+                rerun_fragment()
 
 def display_client_table_for_host():
     """Отображение стола клиентов для хоста"""
     st.title("🎮 Стол игроков (режим просмотра)")
     
-    if not shared_data["game_blocks"]:
+    if not shared_data.block_count():
         st.info("Нет активных игр")
         return
     
-    search_game = st.text_input("🔍 Поиск игры", placeholder="Введите название заклинания...", key="host_game_search")
+    search_game, order = block_search_controls("🔍 Поиск игры", "Введите название заклинания...", "host_game")
     
-    filtered_games = shared_data["game_blocks"]
+    # Без поиска - выбранная сортировка, с поиском - по релевантности
+    filtered_games = shared_data.iter_blocks(order)
     if search_game:
-        filtered_games = [b for b in filtered_games if search_game.lower() in b['spell_name'].lower()]
+        filtered_games = search_blocks(search_game)
     
-    for block in filtered_games:
+    games_page, has_more = take_page(filtered_games, "host_games")
+    for block in games_page:
         with st.container():
             st.markdown("---")
             
@@ -491,35 +859,9 @@ def display_client_table_for_host():
             
             st.write("**Прогресс игроков:**")
             
-            element_cols = st.columns(block['level'])
-            for i in range(block['level']):
-                with element_cols[i]:
-                    if i < len(block['guessed']):
-                        element = block['guessed'][i]
-                        color = ELEMENT_COLORS.get(element, "#CCCCCC")
-                        symbol = ELEMENT_SYMBOLS.get(element, "❓")
-                        
-                        st.markdown(
-                            f'<div style="background-color: {color}; padding: 10px; border-radius: 50%; '
-                            f'width: 50px; height: 50px; display: flex; align-items: center; '
-                            f'justify-content: center; margin: 0 auto; border: 3px solid #06D6A0;">'
-                            f'<span style="font-size: 1.2em;">{symbol}</span></div>',
-                            unsafe_allow_html=True
-                        )
-                        st.caption(f"✓ {element}")
-                    else:
-                        actual_element = block['elements'][i]
-                        color = ELEMENT_COLORS.get(actual_element, "#CCCCCC")
-                        symbol = ELEMENT_SYMBOLS.get(actual_element, "❓")
-                        
-                        st.markdown(
-                            f'<div style="background-color: {color}; padding: 10px; border-radius: 50%; '
-                            f'width: 50px; height: 50px; display: flex; align-items: center; '
-                            f'justify-content: center; margin: 0 auto; border: 2px dashed #666; opacity: 0.6;">'
-                            f'<span style="font-size: 1.2em;">{symbol}</span></div>',
-                            unsafe_allow_html=True
-                        )
-                        st.caption(f"? {actual_element}")
+            st.markdown(block_renderer.block_row(block, HOST_VIEW), unsafe_allow_html=True)
+    
+    show_more_button("host_games", has_more)
 
 # ========== ФУНКЦИИ ДЛЯ ИГРОКА ==========
 def player_interface():
@@ -530,14 +872,11 @@ def player_interface():
     
     # Проверяем, есть ли активная игра
     if st.session_state.current_game:
-        game_block = None
-        for block in shared_data["game_blocks"]:
-            if block['spell_name'] == st.session_state.current_game:
-                game_block = block
-                break
+        game_block = shared_data.get_block(st.session_state.current_game)
         
         if game_block:
-            play_spell_game(game_block)
+            with profiler.section("play_spell_game"):
+                play_spell_game(game_block)
             return
         else:
             # Если блока нет, сбрасываем текущую игру
@@ -549,10 +888,27 @@ def player_interface():
     with col_search:
         st.header("🔍 Выбор заклинания")
         
-        spell_names = [spell["name"] for spell in SPELLS_DB]
+        col_query, col_level = st.columns([2, 1])
+        with col_query:
+            spell_query = st.text_input("🔍 Поиск", placeholder="Название...", key="player_spell_search")
+        with col_level:
+            spell_level = st.selectbox("Уровень", [None] + spell_catalog.levels(),
+                                       format_func=lambda x: "Все" if x is None else str(x),
+                                       key="player_spell_level")
+        
+        if spell_query or spell_level is not None:
+            spell_names = spell_catalog.search_index.search(spell_query, spell_level, limit=SEARCH_LIMIT)
+            # Выбранное заклинание остается в списке, даже если не подходит под новый поиск
+            current_spell = st.session_state.get("player_spell_select")
+            if current_spell and current_spell not in spell_names:
+                spell_names.insert(0, current_spell)
+            spell_options = [""] + spell_names
+        else:
+            # Без фильтров - готовый список из каталога
+            spell_options = spell_catalog.select_options
         selected_spell = st.selectbox(
             "Выберите заклинание:",
-            options=[""] + spell_names,
+            options=spell_options,
             format_func=lambda x: "👇 Выберите из списка" if x == "" else x,
             key="player_spell_select"
         )
@@ -561,28 +917,14 @@ def player_interface():
         st.write("### Действия:")
         
         if selected_spell:
-            spell = None
-            for s in SPELLS_DB:
-                if s["name"] == selected_spell:
-                    spell = s
-                    break
+            spell = spell_catalog.get_by_name(selected_spell)
             
             if spell:
                 # Ищем блок
-                existing_block = None
-                for b in shared_data["game_blocks"]:
-                    if b['spell_name'] == spell['name']:
-                        existing_block = b
-                        break
+                existing_block = shared_data.get_block(spell['name'])
                 
                 # Ищем запрос
-                existing_request = None
-                for r in shared_data["client_requests"]:
-                    if (r['spell_name'] == spell['name'] and 
-                        r['user_id'] == st.session_state.user_id and
-                        r['status'] == 'ожидает'):
-                        existing_request = r
-                        break
+                existing_request = shared_data.find_request(st.session_state.user_id, spell['name'])
                 
                 # Кнопка 1: Играть
                 if existing_block and existing_block['attempts'] < existing_block['max_attempts']:
@@ -600,16 +942,18 @@ def player_interface():
                             key="btn_play_disabled")
                 
                 # Кнопка 2: Запросить комбинацию
-                spell_combo = shared_data["spell_combinations"].get(spell['name'])
-                if not spell_combo and not existing_request:
+                spell_combo = shared_data.spell_combinations.get(spell['name'])
+                if game_engine.can_request_combo(st.session_state.user_id, spell['name']):
                     if st.button("📤 **Запросить комбинацию**", 
                                use_container_width=True,
                                type="secondary",
                                key="btn_request"):
-                        create_new_request(spell['name'], spell['level'], 
-                                         st.session_state.user_name, st.session_state.user_id)
-                        st.success("📨 Запрос отправлен мастеру!")
-                        st.rerun()
+                        if create_new_request(spell['name'], spell['level'], 
+                                              st.session_state.user_name, st.session_state.user_id):
+                            st.success("📨 Запрос отправлен мастеру!")
+                            st.rerun()
+                        else:
+                            st.warning(REQUEST_REJECTED_MESSAGE)
                 else:
                     st.button("📤 Запросить комбинацию", 
                             disabled=True,
@@ -635,15 +979,24 @@ def player_interface():
                             key="btn_start_disabled")
                 
                 # Кнопка 4: Запросить повтор
-                if existing_block and existing_block['attempts'] >= existing_block['max_attempts']:
-                    if not existing_request or existing_request['type'] != 'повтор':
+                retry_at = game_engine.retry_due(spell['name']) if existing_block else None
+                if retry_at is not None:
+                    st.button(f"⏳ Новая попытка в {format_time(retry_at)}",
+                            disabled=True,
+                            use_container_width=True,
+                            help="Попытка вернется сама, запрос мастеру не нужен",
+                            key="btn_repeat_scheduled")
+                elif existing_block and existing_block['attempts'] >= existing_block['max_attempts']:
+                    if game_engine.can_request_retry(st.session_state.user_id, spell['name']):
                         if st.button("🔄 **Запросить новую попытку**", 
                                    use_container_width=True,
                                    key="btn_repeat"):
-                            create_repeat_request(spell['name'], spell['level'], 
-                                                st.session_state.user_name, st.session_state.user_id)
-                            st.success("📨 Запрос на новую попытку отправлен!")
-                            st.rerun()
+                            if create_repeat_request(spell['name'], spell['level'], 
+                                                     st.session_state.user_name, st.session_state.user_id):
+                                st.success("📨 Запрос на новую попытку отправлен!")
+                                st.rerun()
+                            else:
+                                st.warning(REQUEST_REJECTED_MESSAGE)
                     else:
                         st.button("🔄 Запросить новую попытку", 
                                 disabled=True,
@@ -677,7 +1030,10 @@ def player_interface():
                 st.write(f"- **Уровень:** {spell['level']}")
                 
                 if existing_block:
-                    st.write(f"- **Статус:** {'🎮 Доступно' if existing_block['attempts'] < existing_block['max_attempts'] else '⏳ Ожидает новой попытки'}")
+                    if retry_at is not None:
+                        st.write(f"- **Статус:** ⏳ Новая попытка в {format_time(retry_at)}")
+                    else:
+                        st.write(f"- **Статус:** {'🎮 Доступно' if existing_block['attempts'] < existing_block['max_attempts'] else '⏳ Ожидает новой попытки'}")
                     st.write(f"- **Угадано:** {len(existing_block['guessed'])}/{existing_block['level']}")
                 elif spell_combo:
                     st.success("✅ Комбинация создана мастером")
@@ -693,14 +1049,13 @@ def player_interface():
     with col_games:
         st.header("🎮 Активные игры")
         
-        my_requests = [r for r in shared_data["client_requests"] 
-                      if r['user_id'] == st.session_state.user_id and r['status'] == 'ожидает']
+        my_requests = shared_data.user_requests(st.session_state.user_id, STATUS_PENDING)
         if my_requests:
             with st.expander("📨 Мои запросы", expanded=True):
                 for req in my_requests:
-                    st.write(f"• **{req['spell_name']}** ({'новая попытка' if req['type'] == 'повтор' else 'новая комбинация'}) - {req['timestamp']}")
+                    st.write(f"• **{req['spell_name']}** ({'новая попытка' if req['type'] == 'повтор' else 'новая комбинация'}) - {format_time(req['timestamp'])}")
         
-        if not shared_data["game_blocks"]:
+        if not shared_data.block_count():
             st.info("""
             ### 🎯 Как начать игру:
             1. Выберите заклинание слева
@@ -710,17 +1065,26 @@ def player_interface():
             5. После этого можно начать игру
             """)
         else:
-            game_search = st.text_input("🔍 Поиск по играм", placeholder="Введите название...", key="player_game_search")
+            game_search, order = block_search_controls("🔍 Поиск по играм", "Введите название...", "player_game")
             
-            filtered_games = shared_data["game_blocks"]
+            filtered_games = shared_data.iter_blocks(order)
             if game_search:
-                filtered_games = [b for b in filtered_games if game_search.lower() in b['spell_name'].lower()]
+                filtered_games = search_blocks(game_search)
             
-            for block in filtered_games:
-                display_player_game_block(block)
+            with profiler.section("player_blocks"):
+                games_page, has_more = take_page(filtered_games, "player_games")
+                for block in games_page:
+                    display_player_game_block(block)
+                show_more_button("player_games", has_more)
 
+@shared_fragment
 def display_player_game_block(block: Dict):
-    """Отображение игрового блока для игрока"""
+    """Отображение игрового блока для игрока. Кнопки блока перезапускают только его"""
+    # Блок мог быть удален, пока был на экране
+    block = shared_data.get_block(block['spell_name'])
+    if block is None:
+        return
+    
     with st.container():
         st.markdown("---")
         
@@ -735,34 +1099,15 @@ def display_player_game_block(block: Dict):
         with col_status:
             progress = len(block['guessed']) / block['level']
             st.progress(progress)
-            if block['attempts'] >= block['max_attempts']:
+            retry_at = game_engine.retry_due(block['spell_name'])
+            if retry_at is not None:
+                st.caption(f"⏳ Попытка в {format_time(retry_at)}")
+            elif block['attempts'] >= block['max_attempts']:
                 st.caption("🔄 Нужен запрос")
             else:
                 st.caption(f"Попыток: {block['max_attempts'] - block['attempts']}")
         
-        element_cols = st.columns(min(8, block['level']))
-        for i in range(block['level']):
-            with element_cols[i % 8]:
-                if i < len(block['guessed']):
-                    element = block['guessed'][i]
-                    color = ELEMENT_COLORS.get(element, "#CCCCCC")
-                    symbol = ELEMENT_SYMBOLS.get(element, "❓")
-                    
-                    st.markdown(
-                        f'<div style="background-color: {color}; padding: 12px; border-radius: 50%; '
-                        f'width: 50px; height: 50px; display: flex; align-items: center; '
-                        f'justify-content: center; margin: 0 auto; border: 3px solid #06D6A0;">'
-                        f'<span style="font-size: 1.3em;">{symbol}</span></div>',
-                        unsafe_allow_html=True
-                    )
-                else:
-                    st.markdown(
-                        f'<div style="background-color: #333; padding: 12px; border-radius: 50%; '
-                        f'width: 50px; height: 50px; display: flex; align-items: center; '
-                        f'justify-content: center; margin: 0 auto; border: 2px solid #666;">'
-                        f'<span style="font-size: 1.3em; color: white;">?</span></div>',
-                        unsafe_allow_html=True
-                    )
+        st.markdown(block_renderer.block_row(block, PLAYER_VIEW), unsafe_allow_html=True)
         
         col_play, col_repeat = st.columns(2)
         
@@ -777,22 +1122,19 @@ def display_player_game_block(block: Dict):
                          use_container_width=True, key=f"used_{block['id']}")
         
         with col_repeat:
-            if block['attempts'] >= block['max_attempts']:
-                existing_request = None
-                for r in shared_data["client_requests"]:
-                    if (r['spell_name'] == block['spell_name'] and 
-                        r['user_id'] == st.session_state.user_id and
-                        r['status'] == 'ожидает'):
-                        existing_request = r
-                        break
-                
-                if not existing_request:
+            if retry_at is not None:
+                st.button(f"⏳ **Новая попытка в {format_time(retry_at)}**", disabled=True,
+                         use_container_width=True, key=f"scheduled_{block['id']}")
+            elif block['attempts'] >= block['max_attempts']:
+                if game_engine.can_request_retry(st.session_state.user_id, block['spell_name']):
                     if st.button("🔄 **Запросить новую попытку**", key=f"repeat_btn_{block['id']}", 
                                 use_container_width=True, type="secondary"):
-                        create_repeat_request(block['spell_name'], block['level'], 
-                                            st.session_state.user_name, st.session_state.user_id)
-                        st.success("📨 Запрос отправлен!")
-                        st.rerun()
+                        if create_repeat_request(block['spell_name'], block['level'], 
+                                                 st.session_state.user_name, st.session_state.user_id):
+                            st.success("📨 Запрос отправлен!")
+                            rerun_fragment()
+                        else:
+                            st.warning(REQUEST_REJECTED_MESSAGE)
                 else:
                     st.button("⏳ **Запрос отправлен**", disabled=True, 
                              use_container_width=True, key=f"requested_{block['id']}")
@@ -806,10 +1148,23 @@ def display_player_game_block(block: Dict):
 def play_spell_game(block: Dict):
     """Игровой интерфейс угадывания"""
     st.title(f"🎮 Угадайте: {block['spell_name']}")
+    spell_game_panel(block)
+
+@shared_fragment
+def spell_game_panel(block: Dict):
+    """Панель угадывания: выбор элементов и проверка перезапускают только ее"""
+    block = shared_data.get_block(block['spell_name'])
+    if block is None:
+        st.session_state.current_game = None
+        st.rerun()
     
     if block['attempts'] >= block['max_attempts']:
         st.error("❌ Попытка уже использована!")
-        st.info("Нажмите '🔄 Запросить новую попытку' для получения новой попытки.")
+        retry_at = game_engine.retry_due(block['spell_name'])
+        if retry_at is not None:
+            st.info(f"Новая попытка появится сама в {format_time(retry_at)}.")
+        else:
+            st.info("Нажмите '🔄 Запросить новую попытку' для получения новой попытки.")
         
         if st.button("← Назад к играм", use_container_width=True):
             st.session_state.current_game = None
@@ -824,10 +1179,9 @@ def play_spell_game(block: Dict):
     if elements_to_guess == 0:
         st.balloons()
         st.success(f"🎉 Поздравляем! Вы полностью разгадали '{block['spell_name']}'!")
-        st.write(f"**Полная комбинация:** {block['combination']}")
+        st.write(f"**Полная комбинация:** {create_element_display(block['elements'])}")
         
-        block['attempts'] += 1
-        block['last_played'] = datetime.now().strftime("%H:%M:%S")
+        game_engine.finish_game(block['spell_name'])
         
         if st.button("← Назад к играм", use_container_width=True):
             st.session_state.current_game = None
@@ -852,35 +1206,28 @@ def play_spell_game(block: Dict):
             selected_elements.append(element)
     
     if st.button("🔍 **Проверить**", type="primary", use_container_width=True):
-        block['attempts'] += 1
-        block['last_played'] = datetime.now().strftime("%H:%M:%S")
-        
-        # Определяем, какие элементы нужно проверить (еще не угаданные)
-        actual_elements_to_check = []
-        for i, element in enumerate(block['elements']):
-            if i >= len(block['guessed']):
-                actual_elements_to_check.append(element)
-        
-        # Используем правильную логику проверки
-        new_guessed = check_guessed_elements(selected_elements, actual_elements_to_check)
-        
-        if new_guessed:
-            # Добавляем угаданные элементы
-            for element in new_guessed:
-                block['guessed'].append(element)
-            
-            st.success(f"✅ Угадано {len(new_guessed)} элементов!")
+        result = game_engine.submit_guess(block['spell_name'], selected_elements)
+        
+        if result is None or not result.accepted:
+            st.error("❌ Попытка уже использована!")
+            rerun_fragment()
+        elif result.matched:
+            st.success(f"✅ Угадано {len(result.matched)} элементов!")
             
-            if len(block['guessed']) == block['level']:
+            if result.solved:
                 st.balloons()
                 st.success(f"🎉 Вы полностью разгадали заклинание!")
-                st.write(f"**Полная комбинация:** {block['combination']}")
+                st.write(f"**Полная комбинация:** {create_element_display(block['elements'])}")
             
-            st.rerun()
+            rerun_fragment()
         else:
             st.error("❌ Элементы не угаданы!")
-            st.info("Попытка использована. Для новой попытки нажмите '🔄 Запросить новую попытку'.")
-            st.rerun()
+            retry_at = game_engine.retry_due(block['spell_name'])
+            if retry_at is not None:
+                st.info(f"Попытка использована. Новая появится сама в {format_time(retry_at)}.")
+            else:
+                st.info("Попытка использована. Для новой попытки нажмите '🔄 Запросить новую попытку'.")
+            rerun_fragment()
     
     st.markdown("---")
     if st.button("← Назад к играм", use_container_width=True):
@@ -889,13 +1236,34 @@ def play_spell_game(block: Dict):
 
 # ========== ГЛАВНЫЙ ИНТЕРФЕЙС ==========
 def main():
-    init_user_session()
+    # cProfile одного rerun по запросу мастера
+    if st.session_state.pop("capture_profile", False):
+        result = st.session_state.last_profile = {}
+        profile = capture_profile(result)
+    else:
+        profile = contextlib.nullcontext()
+    try:
+        with profile, profiler.rerun():
+            render_page()
+    finally:
+        # st.rerun() прерывает скрипт исключением, поэтому сохраняем в finally
+        shared_data.flush()
+
+def render_page():
+    # Подтягиваем изменения, сделанные другими процессами
+    shared_data.sync()
+    # Версию запоминаем до отрисовки: изменения во время rerun вызовут еще один
+    st.session_state.rendered_version = shared_data.version
+    with profiler.section("init_user_session"):
+        init_user_session()
     
     # Сайдбар
     st.sidebar.title("⚔️ D&D Spell Caster")
     
     # Показываем текущего пользователя
     st.sidebar.write(f"**Пользователь:** {st.session_state.user_name}")
+    room_code = st.session_state.get("room_code", DEFAULT_ROOM)
+    st.sidebar.write(f"**Комната:** {room_code or 'общий стол'}")
     if st.session_state.user_type == "player":
         st.sidebar.write(f"**Роль:** 🎮 Игрок")
     elif st.session_state.user_type == "host":
@@ -903,13 +1271,11 @@ def main():
     else:
         st.sidebar.write(f"**Роль:** 👤 Гость")
     
-    if st.sidebar.button("🔄 Обновить данные", use_container_width=True):
-        st.rerun()
-    
     if st.session_state.user_type in ["player", "host"]:
+        watch_shared_updates()
+        
         if st.sidebar.button("🚪 Выйти", use_container_width=True):
-            if st.session_state.user_id in shared_data["users"]:
-                del shared_data["users"][st.session_state.user_id]
+            shared_data.remove_user(st.session_state.user_id)
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
@@ -0,0 +1,107 @@
+"""
+Сравнение полного rerun страницы игрока и перезапуска одного фрагмента-блока.
+
+Запуск: python bench_fragments.py [число_блоков ...]
+
+Клик по кнопке внутри блока перезапускает только функцию-фрагмент
+display_player_game_block, поэтому ее время не должно зависеть от числа
+блоков на столе, в отличие от полного rerun player_interface.
+
+Последняя колонка - клик мастера "Сбросить прогресс" в панели комбинации вместе
+с проверкой watch_shared_updates: если наблюдатель счел бы страницу устаревшей,
+в замер входит и полный rerun панели мастера. Собственное действие сессии
+полного rerun вызывать не должно.
+"""
+import os
+import statistics
+import sys
+import time
+from typing import Tuple
+
+from streamlit.testing.v1 import AppTest
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+RUNS = 5
+
+
+def bench_page(repo: str, blocks: int, only_one_block: bool, host_click: bool = False):
+    import sys
+    sys.path.insert(0, repo)
+    import streamlit as st
+    import Dnd
+
+    store = Dnd.shared_data
+    for i in range(store.block_count(), blocks):
+        spell = f"Заклинание {i}"
+        store.save_combination(spell, ["Огонь", "Вода", "Земля"], "🔥 + 💧 + 🌍")
+        Dnd.get_or_create_game_block(spell, 3, "bench")
+
+    st.session_state.setdefault("user_id", "bench")
+    st.session_state.setdefault("user_name", "bench")
+    st.session_state.setdefault("user_type", "player")
+    st.session_state.setdefault("current_game", None)
+
+    if host_click:
+        st.session_state.user_type = "host"
+        if st.session_state.get("full_rerun"):
+            # Полный rerun, который запустил бы наблюдатель: render_page отмечает версию и рисует всю панель
+            st.session_state.full_rerun = False
+            st.session_state.rendered_version = store.version
+            Dnd.host_interface()
+            return
+        st.session_state.setdefault("rendered_version", store.version)
+        Dnd.host_combo_panel("Заклинание 0")
+        # Проверка watch_shared_updates после rerun фрагмента
+        st.session_state.full_rerun = store.version != st.session_state.rendered_version
+    elif only_one_block:
+        # То же, что выполняет Streamlit при клике внутри фрагмента
+        Dnd.display_player_game_block(store.get_block("Заклинание 0"))
+    else:
+        Dnd.player_interface()
+
+
+def measure(blocks: int, only_one_block: bool) -> float:
+    app = AppTest.from_function(bench_page, args=(REPO, blocks, only_one_block), default_timeout=120)
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        app.run()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def measure_click(blocks: int) -> Tuple[float, int]:
+    """Медиана клика мастера с проверкой наблюдателя и число вызванных им полных rerun"""
+    app = AppTest.from_function(bench_page, args=(REPO, blocks, False, True), default_timeout=120)
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    timings, full_reruns = [], 0
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        app.button(key="reset_Заклинание 0").click().run()
+        if app.session_state["full_rerun"]:
+            full_reruns += 1
+            app.run()
+        timings.append(time.perf_counter() - started)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    return statistics.median(timings) * 1000, full_reruns
+
+
+def main(sizes):
+    os.environ["DND_DB_PATH"] = ""
+    print(f"{'блоков':>8} {'полный rerun, мс':>18} {'фрагмент блока, мс':>20} {'клик + наблюдатель, мс':>24}")
+    for blocks in sizes:
+        full = measure(blocks, only_one_block=False)
+        fragment = measure(blocks, only_one_block=True)
+        click, full_reruns = measure_click(blocks)
+        print(f"{blocks:>8} {full:>18.1f} {fragment:>20.1f} {click:>24.1f}"
+              f"   (полных rerun: {full_reruns}/{RUNS})")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10, 50, 200])
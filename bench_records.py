@@ -0,0 +1,114 @@
+"""
+Память на одну запись: прежние словари против записей records со __slots__.
+
+Запуск: python bench_records.py [--count 100000]
+
+Для блоков, запросов и пользователей строит count записей в прежнем виде
+(словарь со строкой комбинации и временем strftime) и в новом
+(GameBlock / ClientRequest / UserSession с кодами элементов и временем эпохи)
+и печатает, сколько байт на запись насчитал tracemalloc.
+Списки элементов комбинаций общие с комбинациями заклинаний, поэтому
+у прежних блоков они не засчитываются, а коды новых блоков засчитываются.
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List
+
+from records import ClientRequest, GameBlock, UserSession
+
+ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
+SYMBOLS = ["🔥", "💧", "🌍", "⚡", "❄️", "🌿", "💀", "🛡️"]
+
+
+def display(elements: List[str]) -> str:
+    return " + ".join(SYMBOLS[ELEMENTS.index(e)] for e in elements)
+
+
+def legacy_block(i: int, elements: List[str], guessed: int) -> dict:
+    """Блок в том виде, в каком его создавал прежний start_game"""
+    return {
+        "id": i,
+        "spell_name": f"Заклинание {i}",
+        "level": len(elements),
+        "combination": display(elements),
+        "elements": elements,
+        "guessed": elements[:guessed],
+        "attempts": 1,
+        "max_attempts": 1,
+        "is_active": True,
+        "created_by": "Игрок",
+        "created_at": datetime.now().strftime("%H:%M:%S"),
+        "last_played": datetime.now().strftime("%H:%M:%S"),
+        "version": 2,
+    }
+
+
+def record_block(i: int, elements: List[str], guessed: int) -> GameBlock:
+    now = time.time()
+    return GameBlock(i, f"Заклинание {i}", len(elements), elements, elements[:guessed],
+                     1, 1, True, "Игрок", now, now, 2)
+
+
+def legacy_request(i: int, elements: List[str], guessed: int) -> dict:
+    return {
+        "user_name": "Игрок",
+        "user_id": f"{i:032x}",
+        "spell_name": f"Заклинание {i}",
+        "level": len(elements),
+        "timestamp": datetime.now().strftime("%H:%M:%S"),
+        "status": "ожидает",
+        "type": "новый",
+        "id": i,
+    }
+
+
+def record_request(i: int, elements: List[str], guessed: int) -> ClientRequest:
+    return ClientRequest(i, "Игрок", f"{i:032x}", f"Заклинание {i}", len(elements),
+                         time.time(), "ожидает", "новый")
+
+
+def legacy_user(i: int, elements: List[str], guessed: int) -> dict:
+    return {"name": f"Игрок_{i}", "type": "player", "last_active": time.time()}
+
+
+def record_user(i: int, elements: List[str], guessed: int) -> UserSession:
+    return UserSession(f"Игрок_{i}", "player", time.time())
+
+
+def footprint(build: Callable, count: int, combos: List[List[str]], seed: int = 0) -> float:
+    """Байт на запись: прирост памяти после построения count записей"""
+    rng = random.Random(seed)
+    guessed = [rng.randint(0, len(combo)) for combo in combos]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [build(i, combos[i], guessed[i]) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    combos = [[rng.choice(ELEMENTS) for _ in range(rng.randint(1, 9))] for _ in range(args.count)]
+    print(f"{args.count:,} записей")
+    print(f"{'запись':<12} {'словарь, Б':>11} {'__slots__, Б':>13} {'экономия':>9}")
+    for name, legacy, record in (("блок", legacy_block, record_block),
+                                 ("запрос", legacy_request, record_request),
+                                 ("пользователь", legacy_user, record_user)):
+        before = footprint(legacy, args.count, combos)
+        after = footprint(record, args.count, combos)
+        print(f"{name:<12} {before:>11.0f} {after:>13.0f} {1 - after / before:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Сравнение SearchIndex с прежним поиском подстроки по всему списку.
+
+Запуск: python bench_search.py [число_названий ...]
+
+Прежний способ: [n for n in names if query.lower() in n.lower()] на каждое нажатие клавиши.
+"""
+import random
+import statistics
+import sys
+import time
+
+from search import SearchIndex
+
+WORDS = ["Огненный", "Ледяной", "Шар", "Стена", "Щит", "Молния", "Буря", "Призыв", "Элементаль",
+         "Лечение", "Ран", "Воскрешение", "Слово", "Силы", "Туча", "Врата", "Кожа", "Каменная",
+         "Полёт", "Невидимость", "Снаряд", "Магический", "Рассеивание", "Магии", "Дождь", "Тьмы"]
+QUERIES = ["ог", "шар", "ледян", "щит маг", "ёт", "стена 12", "буря", "зов эле", "несуществующее"]
+REPEATS = 20
+
+
+def make_names(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [f"{' '.join(rng.sample(WORDS, rng.randint(2, 3)))} {i}" for i in range(count)]
+
+
+def substring_scan(names, query):
+    return [n for n in names if query.lower() in n.lower()]
+
+
+def timed(fn) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1e6
+
+
+def main(sizes):
+    print(f"{'названий':>9} {'построение, мс':>15} {'скан, мкс':>11} {'индекс, мкс':>12} {'ускорение':>10}")
+    for count in sizes:
+        names = make_names(count)
+        started = time.perf_counter()
+        index = SearchIndex((name, name, None) for name in names)
+        build_ms = (time.perf_counter() - started) * 1000
+        scan = sum(timed(lambda: substring_scan(names, q)) for q in QUERIES) / len(QUERIES)
+        indexed = sum(timed(lambda: index.search(q, limit=100)) for q in QUERIES) / len(QUERIES)
+        print(f"{count:>9} {build_ms:>15.1f} {scan:>11.1f} {indexed:>12.1f} {scan / indexed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100, 1000, 10000, 50000])
@@ -0,0 +1,221 @@
+"""
+Набор бенчмарков: правила игры, операции хранилища, поиск и полные rerun страниц.
+
+Запуск: python bench_suite.py [--sizes 10 1000 10000] [--only имя ...]
+                               [--save baseline.json] [--compare baseline.json] [--threshold 0.25]
+
+Для каждого размера фикстуры (блоков, запросов и пользователей поровну)
+печатает p50 / p95 / p99 задержки и пиковую память одного вызова (tracemalloc).
+--save записывает результаты в JSON, --compare сравнивает с сохраненными
+и завершается с кодом 1, если p50 или память выросли больше чем на threshold.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from codec import ElementCodec
+from engine import GameEngine
+from store import SharedStore, ORDER_RECENT
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
+QUERIES = ["за", "закл", "ание 1", "99", "несуществующее"]
+MICRO_SAMPLES = 300
+PAGE_SAMPLES = 5
+
+
+def spell_name(i: int) -> str:
+    return f"Заклинание {i}"
+
+
+def build_engine(size: int, seed: int = 0) -> GameEngine:
+    """Хранилище с size блоками, ожидающими запросами и пользователями"""
+    rng = random.Random(seed)
+    engine = GameEngine(SharedStore(), ElementCodec(ELEMENTS), {})
+    for i in range(size):
+        level = rng.randint(1, 9)
+        engine.save_combo(spell_name(i), [rng.choice(ELEMENTS) for _ in range(level)])
+        engine.start_game(spell_name(i), level, "bench")
+        engine.request_combo(f"user{i}", f"user{i}", f"Запрос {i}", level)
+        engine.store.register_user(f"user{i}", f"user{i}", "player")
+    return engine
+
+
+# ========== СЦЕНАРИИ ==========
+def case_check_guess(size: int) -> Callable[[], object]:
+    engine = build_engine(min(size, 1000))
+    rng = random.Random(1)
+    blocks = engine.store.blocks()
+    guesses = [[rng.choice(ELEMENTS) for _ in range(9)] for _ in range(64)]
+    pairs = itertools.cycle([(g, b['elements']) for g, b in zip(itertools.cycle(guesses), blocks[:256])])
+    return lambda: engine.match(*next(pairs))
+
+
+def case_start_game(size: int) -> Callable[[], object]:
+    engine = build_engine(size)
+    fresh = itertools.count(size)
+    return lambda: engine.start_game(spell_name(next(fresh)), 3, "bench")
+
+
+def case_request_combo(size: int) -> Callable[[], object]:
+    engine = build_engine(size)
+    fresh = itertools.count(size)
+
+    def op():
+        i = next(fresh)
+        return engine.request_combo(f"user{i % max(size, 1)}", "bench", f"Новое {i}", 3)
+    return op
+
+
+def case_submit_guess(size: int) -> Callable[[], object]:
+    engine = build_engine(size)
+    names = itertools.cycle([spell_name(i) for i in range(size)])
+
+    def op():
+        name = next(names)
+        engine.grant_retry(name)
+        return engine.submit_guess(name, ["Огонь", "Вода", "Земля"])
+    return op
+
+
+def case_search(size: int) -> Callable[[], object]:
+    engine = build_engine(size)
+    queries = itertools.cycle(QUERIES)
+    return lambda: engine.store.block_index.search(next(queries), limit=100)
+
+
+def case_iter_blocks(size: int) -> Callable[[], object]:
+    engine = build_engine(size)
+    return lambda: next(engine.store.iter_blocks(ORDER_RECENT), None)
+
+
+def page_script(repo: str, size: int, user_type: str):
+    import sys
+    sys.path.insert(0, repo)
+    import random
+    import streamlit as st
+    import Dnd
+
+    rng = random.Random(0)
+    engine = Dnd.game_engine
+    store = Dnd.shared_data
+    for i in range(store.block_count(), size):
+        level = rng.randint(1, 9)
+        name = f"Заклинание {i}"
+        engine.save_combo(name, [rng.choice(Dnd.ELEMENTS) for _ in range(level)])
+        engine.start_game(name, level, "bench")
+        engine.request_combo(f"user{i}", f"user{i}", f"Запрос {i}", level)
+        store.register_user(f"user{i}", f"user{i}", "player")
+
+    st.session_state.setdefault("user_id", "bench")
+    st.session_state.setdefault("user_name", "bench")
+    st.session_state.setdefault("user_type", user_type)
+    st.session_state.setdefault("current_game", None)
+    if user_type == "host":
+        Dnd.host_interface()
+    else:
+        Dnd.player_interface()
+
+
+def page_case(user_type: str):
+    def setup(size: int) -> Callable[[], object]:
+        from streamlit.testing.v1 import AppTest
+        app = AppTest.from_function(page_script, args=(REPO, size, user_type), default_timeout=600)
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+        return app.run
+    return setup
+
+
+CASES: Dict[str, Callable[[int], Callable[[], object]]] = {
+    "check_guess": case_check_guess,
+    "start_game": case_start_game,
+    "request_combo": case_request_combo,
+    "submit_guess": case_submit_guess,
+    "search": case_search,
+    "iter_blocks": case_iter_blocks,
+    "host_rerun": page_case("host"),
+    "player_rerun": page_case("player"),
+}
+PAGE_CASES = {"host_rerun", "player_rerun"}
+
+
+# ========== ИЗМЕРЕНИЕ ==========
+def measure(op: Callable[[], object], samples: int) -> Dict[str, float]:
+    timings: List[float] = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        op()
+        timings.append(time.perf_counter() - started)
+    # Память меряем отдельным вызовом: tracemalloc замедляет код
+    tracemalloc.start()
+    op()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cuts = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "p50_us": statistics.median(timings) * 1e6,
+        "p95_us": cuts[94] * 1e6,
+        "p99_us": cuts[98] * 1e6,
+        "peak_kb": peak / 1024,
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ("p50_us", "peak_kb"):
+            if base[metric] > 0 and current[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{key} {metric}: {base[metric]:.1f} → {current[metric]:.1f} "
+                                   f"(+{(current[metric] / base[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Страницам нужна база в памяти, чтобы прогоны не зависели от файла состояния
+    os.environ["DND_DB_PATH"] = ""
+    results: Dict[str, Dict] = {}
+    print(f"{'сценарий':<14} {'размер':>7} {'p50, мкс':>11} {'p95, мкс':>11} {'p99, мкс':>11} {'пик, КБ':>9}")
+    for size in sorted(args.sizes):
+        for name in args.only:
+            op = CASES[name](size)
+            stats = measure(op, PAGE_SAMPLES if name in PAGE_CASES else MICRO_SAMPLES)
+            results[f"{name}@{size}"] = stats
+            print(f"{name:<14} {size:>7} {stats['p50_us']:>11.1f} {stats['p95_us']:>11.1f} "
+                  f"{stats['p99_us']:>11.1f} {stats['peak_kb']:>9.1f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Регрессии больше {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий больше {args.threshold:.0%} нет")
+
+
+if __name__ == "__main__":
+    main()
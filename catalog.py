@@ -0,0 +1,144 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import csv
+import json
+import os
+
+from search import SearchIndex
+
+# Уровни заклинаний, для которых можно составить комбинацию.
+# Заговоры (уровень 0) при загрузке пропускаются: у них нет элементов
+MIN_LEVEL = 1
+MAX_LEVEL = 9
+
+# ========== ВСТРОЕННЫЙ КАТАЛОГ ==========
+SPELLS_DB = [
+    {"id": 1, "name": "Огненный шар", "level": 3},
+    {"id": 2, "name": "Лечение ран", "level": 1},
+    {"id": 3, "name": "Магическая защита", "level": 2},
+    {"id": 4, "name": "Молния", "level": 3},
+    {"id": 5, "name": "Невидимость", "level": 2},
+    {"id": 6, "name": "Телепортация", "level": 4},
+    {"id": 7, "name": "Воскрешение", "level": 5},
+    {"id": 8, "name": "Метеоритный дождь", "level": 5},
+    {"id": 9, "name": "Шаровая молния", "level": 3},
+    {"id": 10, "name": "Щит мага", "level": 2},
+    {"id": 11, "name": "Призыв элементаля", "level": 4},
+    {"id": 12, "name": "Рассеивание магии", "level": 3},
+    {"id": 13, "name": "Магический снаряд", "level": 1},
+    {"id": 14, "name": "Огненная стена", "level": 4},
+    {"id": 15, "name": "Ледяная буря", "level": 4},
+    {"id": 16, "name": "Полёт", "level": 3},
+    {"id": 17, "name": "Каменная кожа", "level": 3},
+    {"id": 18, "name": "Планарные врата", "level": 5},
+    {"id": 19, "name": "Слово силы", "level": 5},
+    {"id": 20, "name": "Пожирающая туча", "level": 4},
+]
+
+
+# ========== КАТАЛОГ ЗАКЛИНАНИЙ ==========
+class SpellCatalog:
+    """
+    Неизменяемый каталог заклинаний в компактном виде:
+    параллельные массивы id / названий / уровней и индексы по id, названию и уровню.
+    Словари заклинаний создаются только при обращении к конкретной записи.
+    """
+
+    def __init__(self, spells: Iterable[Tuple[int, str, int]]):
+        ids, names, levels = array("l"), [], array("b")
+        self._by_id: Dict[int, int] = {}
+        self._by_name: Dict[str, int] = {}
+        by_level: Dict[int, List[int]] = {}
+        for spell_id, name, level in spells:
+            if spell_id in self._by_id:
+                raise ValueError(f"Повторяющийся id заклинания: {spell_id}")
+            if name in self._by_name:
+                raise ValueError(f"Повторяющееся название заклинания: {name}")
+            position = len(names)
+            ids.append(spell_id)
+            names.append(name)
+            levels.append(level)
+            self._by_id[spell_id] = position
+            self._by_name[name] = position
+            by_level.setdefault(level, []).append(position)
+        self._ids = ids
+        self._names = tuple(names)
+        self._levels = levels
+        self._by_level = {level: tuple(positions) for level, positions in sorted(by_level.items())}
+        # Готовые варианты для selectbox: не пересобираются на каждом rerun
+        self.select_options: Tuple[str, ...] = ("",) + self._names
+        self.search_index = SearchIndex(zip(self._names, self._names, self._levels))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def _spell(self, position: int) -> Dict:
+        return {"id": self._ids[position], "name": self._names[position], "level": self._levels[position]}
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self._names
+
+    def levels(self) -> List[int]:
+        return list(self._by_level)
+
+    def get_by_name(self, name: str) -> Optional[Dict]:
+        position = self._by_name.get(name)
+        return None if position is None else self._spell(position)
+
+    def get_by_id(self, spell_id: int) -> Optional[Dict]:
+        position = self._by_id.get(spell_id)
+        return None if position is None else self._spell(position)
+
+    def level_of(self, name: str) -> Optional[int]:
+        position = self._by_name.get(name)
+        return None if position is None else self._levels[position]
+
+    def names_with_level(self, level: int) -> List[str]:
+        return [self._names[position] for position in self._by_level.get(level, ())]
+
+    def spells(self) -> Iterable[Dict]:
+        for position in range(len(self._names)):
+            yield self._spell(position)
+
+
+# ========== ЗАГРУЗКА ==========
+def _validated(rows: Iterable[Dict], source: str) -> Iterable[Tuple[int, str, int]]:
+    next_id = 1
+    for line, row in enumerate(rows, start=1):
+        try:
+            name = str(row["name"]).strip()
+            level = int(row["level"])
+            raw_id = row.get("id")
+            spell_id = int(raw_id) if raw_id not in (None, "") else next_id
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(f"{source}: запись {line}: нужны поля name и level ({error})")
+        if not name:
+            raise ValueError(f"{source}: запись {line}: пустое название")
+        next_id = max(next_id, spell_id + 1)
+        if level == 0:
+            continue
+        if not MIN_LEVEL <= level <= MAX_LEVEL:
+            raise ValueError(f"{source}: запись {line}: уровень {level} вне диапазона {MIN_LEVEL}-{MAX_LEVEL}")
+        yield spell_id, name, level
+
+
+def load_catalog(path: Optional[str] = None) -> SpellCatalog:
+    """
+    Загружает каталог из JSON (список объектов или {"spells": [...]})
+    или CSV (колонки id,name,level; id можно опустить).
+    Без пути возвращает встроенный SPELLS_DB
+    """
+    if not path:
+        return SpellCatalog(_validated(SPELLS_DB, "SPELLS_DB"))
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8", newline="") as f:
+        if extension == ".csv":
+            return SpellCatalog(_validated(csv.DictReader(f), path))
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("spells", [])
+    return SpellCatalog(_validated(data, path))
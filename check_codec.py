@@ -0,0 +1,96 @@
+"""
+Проверка ElementCodec против прежней проверки догадок.
+
+Запуск: python check_codec.py [случайных_проверок]
+
+Сравнивает на всех наборах до 3 элементов и на случайных до 9:
+- matched() с прежним попарным удалением из копии списка
+- score() с длиной результата
+- score_pairs() / score_matrix() (numpy, если установлен) с score()
+И печатает время прежней и новой проверки. Одна догадка по списку проверяется
+быстрее, чем через кодирование, поэтому GameEngine.match использует список,
+а кодек - только для пакетной оценки.
+"""
+import random
+import sys
+import time
+from itertools import product
+from typing import List
+
+from codec import ElementCodec, np
+
+ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
+
+
+def reference(player_guesses: List[str], actual_elements: List[str]) -> List[str]:
+    """Прежняя check_guessed_elements без изменений"""
+    guessed = []
+    player_copy = player_guesses.copy()
+    actual_copy = actual_elements.copy()
+    for player_element in player_copy:
+        if player_element in actual_copy:
+            guessed.append(player_element)
+            actual_copy.remove(player_element)
+    return guessed
+
+
+def check(codec: ElementCodec, guesses: List[str], actual: List[str]):
+    expected = reference(guesses, actual)
+    code = codec.encode_list(actual)
+    got = codec.matched(guesses, code)
+    assert got == expected, (guesses, actual, got, expected)
+    score = codec.score(codec.encode_list(guesses), code)
+    assert score == len(expected), (guesses, actual, score, expected)
+
+
+def main(random_cases: int):
+    codec = ElementCodec(ELEMENTS)
+    exhaustive = 0
+    for g_len in range(4):
+        for a_len in range(4):
+            for guesses in product(ELEMENTS, repeat=g_len):
+                for actual in product(ELEMENTS[:4], repeat=a_len):
+                    check(codec, list(guesses), list(actual))
+                    exhaustive += 1
+
+    rng = random.Random(0)
+    cases = []
+    for _ in range(random_cases):
+        guesses = [rng.choice(ELEMENTS) for _ in range(rng.randint(0, 9))]
+        actual = [rng.choice(ELEMENTS) for _ in range(rng.randint(0, 9))]
+        check(codec, guesses, actual)
+        cases.append((guesses, actual))
+
+    guess_codes = [codec.encode_list(g) for g, _ in cases]
+    actual_codes = [codec.encode_list(a) for _, a in cases]
+    expected = [codec.score(g, a) for g, a in zip(guess_codes, actual_codes)]
+    assert list(codec.score_pairs(guess_codes, actual_codes)) == expected, "score_pairs"
+    matrix = codec.score_matrix(guess_codes[:50], actual_codes[:40])
+    for i in range(50):
+        assert list(matrix[i]) == [codec.score(guess_codes[i], a) for a in actual_codes[:40]], "score_matrix"
+
+    started = time.perf_counter()
+    for guesses, actual in cases:
+        reference(guesses, actual)
+    old = time.perf_counter() - started
+    started = time.perf_counter()
+    for guesses, actual in cases:
+        codec.matched(guesses, codec.encode_list(actual))
+    new = time.perf_counter() - started
+    started = time.perf_counter()
+    for g, a in zip(guess_codes, actual_codes):
+        codec.score(g, a)
+    scored = time.perf_counter() - started
+    started = time.perf_counter()
+    codec.score_pairs(guess_codes, actual_codes)
+    batch = time.perf_counter() - started
+
+    print(f"OK: {exhaustive} полных + {random_cases} случайных проверок совпали "
+          f"(numpy: {'да' if np is not None else 'нет'})")
+    per_case = 1e6 / len(cases)
+    print(f"на догадку: прежняя проверка {old * per_case:.2f} мкс, matched с кодированием {new * per_case:.2f} мкс, "
+          f"score по готовым кодам {scored * per_case:.2f} мкс, пакетом {batch * per_case:.3f} мкс")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,111 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для пакетной оценки
+    np = None
+
+# Ширина поля счетчика одного элемента. Счетчик не больше 9 (максимальный уровень),
+# поэтому старший бит поля всегда свободен и служит защитой при вычитании
+LANE_BITS = 8
+MAX_COUNT = (1 << (LANE_BITS - 1)) - 1
+
+
+def _repeat(byte: int, lanes: int) -> int:
+    return sum(byte << (LANE_BITS * i) for i in range(lanes))
+
+
+# ========== КОДИРОВАНИЕ КОМБИНАЦИЙ ==========
+class ElementCodec:
+    """
+    Мультимножество элементов в одном целом числе: по 8 бит на счетчик
+    каждого элемента (для 8 элементов - 64 бита).
+    Пересечение двух мультимножеств (сколько элементов угадано)
+    считается поразрядными операциями над всеми полями сразу, без циклов.
+    Выигрыш есть только при пакетной оценке (score_pairs, score_matrix):
+    одну догадку быстрее проверить по списку, как GameEngine.match.
+    """
+
+    def __init__(self, elements: Sequence[str]):
+        self.elements = tuple(elements)
+        self._shift = {element: LANE_BITS * i for i, element in enumerate(self.elements)}
+        lanes = len(self.elements)
+        self._low = _repeat(0x01, lanes)
+        self._guard = _repeat(0x80, lanes)
+        self._lane_mask = (1 << (LANE_BITS * lanes)) - 1
+        self._sum_shift = LANE_BITS * (lanes - 1)
+        self.encode = lru_cache(maxsize=4096)(self._encode)
+
+    def _encode(self, elements: Tuple[str, ...]) -> int:
+        code = 0
+        for element in elements:
+            shift = self._shift.get(element)
+            if shift is not None:
+                code += 1 << shift
+        return code
+
+    def encode_list(self, elements: Iterable[str]) -> int:
+        """Код мультимножества; неизвестные элементы (например, '?') не учитываются - их нельзя угадать"""
+        return self.encode(tuple(elements))
+
+    def counts(self, code: int) -> Dict[str, int]:
+        return {element: (code >> shift) & 0xFF for element, shift in self._shift.items()
+                if (code >> shift) & 0xFF}
+
+    def _minimum(self, a: int, b: int) -> int:
+        # В каждом поле старший бит (a | 0x80) - b остается, только если a >= b
+        ge = (((a | self._guard) - b) & self._guard) >> (LANE_BITS - 1)
+        mask = (ge << LANE_BITS) - ge
+        return (b & mask) | (a & ~mask & self._lane_mask)
+
+    def intersection(self, a: int, b: int) -> int:
+        """Код пересечения мультимножеств: в каждом поле min(a, b)"""
+        return self._minimum(a, b)
+
+    def size(self, code: int) -> int:
+        """Число элементов в мультимножестве (сумма всех полей)"""
+        return ((code * self._low) >> self._sum_shift) & 0xFF
+
+    def score(self, guess: int, actual: int) -> int:
+        """Сколько элементов догадки совпадает с комбинацией (с учетом повторов)"""
+        return self.size(self._minimum(guess, actual))
+
+    def matched(self, guesses: Sequence[str], actual: int) -> List[str]:
+        """
+        Угаданные элементы в порядке догадки: k-й повтор элемента засчитывается,
+        если в комбинации его не меньше k. Совпадает с прежним попарным удалением
+        """
+        used: Dict[str, int] = {}
+        result = []
+        for element in guesses:
+            shift = self._shift.get(element)
+            if shift is None:
+                continue
+            taken = used.get(element, 0)
+            if taken < (actual >> shift) & 0xFF:
+                used[element] = taken + 1
+                result.append(element)
+        return result
+
+    # ---------- Пакетная оценка ----------
+    def _lanes(self, codes: Sequence[int]):
+        packed = np.asarray(codes, dtype=np.uint64)
+        lanes = packed.view(np.uint8).reshape(len(packed), 8)
+        if np.little_endian:
+            return lanes[:, :len(self.elements)]
+        return lanes[:, ::-1][:, :len(self.elements)]
+
+    def score_pairs(self, guesses: Sequence[int], actuals: Sequence[int]):
+        """Оценки для пар (guesses[i], actuals[i]); с numpy - массив, иначе список"""
+        if np is None or len(self.elements) > 8:
+            return [self.score(g, a) for g, a in zip(guesses, actuals)]
+        return np.minimum(self._lanes(guesses), self._lanes(actuals)).sum(axis=1, dtype=np.int64)
+
+    def score_matrix(self, guesses: Sequence[int], actuals: Sequence[int]):
+        """Оценки каждой догадки против каждой комбинации: матрица len(guesses) × len(actuals)"""
+        if np is None or len(self.elements) > 8:
+            return [[self.score(g, a) for a in actuals] for g in guesses]
+        g = self._lanes(guesses)[:, None, :]
+        a = self._lanes(actuals)[None, :, :]
+        return np.minimum(g, a).sum(axis=2, dtype=np.int64)
@@ -0,0 +1,328 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import time
+
+from codec import ElementCodec
+from generator import CombinationGenerator, GeneratedBatch
+from metrics import REJECTED_DUPLICATE, REJECTED_RATE
+from ratelimit import TokenBucketLimiter
+from records import ClientRequest, GameBlock
+from scheduler import CooldownPolicy, RetryScheduler
+from store import BLOCK_WAITING, SharedStore, STATUS_PENDING, STATUS_PROCESSED, block_status
+
+# ========== ТИПЫ ЗАПРОСОВ ==========
+REQUEST_NEW = "новый"
+REQUEST_REPEAT = "повтор"
+
+UNKNOWN_ELEMENT = "?"
+
+# Настройка хранилища, в которой лежит политика перерывов, выбранная мастером
+RETRY_POLICY_SETTING = "retry_policy"
+
+
+# ========== СОСТОЯНИЕ ==========
+# Блоки и запросы - записи records.GameBlock и records.ClientRequest
+@dataclass
+class GuessResult:
+    """Итог проверки догадки"""
+    accepted: bool                                      # попытка была доступна и засчитана
+    matched: List[str] = field(default_factory=list)    # угаданные этой догадкой элементы
+    guessed: List[str] = field(default_factory=list)    # все угаданные элементы блока
+    attempts: int = 0
+    solved: bool = False
+
+
+def attempts_left(block: GameBlock) -> int:
+    return max(0, block['max_attempts'] - block['attempts'])
+
+
+def is_solved(block: GameBlock) -> bool:
+    return len(block['guessed']) >= block['level']
+
+
+# ========== ИГРОВОЙ ДВИЖОК ==========
+class GameEngine:
+    """
+    Правила игры без Streamlit: запросы комбинаций и попыток, блоки,
+    проверка догадок и учет попыток. Интерфейс только вызывает команды
+    и рисует результат, поэтому движок можно гонять из скриптов и нагрузочных тестов.
+    Состояние хранится в SharedStore; все изменения идут через его атомарные методы.
+    Если задана retry_policy, использованные попытки возвращаются сами по истечении
+    перерыва (RetryScheduler), и запрос повторной попытки мастеру не нужен.
+    Политика, выбранная мастером, хранится в настройках хранилища и важнее retry_policy:
+    она переживает перезапуск и одинакова во всех процессах, разделяющих базу.
+    Если задан rate_limiter, игрок не может создавать запросы чаще его лимита;
+    отклоненные запросы считаются в метриках хранилища.
+    """
+
+    def __init__(self, store: SharedStore, codec: ElementCodec, symbols: Dict[str, str],
+                 clock: Callable[[], float] = time.time, max_attempts: int = 1,
+                 retry_policy: Optional[CooldownPolicy] = None,
+                 rate_limiter: Optional[TokenBucketLimiter] = None):
+        self.store = store
+        self.codec = codec
+        self._symbols = symbols
+        self._clock = clock
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter
+        self.retries = RetryScheduler(self._auto_grant, retry_policy, clock)
+        self._policy_data: Optional[Dict] = None
+        if not self._sync_retry_policy() and retry_policy is not None:
+            self.retries.start()
+
+    def _timestamp(self) -> float:
+        return self._clock()
+
+    def display(self, elements: Sequence[str]) -> str:
+        """Строка комбинации из символов элементов"""
+        return " + ".join([self._symbols.get(e, "❓") for e in elements])
+
+    # ---------- Запросы ----------
+    def _request(self, user_id: str, user_name: str, spell_name: str, level: int,
+                 request_type: str) -> Optional[ClientRequest]:
+        """
+        Единственный путь создания запросов игроков. None, если такой же запрос
+        (игрок, заклинание, тип) уже ожидает или игрок превысил лимит частоты.
+        Повтор отсеивается раньше лимита и не тратит токен; окончательную проверку
+        на повтор хранилище делает атомарно при добавлении
+        """
+        if self.store.has_pending_request(user_id, spell_name, request_type):
+            self.store.metrics.request_rejected(REJECTED_DUPLICATE, user_id)
+            return None
+        if self.rate_limiter is not None and not self.rate_limiter.allow(user_id):
+            self.store.metrics.request_rejected(REJECTED_RATE, user_id)
+            return None
+        req = self.store.create_request({
+            "user_name": user_name,
+            "user_id": user_id,
+            "spell_name": spell_name,
+            "level": level,
+            "timestamp": self._timestamp(),
+            "status": STATUS_PENDING,
+            "type": request_type
+        }, unique=True)
+        if req is None:
+            self.store.metrics.request_rejected(REJECTED_DUPLICATE, user_id)
+        return req
+
+    def can_request_combo(self, user_id: str, spell_name: str) -> bool:
+        return (spell_name not in self.store.spell_combinations
+                and self.store.find_request(user_id, spell_name) is None)
+
+    def request_combo(self, user_id: str, user_name: str, spell_name: str,
+                      level: int) -> Optional[ClientRequest]:
+        """Запрос комбинации мастеру; None, если комбинация уже есть, запрос ожидает или превышен лимит"""
+        if spell_name in self.store.spell_combinations:
+            return None
+        return self._request(user_id, user_name, spell_name, level, REQUEST_NEW)
+
+    def can_request_retry(self, user_id: str, spell_name: str) -> bool:
+        block = self.store.get_block(spell_name)
+        if block is None or attempts_left(block):
+            return False
+        # Попытка вернется сама - просить мастера незачем
+        if self.retry_due(spell_name) is not None:
+            return False
+        pending = self.store.find_request(user_id, spell_name)
+        return pending is None or pending['type'] != REQUEST_REPEAT
+
+    def request_retry(self, user_id: str, user_name: str, spell_name: str) -> Optional[ClientRequest]:
+        """Запрос новой попытки; None, если попытка еще есть, запрос уже отправлен или превышен лимит"""
+        block = self.store.get_block(spell_name)
+        if block is None or attempts_left(block) or self.retry_due(spell_name) is not None:
+            return None
+        # Уже отправленный запрос отсеивает само хранилище
+        return self._request(user_id, user_name, spell_name, block['level'], REQUEST_REPEAT)
+
+    def process_request(self, request: ClientRequest, elements: Optional[Sequence[str]] = None):
+        """
+        Мастер обрабатывает запрос, при необходимости сохраняя комбинацию.
+        Обработанный повторный запрос возвращает блоку попытки
+        """
+        if elements is not None:
+            self.save_combo(request['spell_name'], elements)
+        if request['type'] == REQUEST_REPEAT:
+            self.grant_retry(request['spell_name'])
+        self.store.set_request_status(request, STATUS_PROCESSED)
+
+    def reject_request(self, request: ClientRequest):
+        self.store.delete_request(request['id'])
+
+    # ---------- Комбинации ----------
+    def save_combo(self, spell_name: str, elements: Sequence[str]):
+        """Сохраняет комбинацию; существующий блок получает новые элементы"""
+        self.store.save_combination(spell_name, list(elements), self.display(elements))
+
+    def generate_combos(self, spells: Iterable[Tuple[str, int]], seed: int,
+                        allowed: Optional[Iterable[str]] = None, max_repeats: Optional[Dict[int, int]] = None,
+                        unique: bool = True, overwrite: bool = False) -> GeneratedBatch:
+        """
+        Комбинации для многих заклинаний без сохранения (для предпросмотра).
+        Без overwrite заклинания с готовой комбинацией пропускаются;
+        с unique новые комбинации не совпадают ни друг с другом, ни с сохраненными у других заклинаний
+        """
+        existing = self.store.spell_combinations
+        spells = [(name, level) for name, level in dict(spells).items() if overwrite or name not in existing]
+        names = {name for name, _ in spells}
+        taken = [combo['elements'] for name, combo in list(existing.items()) if name not in names]
+        generator = CombinationGenerator(self.codec.elements, allowed, max_repeats, unique)
+        return generator.generate(spells, seed, taken)
+
+    def commit_combos(self, combos: Dict[str, Sequence[str]]) -> int:
+        """
+        Сохраняет пакет комбинаций одним обновлением хранилища и отмечает
+        обработанными ожидающие запросы этих комбинаций. Возвращает число закрытых запросов
+        """
+        self.store.save_combinations({name: (list(elements), self.display(elements))
+                                      for name, elements in combos.items()})
+        processed = 0
+        for req in self.store.requests_with_status(STATUS_PENDING):
+            if req['type'] == REQUEST_NEW and req['spell_name'] in combos:
+                self.store.set_request_status(req, STATUS_PROCESSED)
+                processed += 1
+        return processed
+
+    def delete_spell(self, spell_name: str):
+        self.retries.cancel(spell_name)
+        self.store.delete_spell(spell_name)
+
+    # ---------- Игра ----------
+    def start_game(self, spell_name: str, level: int, user_name: str = "Система") -> GameBlock:
+        """Возвращает блок заклинания, создавая его при первом вызове"""
+        spell_combo = self.store.spell_combinations.get(spell_name, {})
+        elements = spell_combo.get('elements', [UNKNOWN_ELEMENT] * level)
+        created_at = self._timestamp()
+        return self.store.get_or_create_block(spell_name, lambda block_id: GameBlock(
+            block_id, spell_name, level, elements,
+            max_attempts=self.max_attempts, created_by=user_name, created_at=created_at))
+
+    def match(self, guesses: Sequence[str], remaining: Sequence[str]) -> List[str]:
+        """
+        Элементы догадки, совпавшие с еще не угаданной частью комбинации; каждый элемент
+        комбинации засчитывается один раз (🔥+❄️+🔥 против 🔥🔥 откроет два 🔥).
+        В комбинации не больше 9 элементов, и проверка по списку быстрее кодирования
+        в ElementCodec (см. check_codec.py), поэтому кодек здесь не используется
+        """
+        guessed = []
+        remaining = list(remaining)
+        for element in guesses:
+            if element in remaining:
+                guessed.append(element)
+                remaining.remove(element)
+        return guessed
+
+    def submit_guess(self, spell_name: str, guesses: Sequence[str]) -> Optional[GuessResult]:
+        """
+        Проверяет догадку и тратит попытку. Угаданные элементы открываются по порядку.
+        None, если блока нет; accepted=False, если попыток не осталось
+        """
+        block = self.store.get_block(spell_name)
+        if block is None:
+            return None
+        if not attempts_left(block):
+            return GuessResult(False, [], list(block['guessed']), block['attempts'], is_solved(block))
+        result = GuessResult(True)
+
+        def apply_guess(current: Dict) -> Dict:
+            # При конфликте с другой сессией вызывается повторно на свежем состоянии
+            guessed, attempts = current['guessed'], current['attempts']
+            if attempts >= current['max_attempts']:
+                result.accepted = False
+                return {}
+            result.accepted = True
+            result.matched = self.match(guesses, current['elements'][len(guessed):])
+            return {"guessed": guessed + result.matched, "attempts": attempts + 1,
+                    "last_played": self._timestamp()}
+
+        if self.store.update_block(block, apply_guess) is None:
+            return None
+        result.guessed = list(block['guessed'])
+        result.attempts = block['attempts']
+        result.solved = is_solved(block)
+        if result.accepted and not result.solved and not attempts_left(block):
+            self._schedule_retry(block)
+        return result
+
+    def finish_game(self, spell_name: str):
+        """Просмотр полностью разгаданного блока расходует попытку"""
+        block = self.store.get_block(spell_name)
+        if block is not None:
+            self.store.update_progress(block, lambda guessed, attempts: (guessed, attempts + 1),
+                                       self._timestamp())
+
+    def grant_retry(self, spell_name: str) -> bool:
+        """Возвращает блоку все попытки, угаданные элементы сохраняются"""
+        self.retries.cancel(spell_name)
+        block = self.store.get_block(spell_name)
+        if block is None:
+            return False
+        self.store.update_progress(block, lambda guessed, attempts: (guessed, 0))
+        return True
+
+    def reset_progress(self, spell_name: str):
+        self.retries.cancel(spell_name)
+        block = self.store.get_block(spell_name)
+        if block is not None:
+            self.store.reset_progress(block)
+
+    # ---------- Автоматические попытки ----------
+    def _schedule_retry(self, block: GameBlock) -> Optional[float]:
+        used_at = block['last_played'] or self._timestamp()
+        return self.retries.schedule(block['spell_name'], block['level'], used_at, block['version'])
+
+    def _sync_retry_policy(self, fresh: bool = False) -> bool:
+        """
+        Применяет политику из настроек хранилища, если она отличается от текущей
+        (например, ее поменял мастер в другом процессе). True, если политика сменилась
+        """
+        data = self.store.get_setting(RETRY_POLICY_SETTING, fresh)
+        if data is None or data == self._policy_data:
+            return False
+        self._policy_data = data
+        self.retries.set_policy(CooldownPolicy.from_dict(data))
+        self.retries.start()
+        self.reschedule_retries()
+        return True
+
+    def _auto_grant(self, spell_name: str, version: int) -> bool:
+        """
+        Возврат попытки из потока планировщика. Срабатывает, только если блок
+        не менялся с момента планирования: в общем режиме версию проверяет и база,
+        поэтому несколько процессов не вернут одну попытку дважды.
+        Перед возвратом политика перечитывается из базы: если мастер ее сменил,
+        возвраты уже перепланированы по новой
+        """
+        if self._sync_retry_policy(fresh=True):
+            return False
+        block = self.store.get_block(spell_name)
+        if block is None or block['version'] != version:
+            return False
+        return self.store.compare_and_set(block, version, {"attempts": 0})
+
+    def retry_due(self, spell_name: str) -> Optional[float]:
+        """
+        Когда блок получит попытку сам (время эпохи); None - только по запросу мастеру.
+        Блок, попытки которого закончились в другом процессе или до перезапуска,
+        планируется при первом обращении
+        """
+        self._sync_retry_policy()
+        block = self.store.get_block(spell_name)
+        if block is None or block_status(block) != BLOCK_WAITING:
+            return None
+        return self._schedule_retry(block)
+
+    def set_retry_policy(self, policy: CooldownPolicy):
+        """Новая политика перерывов для всех процессов стола; ожидающие блоки планируются заново"""
+        self._policy_data = policy.to_dict()
+        self.store.set_setting(RETRY_POLICY_SETTING, self._policy_data)
+        self.retries.set_policy(policy)
+        self.retries.start()
+        self.reschedule_retries()
+
+    def reschedule_retries(self) -> int:
+        """Планирует возврат попыток всем ожидающим блокам; возвращает число запланированных"""
+        scheduled = 0
+        for block in self.store.blocks_with_status(BLOCK_WAITING):
+            if self._schedule_retry(block) is not None:
+                scheduled += 1
+        return scheduled
@@ -0,0 +1,76 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import random
+
+# Сколько раз пытаться подобрать комбинацию, не совпадающую с уже занятыми
+MAX_TRIES = 200
+
+
+@dataclass
+class GeneratedBatch:
+    """Сгенерированные комбинации для предпросмотра перед сохранением"""
+    seed: int
+    combos: Dict[str, List[str]] = field(default_factory=dict)
+    levels: Dict[str, int] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)    # не удалось подобрать уникальную комбинацию
+
+
+# ========== ГЕНЕРАЦИЯ КОМБИНАЦИЙ ==========
+class CombinationGenerator:
+    """
+    Случайные комбинации для многих заклинаний сразу с ограничениями:
+    - allowed - какие элементы можно использовать
+    - max_repeats - сколько раз один элемент может входить в комбинацию данного уровня
+    - unique - у разных заклинаний не бывает одинакового набора элементов
+      (сравниваются мультимножества: угадывание от порядка не зависит)
+    Результат определяется зерном и порядком заклинаний.
+    """
+
+    def __init__(self, elements: Sequence[str], allowed: Optional[Iterable[str]] = None,
+                 max_repeats: Optional[Dict[int, int]] = None, unique: bool = True):
+        allowed = set(elements if allowed is None else allowed)
+        self.elements = [e for e in elements if e in allowed]
+        if not self.elements:
+            raise ValueError("Нужен хотя бы один разрешенный элемент")
+        self.max_repeats = max_repeats or {}
+        self.unique = unique
+
+    def _combination(self, rng: random.Random, level: int) -> Optional[List[str]]:
+        limit = self.max_repeats.get(level, level)
+        counts: Dict[str, int] = {}
+        combination = []
+        for _ in range(level):
+            available = [e for e in self.elements if counts.get(e, 0) < limit]
+            if not available:
+                return None
+            element = rng.choice(available)
+            counts[element] = counts.get(element, 0) + 1
+            combination.append(element)
+        return combination
+
+    def generate(self, spells: Iterable[Tuple[str, int]], seed: int,
+                 taken: Iterable[Sequence[str]] = ()) -> GeneratedBatch:
+        """
+        Комбинации для пар (название, уровень). taken - комбинации, которые уже заняты
+        (например, сохраненные у других заклинаний); при unique новые с ними не совпадают
+        """
+        rng = random.Random(seed)
+        used = {tuple(sorted(combo)) for combo in taken} if self.unique else set()
+        batch = GeneratedBatch(seed)
+        for spell_name, level in spells:
+            for _ in range(MAX_TRIES if self.unique else 1):
+                combination = self._combination(rng, level)
+                if combination is None:
+                    break
+                key = tuple(sorted(combination))
+                if key not in used:
+                    break
+                combination = None
+            if combination is None:
+                batch.skipped.append(spell_name)
+                continue
+            if self.unique:
+                used.add(key)
+            batch.combos[spell_name] = combination
+            batch.levels[spell_name] = level
+        return batch
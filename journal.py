@@ -0,0 +1,382 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import sys
+import threading
+import time
+
+from persistence import Persistence, WriteOp, USER_LOAD_WINDOW
+from records import to_json
+from store import STATUS_PENDING
+
+# Снимок состояния пишется после стольких событий журнала
+SNAPSHOT_EVERY = 10000
+SNAPSHOT_FILE = "snapshot.jsonl"
+HISTORY_FILE = "history.jsonl"
+SEGMENT_PREFIX = "journal."
+SEGMENT_SUFFIX = ".jsonl"
+
+# Вид записи (как в WriteOp) → типы событий сохранения и удаления
+EVENT_TYPES = {
+    "combo": ("combo_saved", "combo_deleted"),
+    "block": ("block_saved", "block_deleted"),
+    "request": ("request_saved", "request_deleted"),
+    "user": ("user_saved", "user_deleted"),
+    "setting": ("setting_saved", "setting_deleted"),
+    "spell_requests": (None, "spell_requests_deleted"),
+}
+EVENT_KINDS = {event: (kind, deleted) for kind, events in EVENT_TYPES.items()
+               for deleted, event in enumerate(events) if event}
+
+
+def _segment_name(first_seq: int) -> str:
+    return f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}"
+
+
+def _header(kind: str, key, data: Optional[Dict]) -> Dict:
+    """Заголовок события: тип, ключ и поля, по которым load_state фильтрует без разбора данных"""
+    header = {"type": EVENT_TYPES[kind][data is None], "key": key}
+    if kind == "request" and data is not None:
+        header["status"] = data["status"]
+        header["spell"] = data["spell_name"]
+    elif kind == "user" and data is not None:
+        header["last_active"] = data["last_active"]
+    return header
+
+
+# ========== ЖУРНАЛ СОБЫТИЙ ==========
+class JournalPersistence(Persistence):
+    """
+    Хранение в виде журнала событий только на дозапись плюс периодические снимки.
+
+    Каждая операция пакета write_batch становится типизированным событием
+    (combo_saved, block_saved, request_deleted, ...) с номером seq и временем.
+    Строка события: JSON-заголовок, табуляция, JSON данных записи -
+    при восстановлении данные не разбираются, а хранятся строкой до load_state.
+    Пакет пишется одним куском в конец текущего сегмента; fsync объединяется:
+    поток, дождавшийся своей очереди, синхронизирует все, что записано до него,
+    и остальным ждущим потокам fsync уже не нужен.
+
+    Раз в snapshot_every событий текущее состояние пишется в снимок
+    (временный файл и os.replace), а журнал продолжается в новом сегменте.
+    При старте загружается снимок и проигрываются только события после него;
+    оборванная при сбое последняя строка отбрасывается.
+    Старые сегменты не удаляются (keep_segments=True) и служат журналом аудита: events().
+
+    В памяти держатся только ожидающие заявки. Обработанные дописываются в history.jsonl,
+    а в памяти остается индекс id → (смещение строки, заклинание); load_history и
+    iter_history читают строки по смещениям. Удаление заявки или возврат в ожидание
+    дописывает в историю строку-надгробие. При старте история сверяется с журналом по seq:
+    строки новее журнала отрезаются, недостающие дописываются.
+
+    Общий режим для нескольких процессов не поддерживается (shared=False).
+    """
+
+    def __init__(self, directory: str, snapshot_every: int = SNAPSHOT_EVERY,
+                 fsync: bool = True, keep_segments: bool = True, pending_status: str = STATUS_PENDING):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.keep_segments = keep_segments
+        self.pending_status = pending_status
+        # Порядок захвата: _sync_lock, затем _lock
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        # Текущее состояние: вид → ключ → (заголовок, данные строкой JSON); заявки - только ожидающие
+        self._records: Dict[str, Dict[object, Tuple[Dict, str]]] = {
+            kind: {} for kind in ("combo", "block", "request", "user", "setting")}
+        # Обработанные заявки: id → (смещение строки в history.jsonl, заклинание)
+        self._history: Dict[int, Tuple[int, str]] = {}
+        self._history_path = os.path.join(directory, HISTORY_FILE)
+        self._history_size = 0
+        # Изменения заявок (seq, заголовок, данные), еще не перенесенные в историю
+        self._history_ops: List[Tuple[int, Dict, Optional[str]]] = []
+        self._last_ids = {"block": 0, "request": 0}
+        self._seq = 0
+        self._snapshot_seq = 0
+        self._synced_seq = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._file = open(self._segment_path, "a", encoding="utf-8")
+
+    # ---------- Состояние ----------
+    def _apply(self, header: Dict, raw: Optional[str], seq: int):
+        kind, deleted = EVENT_KINDS[header["type"]]
+        key = header["key"]
+        if kind in ("request", "spell_requests"):
+            self._history_ops.append((seq, header, raw))
+        if kind == "spell_requests":
+            requests = self._records["request"]
+            for request_id in [rid for rid, (h, _) in requests.items() if h["spell"] == key]:
+                del requests[request_id]
+            return
+        if deleted:
+            self._records[kind].pop(key, None)
+            return
+        if kind == "request" and header["status"] != self.pending_status:
+            self._records[kind].pop(key, None)
+        else:
+            self._records[kind][key] = (header, raw)
+        if kind in self._last_ids and key > self._last_ids[kind]:
+            self._last_ids[kind] = key
+
+    def _write_history(self, ops: List[Tuple[int, Dict, Optional[str]]]):
+        """Переносит изменения заявок в history.jsonl и индекс (вызывается под _lock)"""
+        lines = []
+        for seq, header, raw in ops:
+            kind, deleted = EVENT_KINDS[header["type"]]
+            key = header["key"]
+            if kind == "spell_requests":
+                removed = [rid for rid, (_, spell) in self._history.items() if spell == key]
+            elif deleted or header["status"] == self.pending_status:
+                removed = [key] if key in self._history else []
+            else:
+                line = f"{json.dumps(dict(header, seq=seq), ensure_ascii=False)}\t{raw}\n".encode("utf-8")
+                self._history[key] = (self._history_size, sys.intern(header["spell"]))
+                self._history_size += len(line)
+                lines.append(line)
+                continue
+            for request_id in removed:
+                del self._history[request_id]
+                tombstone = {"type": EVENT_TYPES["request"][1], "key": request_id, "seq": seq}
+                line = f"{json.dumps(tombstone)}\tnull\n".encode("utf-8")
+                self._history_size += len(line)
+                lines.append(line)
+        if lines:
+            self._history_file.write(b"".join(lines))
+            self._history_file.flush()
+
+    def _read_lines(self, path: str) -> Iterator[Tuple[Dict, Optional[str], int]]:
+        """Строки файла событий: (заголовок, данные, смещение конца строки); оборванная строка не выдается"""
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                offset += len(line)
+                head, _, raw = line.decode("utf-8").rstrip("\n").partition("\t")
+                yield json.loads(head), (raw if raw != "null" else None), offset
+
+    def _segments(self) -> List[Tuple[int, str]]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                first_seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                segments.append((first_seq, os.path.join(self.directory, name)))
+        return sorted(segments)
+
+    def _recover(self):
+        """Загружает последний снимок и проигрывает хвост журнала после него"""
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            lines = self._read_lines(snapshot_path)
+            meta = next(lines)[0]
+            for header, raw, _ in lines:
+                self._apply(header, raw, meta["seq"])
+            self._seq = self._snapshot_seq = self._synced_seq = meta["seq"]
+            self._last_ids.update(meta["last_ids"])
+
+        segments = self._segments()
+        # Сегменты, целиком вошедшие в снимок, пропускаем, не читая
+        start = 0
+        for i, (first_seq, _) in enumerate(segments):
+            if first_seq <= self._seq + 1:
+                start = i
+        for first_seq, path in segments[start:]:
+            good = 0
+            for header, raw, offset in self._read_lines(path):
+                good = offset
+                if header["seq"] > self._seq:
+                    self._apply(header, raw, header["seq"])
+                    self._seq = header["seq"]
+            if good < os.path.getsize(path):
+                # Хвост, оборванный при сбое, отрезаем, чтобы дозапись шла с целой строки
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+        self._synced_seq = self._seq
+        if segments and segments[-1][0] > self._snapshot_seq:
+            self._segment_path = segments[-1][1]
+        else:
+            self._segment_path = os.path.join(self.directory, _segment_name(self._seq + 1))
+        self._recover_history()
+
+    def _recover_history(self):
+        """Строит индекс истории и сверяет ее с проигранным журналом"""
+        history_seq = good = 0
+        if os.path.exists(self._history_path):
+            start = 0
+            for header, _, offset in self._read_lines(self._history_path):
+                # Строки, записанные после последнего сохраненного события журнала, отбрасываем
+                if header["seq"] > self._seq:
+                    break
+                if EVENT_KINDS[header["type"]][1]:
+                    self._history.pop(header["key"], None)
+                else:
+                    self._history[header["key"]] = (start, sys.intern(header["spell"]))
+                history_seq = header["seq"]
+                start = good = offset
+            if good < os.path.getsize(self._history_path):
+                with open(self._history_path, "r+b") as f:
+                    f.truncate(good)
+        self._history_size = good
+        self._history_file = open(self._history_path, "ab")
+        # Дописываем изменения, которые есть в журнале (или в снимке старого формата), но не дошли до истории
+        ops, self._history_ops = self._history_ops, []
+        self._write_history([op for op in ops if op[0] > history_seq])
+        if self.fsync:
+            os.fsync(self._history_file.fileno())
+
+    def _parsed(self, kind: str) -> Iterator[Tuple[object, Dict, str]]:
+        with self._lock:
+            records = list(self._records[kind].items())
+        for key, (header, raw) in records:
+            yield key, header, raw
+
+    # ---------- Чтение ----------
+    def load_state(self, pending_status: str) -> Dict:
+        combos = {key: json.loads(raw) for key, _, raw in self._parsed("combo")}
+        blocks = [json.loads(raw) for _, _, raw in sorted(self._parsed("block"), key=lambda r: r[0])]
+        requests = [json.loads(raw) for _, _, raw in sorted(self._parsed("request"), key=lambda r: r[0])]
+        since = time.time() - USER_LOAD_WINDOW
+        users = {key: json.loads(raw) for key, header, raw in self._parsed("user")
+                 if header["last_active"] > since}
+        settings = {key: json.loads(raw) for key, _, raw in self._parsed("setting")}
+        with self._lock:
+            last_ids = dict(self._last_ids)
+            processed = len(self._history)
+        return {
+            "spell_combinations": combos,
+            "game_blocks": blocks,
+            "client_requests": requests,
+            "users": users,
+            "settings": settings,
+            "last_block_id": last_ids["block"],
+            "last_request_id": last_ids["request"],
+            "processed_requests": processed,
+        }
+
+    def _history_offsets(self) -> List[int]:
+        """Смещения строк обработанных заявок по возрастанию id"""
+        with self._lock:
+            if not self._history_file.closed:
+                self._history_file.flush()
+            return [offset for _, (offset, _) in sorted(self._history.items())]
+
+    def _read_history(self, offsets: List[int]) -> Iterator[Dict]:
+        with open(self._history_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield json.loads(f.readline().decode("utf-8").rstrip("\n").partition("\t")[2])
+
+    def load_history(self, pending_status: str, limit: Optional[int] = None) -> List[Dict]:
+        offsets = self._history_offsets()
+        if limit is not None:
+            offsets = offsets[-limit:] if limit else []
+        return list(self._read_history(offsets))
+
+    def iter_history(self, pending_status: str) -> Iterator[Dict]:
+        # В памяти только смещения, записи читаются с диска по одной
+        yield from self._read_history(self._history_offsets())
+
+    def events(self, since_seq: int = 0) -> Iterator[Dict]:
+        """Журнал аудита: события с seq > since_seq по порядку (из сохраненных сегментов)"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+        for _, path in self._segments():
+            for header, raw, _ in self._read_lines(path):
+                if header["seq"] > since_seq:
+                    header["data"] = json.loads(raw) if raw is not None else None
+                    yield header
+
+    # ---------- Запись ----------
+    def allocate_id(self, kind: str) -> int:
+        """Следующий id ("block" или "request"); журнал пишет один процесс, поэтому хватает счетчика в памяти"""
+        with self._lock:
+            self._last_ids[kind] += 1
+            return self._last_ids[kind]
+
+    def write_batch(self, ops: List[WriteOp]):
+        if not ops:
+            return
+        now = round(time.time(), 3)
+        with self._lock:
+            chunk = []
+            for kind, key, data in ops:
+                self._seq += 1
+                header = _header(kind, key, data)
+                raw = json.dumps(data, ensure_ascii=False, default=to_json) if data is not None else None
+                self._apply(header, raw, self._seq)
+                event = dict(header, seq=self._seq, ts=now)
+                chunk.append(f"{json.dumps(event, ensure_ascii=False)}\t{raw or 'null'}\n")
+            self._file.write("".join(chunk))
+            self._file.flush()
+            # История пишется после журнала: при сбое между ними недостающее восстановится из журнала
+            ops, self._history_ops = self._history_ops, []
+            self._write_history(ops)
+            seq = self._seq
+            snapshot_due = seq - self._snapshot_seq >= self.snapshot_every
+        if snapshot_due:
+            self.snapshot()
+        else:
+            self._sync(seq)
+
+    def _sync(self, seq: int):
+        """Групповой fsync: один вызов покрывает все события, записанные к его началу"""
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._lock:
+                target = self._seq
+                fds = (self._file.fileno(), self._history_file.fileno())
+            for fd in fds:
+                os.fsync(fd)
+            self._synced_seq = target
+
+    def snapshot(self):
+        """Пишет снимок текущего состояния и начинает новый сегмент журнала"""
+        with self._sync_lock:
+            with self._lock:
+                seq = self._seq
+                if seq == self._snapshot_seq:
+                    return
+                meta = {"type": "snapshot", "seq": seq, "last_ids": self._last_ids, "ts": time.time()}
+                lines = [f"{json.dumps(meta)}\tnull\n"]
+                for records in self._records.values():
+                    lines.extend(f"{json.dumps(header, ensure_ascii=False)}\t{raw}\n"
+                                 for header, raw in records.values())
+                # Новые события пойдут в следующий сегмент; старый закрываем целиком записанным.
+                # Обработанных заявок в снимке нет, поэтому история должна лечь на диск до него
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                    os.fsync(self._history_file.fileno())
+                self._file.close()
+                old_segments = self._segments()
+                # Сразу отмечаем снимок, чтобы писатели, пришедшие во время записи файла, не начинали новый
+                self._snapshot_seq = seq
+                self._segment_path = os.path.join(self.directory, _segment_name(seq + 1))
+                self._file = open(self._segment_path, "a", encoding="utf-8")
+
+            path = os.path.join(self.directory, SNAPSHOT_FILE)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._synced_seq = max(self._synced_seq, seq)
+            if not self.keep_segments:
+                for _, segment_path in old_segments:
+                    os.remove(segment_path)
+
+    def close(self):
+        with self._sync_lock, self._lock:
+            for f in (self._file, self._history_file):
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
@@ -0,0 +1,366 @@
+"""
+Нагрузочный генератор: N одновременных игроков и мастер на одном хранилище.
+
+Запуск: python load_test.py [--players 1 5 10 20 50] [--steps 20] [--think 0]
+        python load_test.py --engine-only [--players 1 10 50 100 200] [--steps 200]
+
+Каждый игрок - поток со своей сессией Streamlit (AppTest), все сессии делят
+одно хранилище Dnd.py, как на сервере. Шаг игрока - один настоящий rerun
+страницы: действие (запрос комбинации, начало игры, догадка, запрос новой
+попытки) и полная отрисовка player_interface через Dnd.main(), без браузера.
+Мастер в отдельной сессии обрабатывает очередь и перерисовывает свою панель.
+Для каждого N печатает пропускную способность, распределение времени rerun
+игрока, долю rerun дольше секунды и время rerun мастера - по ним видно,
+со скольких игроков страница начинает отвечать дольше секунды.
+
+С --engine-only тот же сценарий вызывает только движок и чтения страницы,
+без Streamlit: время шага - микросекунды, зато видно ожидание на блокировках
+хранилища (доля захватов, которым пришлось ждать, и суммарное ожидание).
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from catalog import load_catalog
+from codec import ElementCodec
+from engine import GameEngine, REQUEST_REPEAT, attempts_left
+from presence import new_session_id
+from render import BlockRenderer, PLAYER_VIEW
+from store import SharedStore, STATUS_PENDING, ORDER_RECENT
+
+ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
+PAGE_SIZE = 20
+HOST_INTERVAL = 0.05
+SLOW_STEP = 1.0
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+# ========== БЛОКИРОВКИ С ЗАМЕРОМ ==========
+class LockStats:
+    def __init__(self):
+        self.acquired = itertools.count()
+        self.waits: List[float] = []
+
+    def count(self) -> int:
+        # next() сдвинул бы счетчик; repr показывает текущее значение, например count(42)
+        return int(repr(self.acquired)[len("count("):-1])
+
+    def report(self) -> Dict[str, float]:
+        return {
+            "acquired": self.count(),
+            "contended": len(self.waits),
+            "wait_ms": sum(self.waits) * 1000,
+        }
+
+
+class CountingLock:
+    """Обычный Lock, который считает захваты и время ожидания занятой блокировки"""
+
+    def __init__(self, stats: LockStats):
+        self._lock = threading.Lock()
+        self._stats = stats
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        next(self._stats.acquired)
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        # list.append атомарен под GIL
+        self._stats.waits.append(time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# ========== СЦЕНАРИИ ==========
+def player_step(engine: GameEngine, catalog, user_id: str, name: str, rng: random.Random):
+    """Одно действие игрока со случайным заклинанием: то, что он сделал бы на этом шаге"""
+    store = engine.store
+    spell = catalog.get_by_name(rng.choice(catalog.names))
+    block = store.get_block(spell['name'])
+    if spell['name'] not in store.spell_combinations:
+        engine.request_combo(user_id, name, spell['name'], spell['level'])
+    elif block is None:
+        engine.start_game(spell['name'], spell['level'], name)
+    elif attempts_left(block):
+        remaining = block['level'] - len(block['guessed'])
+        engine.submit_guess(spell['name'], [rng.choice(ELEMENTS) for _ in range(remaining)])
+    else:
+        engine.request_retry(user_id, name, spell['name'])
+    return spell
+
+
+def host_step(engine: GameEngine, rng: random.Random):
+    """Мастер: создает комбинации по запросам и возвращает попытки по запросам повтора"""
+    store = engine.store
+    store.metrics.snapshot()
+    for req in store.requests_with_status(STATUS_PENDING)[:PAGE_SIZE]:
+        if req['type'] == REQUEST_REPEAT or req['spell_name'] in store.spell_combinations:
+            engine.process_request(req)
+        else:
+            engine.process_request(req, [rng.choice(ELEMENTS) for _ in range(req['level'])])
+
+
+class LoadRun:
+    def __init__(self, players: int, steps: int, think: float, seed: int = 0):
+        self.lock_stats: Dict[str, LockStats] = {}
+        store = SharedStore(lock_factory=self._lock)
+        self.engine = GameEngine(store, ElementCodec(ELEMENTS), {})
+        self.renderer = BlockRenderer(ELEMENTS, {}, {})
+        self.catalog = load_catalog()
+        self.players = players
+        self.steps = steps
+        self.think = think
+        self.seed = seed
+        self.latencies: List[float] = []
+        self.stopped = threading.Event()
+
+    def _lock(self, name: str) -> CountingLock:
+        return CountingLock(self.lock_stats.setdefault(name, LockStats()))
+
+    def _player_page(self, user_id: str, spell_name: str):
+        """Чтения, которые делает player_interface при rerun"""
+        store = self.engine.store
+        store.touch_user(user_id)
+        self.catalog.search_index.search(spell_name[:3], limit=100)
+        store.get_block(spell_name)
+        store.find_request(user_id, spell_name)
+        store.user_requests(user_id, STATUS_PENDING)
+        for block in itertools.islice(store.iter_blocks(ORDER_RECENT), PAGE_SIZE):
+            self.renderer.block_row(block, PLAYER_VIEW)
+
+    def player(self, index: int):
+        rng = random.Random(self.seed * 100003 + index)
+        engine, store = self.engine, self.engine.store
+        user_id = new_session_id()
+        name = f"Игрок_{index}"
+        store.register_user(user_id, name, "player")
+        latencies = []
+        for _ in range(self.steps):
+            started = time.perf_counter()
+            spell = player_step(engine, self.catalog, user_id, name, rng)
+            self._player_page(user_id, spell['name'])
+            latencies.append(time.perf_counter() - started)
+            if self.think:
+                time.sleep(rng.uniform(0, 2 * self.think))
+        self.latencies.extend(latencies)
+
+    def host(self):
+        rng = random.Random(self.seed)
+        while not self.stopped.is_set():
+            host_step(self.engine, rng)
+            self.stopped.wait(HOST_INTERVAL)
+
+    def run(self) -> Dict[str, float]:
+        host = threading.Thread(target=self.host, daemon=True)
+        players = [threading.Thread(target=self.player, args=(i,)) for i in range(self.players)]
+        started = time.perf_counter()
+        host.start()
+        for thread in players:
+            thread.start()
+        for thread in players:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        self.stopped.set()
+        host.join()
+
+        return summarize(self.latencies, elapsed)
+
+
+# ========== RERUN СТРАНИЦ ==========
+def session_page(repo: str, role: str, seed: int):
+    """
+    Скрипт одной сессии для AppTest: каждый rerun - действие (шаг игрока или
+    обработка очереди мастером) и полная отрисовка страницы, как после клика.
+    AppTest выполняет только текст функции, поэтому все импорты - внутри
+    """
+    import random
+    import sys
+    sys.path.insert(0, repo)
+    import streamlit as st
+    import Dnd
+    import load_test
+    from presence import new_session_id
+
+    if "load_rng" not in st.session_state:
+        # Первый rerun - вход в игру
+        st.session_state.load_rng = random.Random(seed)
+        st.session_state.user_id = new_session_id()
+        st.session_state.user_name = f"{'Мастер' if role == 'host' else 'Игрок'}_{seed}"
+        st.session_state.user_type = role
+        st.session_state.current_game = None
+    elif role == "host":
+        load_test.host_step(Dnd.game_engine, st.session_state.load_rng)
+    else:
+        load_test.player_step(Dnd.game_engine, Dnd.spell_catalog, st.session_state.user_id,
+                              st.session_state.user_name, st.session_state.load_rng)
+    Dnd.main()
+
+
+class RerunLoad:
+    """
+    N сессий игроков и сессия мастера на одном процессе Streamlit; общее хранилище - кэш Dnd.py.
+    Скрипты сессий выполняются в потоках одного процесса и делят GIL, поэтому rerun
+    по сути идут по очереди. AppTest к тому же не выполняет прогоны параллельно
+    (у них общий Runtime), поэтому rerun выполняются по одному, а время rerun считается
+    от клика, вместе с ожиданием в очереди - как его видит игрок
+    """
+
+    def __init__(self, players: int, steps: int, think: float, seed: int = 0):
+        self.players = players
+        self.steps = steps
+        self.think = think
+        self.seed = seed
+        self.latencies: List[float] = []
+        self.host_latencies: List[float] = []
+        self.errors: List[str] = []
+        self.stopped = threading.Event()
+        self._server = threading.Lock()
+
+    def _session(self, role: str, seed: int):
+        from streamlit.testing.v1 import AppTest
+        return AppTest.from_function(session_page, args=(REPO, role, seed), default_timeout=600)
+
+    def _rerun(self, app) -> Optional[float]:
+        """Время rerun от клика до конца отрисовки, вместе с ожиданием очереди; None при ошибке страницы"""
+        started = time.perf_counter()
+        with self._server:
+            app.run()
+        elapsed = time.perf_counter() - started
+        if app.exception:
+            self.errors.append(app.exception[0].message)
+            return None
+        return elapsed
+
+    def player(self, index: int):
+        rng = random.Random(self.seed * 100003 + index)
+        app = self._session("player", self.seed * 100003 + index)
+        self._rerun(app)
+        latencies = []
+        for _ in range(self.steps):
+            elapsed = self._rerun(app)
+            if elapsed is None:
+                break
+            latencies.append(elapsed)
+            if self.think:
+                time.sleep(rng.uniform(0, 2 * self.think))
+        self.latencies.extend(latencies)
+
+    def host(self):
+        app = self._session("host", self.seed)
+        self._rerun(app)
+        # Хотя бы один замер, даже если игроки закончили раньше
+        while True:
+            elapsed = self._rerun(app)
+            if elapsed is None:
+                return
+            self.host_latencies.append(elapsed)
+            if self.stopped.wait(HOST_INTERVAL):
+                return
+
+    def run(self) -> Dict[str, float]:
+        _fresh_app()
+        host = threading.Thread(target=self.host, daemon=True)
+        players = [threading.Thread(target=self.player, args=(i,)) for i in range(self.players)]
+        started = time.perf_counter()
+        host.start()
+        for thread in players:
+            thread.start()
+        for thread in players:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        self.stopped.set()
+        host.join()
+        if self.errors:
+            raise RuntimeError(self.errors[0])
+        result = summarize(self.latencies, elapsed)
+        result["host_p50_ms"] = statistics.median(self.host_latencies) * 1000
+        result["host_max_ms"] = max(self.host_latencies) * 1000
+        return result
+
+
+def _fresh_app():
+    """Новое пустое хранилище для каждого N: кэш ресурсов сбрасывается, Dnd.py импортируется заново"""
+    import streamlit as st
+    os.environ["DND_DB_PATH"] = ""
+    st.cache_resource.clear()
+    sys.modules.pop("Dnd", None)
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "steps": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+        "slow_share": sum(1 for t in latencies if t > SLOW_STEP) / len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, nargs="+", help="число игроков (по умолчанию 1 5 10 20 50, "
+                                                               "с --engine-only 1 10 50 100 200)")
+    parser.add_argument("--steps", type=int, help="действий на игрока (по умолчанию 20, с --engine-only 200)")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument("--engine-only", action="store_true", help="только движок, без rerun страниц")
+    args = parser.parse_args()
+
+    if args.engine_only:
+        run_engine(args.players or [1, 10, 50, 100, 200], args.steps or 200, args.think)
+    else:
+        run_reruns(args.players or [1, 5, 10, 20, 50], args.steps or 20, args.think)
+
+
+def run_reruns(player_counts: List[int], steps: int, think: float):
+    print(f"{'игроков':>8} {'rerun/с':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} "
+          f"{'max, мс':>9} {'> 1 с':>7} {'мастер p50, мс':>15} {'мастер max, мс':>15}")
+    for players in player_counts:
+        result = RerunLoad(players, steps, think).run()
+        print(f"{players:>8} {result['throughput']:>8.1f} {result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f} "
+              f"{result['p99_ms']:>9.0f} {result['max_ms']:>9.0f} {result['slow_share']:>7.1%} "
+              f"{result['host_p50_ms']:>15.0f} {result['host_max_ms']:>15.0f}")
+
+
+def run_engine(player_counts: List[int], steps: int, think: float):
+    print(f"{'игроков':>8} {'шагов/с':>10} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} "
+          f"{'max, мс':>9} {'> 1 с':>7}  ожидание блокировок")
+    for players in player_counts:
+        run = LoadRun(players, steps, think)
+        result = run.run()
+        contention = []
+        for name, stats in sorted(run.lock_stats.items()):
+            report = stats.report()
+            if report["contended"]:
+                share = report["contended"] / max(report["acquired"], 1)
+                contention.append(f"{name} {share:.1%}/{report['wait_ms']:.0f} мс")
+        print(f"{players:>8} {result['throughput']:>10,.0f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['max_ms']:>9.1f} {result['slow_share']:>7.1%}  "
+              f"{', '.join(contention) or 'нет'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+import heapq
+import threading
+import time
+
+# Окно, по которому считается число запросов в минуту, и ширина его корзин
+RATE_WINDOW = 300
+RATE_BUCKET = 10
+
+# Имена счетчиков
+BLOCKS = "blocks"
+COMBOS = "combos"
+PENDING = "pending"
+PROCESSED = "processed"
+SOLVED = "solved"
+SOLVED_ATTEMPTS = "solved_attempts"
+USERS_SEEN = "users_seen"
+USERS_EVICTED = "users_evicted"
+# Отклоненные запросы: сверх лимита частоты и повторы уже ожидающего запроса
+REJECTED_RATE = "rejected_rate"
+REJECTED_DUPLICATE = "rejected_duplicate"
+
+
+# ========== МЕТРИКИ ПАНЕЛИ МАСТЕРА ==========
+class DashboardMetrics:
+    """
+    Счетчики, которые хранилище обновляет при каждом изменении,
+    чтобы панель мастера читала готовые числа вместо перебора коллекций.
+    Кроме счетчиков хранит скользящее окно созданных запросов
+    для расчета запросов в минуту и число отклоненных запросов по игрокам.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        # (начало корзины, число запросов) по возрастанию времени
+        self._request_times: Deque[List[float]] = deque()
+        self._rejected_by_user: Dict[str, int] = {}
+
+    def get(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def adjust(self, name: str, delta: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + delta
+
+    def set(self, name: str, value: int):
+        with self._lock:
+            self._counters[name] = value
+
+    # ---------- Решенные блоки ----------
+    def block_solved(self, attempts: int):
+        with self._lock:
+            self._counters[SOLVED] = self._counters.get(SOLVED, 0) + 1
+            self._counters[SOLVED_ATTEMPTS] = self._counters.get(SOLVED_ATTEMPTS, 0) + attempts
+
+    def block_unsolved(self, attempts: int):
+        """Блок перестал быть решенным (сброс, новая комбинация или удаление)"""
+        with self._lock:
+            self._counters[SOLVED] = self._counters.get(SOLVED, 0) - 1
+            self._counters[SOLVED_ATTEMPTS] = self._counters.get(SOLVED_ATTEMPTS, 0) - attempts
+
+    def average_attempts(self) -> Optional[float]:
+        """Среднее число попыток на решенный блок или None, если решенных нет"""
+        solved = self.get(SOLVED)
+        return self.get(SOLVED_ATTEMPTS) / solved if solved else None
+
+    # ---------- Поток запросов ----------
+    def _trim(self, now: float):
+        while self._request_times and self._request_times[0][0] <= now - RATE_WINDOW:
+            self._request_times.popleft()
+
+    def request_created(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        start = now - now % RATE_BUCKET
+        with self._lock:
+            self._counters[PENDING] = self._counters.get(PENDING, 0) + 1
+            if self._request_times and self._request_times[-1][0] == start:
+                self._request_times[-1][1] += 1
+            else:
+                self._request_times.append([start, 1])
+            self._trim(now)
+
+    def requests_per_minute(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        with self._lock:
+            self._trim(now)
+            total = sum(count for _, count in self._request_times)
+        return total * 60 / RATE_WINDOW
+
+    # ---------- Отклоненные запросы ----------
+    def request_rejected(self, reason: str, user_id: str):
+        """reason - REJECTED_RATE или REJECTED_DUPLICATE"""
+        with self._lock:
+            self._counters[reason] = self._counters.get(reason, 0) + 1
+            self._rejected_by_user[user_id] = self._rejected_by_user.get(user_id, 0) + 1
+
+    def top_rejected(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Игроки с наибольшим числом отклоненных запросов: (user_id, число)"""
+        with self._lock:
+            return heapq.nlargest(limit, self._rejected_by_user.items(), key=lambda item: item[1])
+
+    def forget_users(self, user_ids: Iterable[str]):
+        """Вытесненные сессии больше не показываются среди нарушителей"""
+        with self._lock:
+            for user_id in user_ids:
+                self._rejected_by_user.pop(user_id, None)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Все счетчики и производные значения одним словарем"""
+        with self._lock:
+            data: Dict[str, float] = dict(self._counters)
+        data["average_attempts"] = self.average_attempts()
+        data["requests_per_minute"] = self.requests_per_minute()
+        return data
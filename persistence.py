@@ -0,0 +1,324 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import sqlite3
+import threading
+import time
+
+from records import to_json
+
+# Операция пакета записи: (вид, ключ, данные). data=None означает удаление.
+# Виды: "combo", "block", "request", "user", "setting" (настройка стола, например политика попыток),
+# "spell_requests" (удалить все запросы заклинания)
+WriteOp = Tuple[str, object, Optional[Dict]]
+
+# Пользователи, не заходившие дольше этого времени, не загружаются при старте
+USER_LOAD_WINDOW = 3600
+# Сколько строк истории читать за одно обращение к базе при экспорте
+HISTORY_CHUNK = 1000
+
+
+# ========== ИНТЕРФЕЙС ХРАНЕНИЯ ==========
+class Persistence:
+    """
+    Подключаемое долговременное хранение общих данных.
+    Если shared=True, хранилище разделяют несколько процессов Streamlit:
+    id выделяет само хранилище, блоки пишутся сразу с проверкой версии,
+    а has_changes() сообщает, что другой процесс что-то записал.
+    """
+
+    shared = False
+
+    def load_state(self, pending_status: str) -> Dict:
+        """
+        Загружает только то, что нужно для первого рендера:
+        комбинации, блоки, ожидающие запросы, недавних пользователей,
+        настройки, счетчики id и число обработанных запросов.
+        """
+        return {
+            "spell_combinations": {},
+            "game_blocks": [],
+            "client_requests": [],
+            "users": {},
+            "settings": {},
+            "last_block_id": 0,
+            "last_request_id": 0,
+            "processed_requests": 0,
+        }
+
+    def load_history(self, pending_status: str, limit: Optional[int] = None) -> List[Dict]:
+        """Догружает последние limit обработанных запросов (по возрастанию id) по требованию"""
+        return []
+
+    def iter_history(self, pending_status: str) -> Iterator[Dict]:
+        """Все обработанные запросы по возрастанию id, не загружая их в память разом (для экспорта)"""
+        return iter(self.load_history(pending_status))
+
+    def write_batch(self, ops: List[WriteOp]):
+        """Записывает пакет изменений одной транзакцией"""
+
+    # ---------- Общий режим для нескольких процессов ----------
+    def allocate_id(self, kind: str) -> int:
+        """Выделяет id, уникальный для всех процессов ("block" или "request")"""
+        raise NotImplementedError
+
+    def insert_block(self, block: Dict) -> Dict:
+        """Создает блок; если другой процесс уже создал блок для заклинания, возвращает его"""
+        return block
+
+    def cas_block(self, block: Dict, expected_version: int) -> bool:
+        """Записывает блок, только если в хранилище он все еще версии expected_version"""
+        return True
+
+    def load_block(self, block_id: int) -> Optional[Dict]:
+        return None
+
+    def load_setting(self, name: str) -> Optional[Dict]:
+        """Свежее значение настройки прямо из хранилища, минуя sync()"""
+        return None
+
+    def has_changes(self) -> bool:
+        """Канал уведомлений: были ли записи из других процессов с прошлого вызова"""
+        return False
+
+    def close(self):
+        pass
+
+
+# ========== SQLITE (WAL) ==========
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spell_combinations (
+    spell_name TEXT PRIMARY KEY,
+    combination TEXT NOT NULL,
+    elements TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS game_blocks (
+    id INTEGER PRIMARY KEY,
+    spell_name TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_blocks_spell ON game_blocks(spell_name);
+CREATE TABLE IF NOT EXISTS client_requests (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    spell_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_requests_spell ON client_requests(spell_name);
+CREATE INDEX IF NOT EXISTS idx_requests_user_status ON client_requests(user_id, status);
+CREATE INDEX IF NOT EXISTS idx_requests_status ON client_requests(status);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    last_active REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users(last_active);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Постоянные тексты запросов: sqlite3 кэширует их подготовленные выражения
+UPSERT_SQL = {
+    "combo": "INSERT OR REPLACE INTO spell_combinations (spell_name, combination, elements) VALUES (?, ?, ?)",
+    # Устаревшая версия блока (например, из другого процесса) не перезаписывает новую
+    "block": ("INSERT INTO game_blocks (id, spell_name, version, data) VALUES (?, ?, ?, ?) "
+              "ON CONFLICT(id) DO UPDATE SET data = excluded.data, version = excluded.version "
+              "WHERE excluded.version >= game_blocks.version"),
+    "request": "INSERT OR REPLACE INTO client_requests (id, user_id, spell_name, status, data) VALUES (?, ?, ?, ?, ?)",
+    "user": "INSERT OR REPLACE INTO users (user_id, type, last_active, data) VALUES (?, ?, ?, ?)",
+    "setting": "INSERT OR REPLACE INTO settings (name, data) VALUES (?, ?)",
+}
+DELETE_SQL = {
+    "combo": "DELETE FROM spell_combinations WHERE spell_name = ?",
+    "block": "DELETE FROM game_blocks WHERE id = ?",
+    "request": "DELETE FROM client_requests WHERE id = ?",
+    "user": "DELETE FROM users WHERE user_id = ?",
+    "setting": "DELETE FROM settings WHERE name = ?",
+    "spell_requests": "DELETE FROM client_requests WHERE spell_name = ?",
+}
+
+
+def _row(kind: str, key, data: Dict) -> tuple:
+    if kind == "combo":
+        return key, data["combination"], json.dumps(data["elements"], ensure_ascii=False)
+    if kind == "block":
+        return key, data["spell_name"], data.get("version", 0), json.dumps(data, ensure_ascii=False, default=to_json)
+    if kind == "request":
+        return key, data["user_id"], data["spell_name"], data["status"], json.dumps(data, ensure_ascii=False, default=to_json)
+    if kind == "user":
+        return key, data["type"], data["last_active"], json.dumps(data, ensure_ascii=False, default=to_json)
+    if kind == "setting":
+        return key, json.dumps(data, ensure_ascii=False)
+    raise ValueError(f"Неизвестный вид записи: {kind}")
+
+
+class SQLitePersistence(Persistence):
+    """
+    Хранение в SQLite в режиме WAL: читатели не блокируют писателя.
+    С shared=True один файл базы разделяют несколько процессов (реплик):
+    уведомления об изменениях берутся из PRAGMA data_version, который
+    меняется только при коммитах других соединений.
+    """
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        for kind, table in (("block", "game_blocks"), ("request", "client_requests")):
+            self._conn.execute(
+                f"INSERT INTO counters (name, value) SELECT ?, COALESCE(MAX(id), 0) FROM {table} WHERE true "
+                f"ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)", (kind,))
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _migrate(self):
+        """Добавляет колонку version в базы, созданные до появления общего режима"""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(game_blocks)")]
+        if columns and "version" not in columns:
+            self._conn.execute("ALTER TABLE game_blocks ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def load_state(self, pending_status: str) -> Dict:
+        with self._lock:
+            conn = self._conn
+            combos = {
+                name: {"combination": combination, "elements": json.loads(elements)}
+                for name, combination, elements in conn.execute(
+                    "SELECT spell_name, combination, elements FROM spell_combinations ORDER BY rowid")
+            }
+            blocks = [json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM game_blocks ORDER BY id")]
+            requests = [json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM client_requests WHERE status = ? ORDER BY id", (pending_status,))]
+            users = {
+                user_id: json.loads(data) for user_id, data in conn.execute(
+                    "SELECT user_id, data FROM users WHERE last_active > ?",
+                    (time.time() - USER_LOAD_WINDOW,))
+            }
+            settings = {name: json.loads(data) for name, data in conn.execute("SELECT name, data FROM settings")}
+            # Счетчики растут только в общем режиме, поэтому учитываем и MAX(id)
+            counters = dict(conn.execute("SELECT name, value FROM counters"))
+            last_block_id = max(counters.get("block", 0), conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM game_blocks").fetchone()[0])
+            last_request_id = max(counters.get("request", 0), conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM client_requests").fetchone()[0])
+            processed = conn.execute(
+                "SELECT COUNT(*) FROM client_requests WHERE status != ?", (pending_status,)).fetchone()[0]
+        return {
+            "spell_combinations": combos,
+            "game_blocks": blocks,
+            "client_requests": requests,
+            "users": users,
+            "settings": settings,
+            "last_block_id": last_block_id,
+            "last_request_id": last_request_id,
+            "processed_requests": processed,
+        }
+
+    def load_history(self, pending_status: str, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM client_requests WHERE status != ? ORDER BY id DESC LIMIT ?",
+                (pending_status, -1 if limit is None else limit)).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def iter_history(self, pending_status: str) -> Iterator[Dict]:
+        # Порциями по id: блокировка соединения держится только на время одной порции
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, data FROM client_requests WHERE status != ? AND id > ? ORDER BY id LIMIT ?",
+                    (pending_status, last_id, HISTORY_CHUNK)).fetchall()
+            for last_id, data in rows:
+                yield json.loads(data)
+            if len(rows) < HISTORY_CHUNK:
+                return
+
+    def write_batch(self, ops: List[WriteOp]):
+        if not ops:
+            return
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Подряд идущие операции одного вида пишем через executemany
+                group_sql, group_rows = None, []
+                for kind, key, data in ops:
+                    if data is None:
+                        sql, row = DELETE_SQL[kind], (key,)
+                    else:
+                        sql, row = UPSERT_SQL[kind], _row(kind, key, data)
+                    if sql != group_sql:
+                        if group_rows:
+                            conn.executemany(group_sql, group_rows)
+                        group_sql, group_rows = sql, []
+                    group_rows.append(row)
+                if group_rows:
+                    conn.executemany(group_sql, group_rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def allocate_id(self, kind: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE counters SET value = value + 1 WHERE name = ? RETURNING value", (kind,)
+            ).fetchone()[0]
+
+    def insert_block(self, block: Dict) -> Dict:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO game_blocks (id, spell_name, version, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(spell_name) DO NOTHING",
+                    _row("block", block['id'], block))
+                (data,) = conn.execute("SELECT data FROM game_blocks WHERE spell_name = ?",
+                                       (block['spell_name'],)).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return json.loads(data)
+
+    def cas_block(self, block: Dict, expected_version: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE game_blocks SET version = ?, data = ? WHERE id = ? AND version = ?",
+                (block['version'], json.dumps(block, ensure_ascii=False, default=to_json), block['id'], expected_version))
+            return cursor.rowcount == 1
+
+    def load_block(self, block_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM game_blocks WHERE id = ?", (block_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_setting(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM settings WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def has_changes(self) -> bool:
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = version != self._data_version
+            self._data_version = version
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,176 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import threading
+import time
+import uuid
+
+# Ширина корзины времени активности, секунды
+BUCKET_SECONDS = 30
+# Окно "онлайн" по умолчанию
+ONLINE_WINDOW = 300
+# Сессии без активности дольше этого срока вытесняются
+DEFAULT_HORIZON = 3600
+
+
+def new_session_id() -> str:
+    """Случайный id сессии без коллизий при одновременных входах"""
+    return uuid.uuid4().hex
+
+
+# ========== ПРИСУТСТВИЕ ПОЛЬЗОВАТЕЛЕЙ ==========
+class PresenceTracker:
+    """
+    Время активности сессий, разложенное по корзинам шириной BUCKET_SECONDS.
+    - отметка активности переносит сессию в текущую корзину за O(1)
+    - у каждой корзины есть счетчики по типу пользователя, поэтому число
+      онлайн считается по window / BUCKET_SECONDS корзинам, а не по всем сессиям
+    - sweep() выбрасывает целые корзины старше horizon
+    Счет онлайн точен до ширины корзины.
+    """
+
+    def __init__(self, horizon: float = DEFAULT_HORIZON, bucket_seconds: int = BUCKET_SECONDS):
+        self.horizon = horizon
+        self._width = bucket_seconds
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict] = {}
+        self._session_bucket: Dict[str, int] = {}
+        self._buckets: Dict[int, Set[str]] = {}
+        self._bucket_counts: Dict[int, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        return self._sessions.get(session_id)
+
+    # ---------- Корзины ----------
+    def _place(self, session_id: str, user: Dict):
+        bucket = int(user["last_active"] // self._width)
+        self._session_bucket[session_id] = bucket
+        self._buckets.setdefault(bucket, set()).add(session_id)
+        counts = self._bucket_counts.setdefault(bucket, {})
+        counts[user["type"]] = counts.get(user["type"], 0) + 1
+
+    def _unplace(self, session_id: str, user: Dict):
+        bucket = self._session_bucket.pop(session_id)
+        members = self._buckets[bucket]
+        members.discard(session_id)
+        counts = self._bucket_counts[bucket]
+        counts[user["type"]] -= 1
+        if not members:
+            del self._buckets[bucket]
+            del self._bucket_counts[bucket]
+
+    # ---------- Изменения ----------
+    def put(self, session_id: str, user: Dict):
+        """Добавляет или заменяет сессию (словарь с name, type, last_active)"""
+        with self._lock:
+            old = self._sessions.get(session_id)
+            if old is not None:
+                self._unplace(session_id, old)
+            self._sessions[session_id] = user
+            self._place(session_id, user)
+
+    def replace_all(self, users: Dict[str, Dict]):
+        """Полностью заменяет набор сессий (перечитывание из базы)"""
+        with self._lock:
+            self._sessions.clear()
+            self._session_bucket.clear()
+            self._buckets.clear()
+            self._bucket_counts.clear()
+            for session_id, user in users.items():
+                self._sessions[session_id] = user
+                self._place(session_id, user)
+
+    def touch(self, session_id: str, now: Optional[float] = None) -> Optional[float]:
+        """
+        Отмечает активность. Возвращает прежнее время активности
+        или None, если сессия неизвестна
+        """
+        user = self._sessions.get(session_id)
+        if user is None:
+            return None
+        now = time.time() if now is None else now
+        previous = user["last_active"]
+        with self._lock:
+            if self._sessions.get(session_id) is not user:
+                return None
+            # Переносим между корзинами только при смене корзины
+            if int(now // self._width) != self._session_bucket[session_id]:
+                self._unplace(session_id, user)
+                user["last_active"] = now
+                self._place(session_id, user)
+            else:
+                user["last_active"] = now
+        return previous
+
+    def remove(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            user = self._sessions.pop(session_id, None)
+            if user is not None:
+                self._unplace(session_id, user)
+            return user
+
+    def sweep(self, now: Optional[float] = None) -> List[str]:
+        """Вытесняет сессии, неактивные дольше horizon; возвращает их id"""
+        now = time.time() if now is None else now
+        oldest = int((now - self.horizon) // self._width)
+        evicted = []
+        with self._lock:
+            for bucket in [b for b in self._buckets if b < oldest]:
+                for session_id in self._buckets.pop(bucket):
+                    del self._sessions[session_id]
+                    del self._session_bucket[session_id]
+                    evicted.append(session_id)
+                del self._bucket_counts[bucket]
+        return evicted
+
+    # ---------- Счетчики ----------
+    def _recent_buckets(self, window: float, now: Optional[float]) -> Iterable[int]:
+        now = time.time() if now is None else now
+        current = int(now // self._width)
+        first = int((now - window) // self._width)
+        # Корзин в окне немного, а корзин вообще может быть больше - берем меньший перебор
+        if current - first + 1 <= len(self._buckets):
+            return (b for b in range(first, current + 1) if b in self._buckets)
+        return (b for b in list(self._buckets) if first <= b <= current)
+
+    def online_counts(self, window: float = ONLINE_WINDOW, now: Optional[float] = None) -> Dict[str, int]:
+        """Число сессий, активных за window секунд, по типу пользователя"""
+        totals: Dict[str, int] = {}
+        with self._lock:
+            for bucket in self._recent_buckets(window, now):
+                for user_type, count in self._bucket_counts[bucket].items():
+                    totals[user_type] = totals.get(user_type, 0) + count
+        return totals
+
+    def online(self, window: float = ONLINE_WINDOW, now: Optional[float] = None) -> List[Dict]:
+        """Сами активные сессии (для списков); счетчики дешевле через online_counts"""
+        with self._lock:
+            return [self._sessions[session_id]
+                    for bucket in self._recent_buckets(window, now)
+                    for session_id in self._buckets[bucket]]
+
+
+# ========== ФОНОВАЯ ОЧИСТКА ==========
+class PresenceSweeper(threading.Thread):
+    """Поток-демон, который раз в interval секунд вызывает sweep и передает вытесненные id"""
+
+    def __init__(self, tracker: PresenceTracker, interval: float,
+                 on_evict: Optional[Callable[[List[str]], None]] = None):
+        super().__init__(name="presence-sweeper", daemon=True)
+        self._tracker = tracker
+        self._interval = interval
+        self._on_evict = on_evict
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            evicted = self._tracker.sweep()
+            if evicted and self._on_evict is not None:
+                self._on_evict(evicted)
+
+    def stop(self):
+        self._stopped.set()
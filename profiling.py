@@ -0,0 +1,179 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+
+# Сколько последних замеров хранить на каждую метрику
+DEFAULT_WINDOW = 500
+# Сколько строк cProfile показывать
+PROFILE_LINES = 30
+
+RERUN = "rerun"
+WIDGETS = "widgets"
+LOOKUPS = "lookups"
+
+
+def _percentile(ordered: List[float], share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+# ========== ПРОФИЛИРОВАНИЕ RERUN ==========
+class RerunProfiler:
+    """
+    Время секций rerun, число виджетов и обращений к общему хранилищу.
+    Замеры текущего rerun копятся в данных потока (у каждой сессии свой поток),
+    по завершении rerun попадают в скользящие окна по window значений.
+    Выключенный профайлер ничего не записывает.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = DEFAULT_WINDOW):
+        self.enabled = enabled
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._local = threading.local()
+        self._patched = False
+
+    def _record(self) -> Optional[Dict[str, float]]:
+        return getattr(self._local, "record", None)
+
+    def _add(self, name: str, value: float):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self._window)
+            samples.append(value)
+
+    # ---------- Замеры ----------
+    @contextmanager
+    def rerun(self):
+        """Весь rerun: по завершении время, виджеты, обращения и секции уходят в окна"""
+        if not self.enabled:
+            yield
+            return
+        record = {WIDGETS: 0, LOOKUPS: 0}
+        self._local.record = record
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.record = None
+            self._add(RERUN, (time.perf_counter() - started) * 1000)
+            for name, value in record.items():
+                self._add(name, value)
+
+    @contextmanager
+    def section(self, name: str):
+        """Секция rerun; время в миллисекундах, повторные входы складываются"""
+        record = self._record()
+        if record is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = f"section:{name}"
+            record[key] = record.get(key, 0) + (time.perf_counter() - started) * 1000
+
+    def count(self, name: str, amount: int = 1):
+        record = self._record()
+        if record is not None:
+            record[name] = record.get(name, 0) + amount
+
+    # ---------- Подключение счетчиков ----------
+    def _counted(self, fn: Callable, name: str) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            record = self._record()
+            if record is not None:
+                record[name] += 1
+            return fn(*args, **kwargs)
+        return wrapper
+
+    def count_widgets(self, module, names: Iterable[str]):
+        """Оборачивает функции модуля streamlit, чтобы считать выведенные элементы (один раз на процесс)"""
+        with self._lock:
+            if self._patched:
+                return
+            self._patched = True
+        for name in names:
+            setattr(module, name, self._counted(getattr(module, name), WIDGETS))
+
+    def count_lookups(self, obj, names: Iterable[str]):
+        """Оборачивает методы объекта (например, хранилища), чтобы считать обращения"""
+        for name in names:
+            setattr(obj, name, self._counted(getattr(obj, name), LOOKUPS))
+
+    # ---------- Отчеты ----------
+    def summary(self) -> List[Dict[str, float]]:
+        """По каждой метрике: число замеров, среднее, p50, p95 и максимум"""
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self._samples.items()}
+        rows = []
+        for name, ordered in sorted(snapshot.items()):
+            if not ordered:
+                continue
+            rows.append({
+                "метрика": name,
+                "замеров": len(ordered),
+                "среднее": sum(ordered) / len(ordered),
+                "p50": _percentile(ordered, 0.5),
+                "p95": _percentile(ordered, 0.95),
+                "max": ordered[-1],
+            })
+        return rows
+
+    def metrics(self) -> List[str]:
+        with self._lock:
+            return sorted(self._samples)
+
+    def histogram(self, name: str, bins: int = 10) -> List[Tuple[float, int]]:
+        """Гистограмма окна метрики: (нижняя граница корзины, число замеров)"""
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        if not samples:
+            return []
+        low, high = min(samples), max(samples)
+        width = (high - low) / bins or 1
+        counts = [0] * bins
+        for value in samples:
+            counts[min(bins - 1, int((value - low) / width))] += 1
+        return [(round(low + i * width, 2), count) for i, count in enumerate(counts)]
+
+    def export(self) -> Dict:
+        """Сводка и сырые окна для выгрузки в JSON"""
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        return {"exported_at": time.time(), "summary": self.summary(), "samples": samples}
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+@contextmanager
+def capture_profile(result: Dict[str, str]):
+    """
+    cProfile одного rerun: текст с самыми дорогими функциями кладется в result["text"].
+    Если другой профайлер уже активен (две сессии одновременно), замер пропускается
+    """
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as error:
+        result["text"] = f"cProfile недоступен: {error}"
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        result["text"] = out.getvalue()
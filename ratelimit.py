@@ -0,0 +1,57 @@
+from typing import Callable, Dict, List
+import threading
+import time
+
+# Полные корзины не отличаются от отсутствующих; их удаляют раз в столько проверок
+PRUNE_EVERY = 1000
+
+
+# ========== ОГРАНИЧЕНИЕ ЧАСТОТЫ ==========
+class TokenBucketLimiter:
+    """
+    Корзина токенов на каждый ключ (user_id): в корзине до burst токенов,
+    они пополняются со скоростью rate в секунду, каждое действие тратит токен.
+    Короткая серия до burst действий проходит, дальше - не чаще rate в секунду.
+    Корзины хранятся как [токены, время пополнения] и пополняются лениво при проверке,
+    поэтому фоновый поток не нужен.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Нужны rate > 0 и burst >= 1")
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[float]] = {}
+        self._checks = 0
+
+    def _refill(self, bucket: List[float], now: float) -> float:
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[0], bucket[1] = tokens, now
+        return tokens
+
+    def allow(self, key: str) -> bool:
+        """Тратит токен ключа; False, если корзина пуста"""
+        now = self._clock()
+        with self._lock:
+            self._checks += 1
+            if self._checks % PRUNE_EVERY == 0:
+                self._prune(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = [self.burst - 1, now]
+                return True
+            if self._refill(bucket, now) < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def _prune(self, now: float):
+        """Удаляет полные корзины, чтобы словарь не рос с числом когда-либо виденных ключей"""
+        full = [key for key, bucket in self._buckets.items() if self._refill(bucket, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
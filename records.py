@@ -0,0 +1,228 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import threading
+import time
+
+# Формат времени в интерфейсе; в записях хранится время эпохи (float)
+TIME_FORMAT = "%H:%M:%S"
+
+
+# ========== КОДЫ ЭЛЕМЕНТОВ ==========
+class ElementTable:
+    """
+    Общая для процесса таблица кодов элементов: название → номер (один байт).
+    Коды выдаются при первой встрече названия и больше не меняются,
+    поэтому комбинации хранятся как bytes, а не как списки строк.
+    """
+
+    MAX_CODES = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(name)
+                if code is None:
+                    if len(self._names) >= self.MAX_CODES:
+                        raise ValueError(f"Слишком много разных элементов: больше {self.MAX_CODES}")
+                    code = len(self._names)
+                    self._names.append(name)
+                    self._codes[name] = code
+        return code
+
+    def encode(self, names: Iterable[str]) -> bytes:
+        return bytes(self.code(name) for name in names)
+
+    def decode(self, codes: bytes) -> List[str]:
+        names = self._names
+        return [names[code] for code in codes]
+
+
+ELEMENT_TABLE = ElementTable()
+
+
+# ========== ВРЕМЯ ==========
+def format_time(value: Optional[float], fmt: str = TIME_FORMAT) -> str:
+    """Строка времени для интерфейса; считается при выводе, а не при записи"""
+    if value is None:
+        return "—"
+    return datetime.fromtimestamp(value).strftime(fmt)
+
+
+def parse_time(value) -> Optional[float]:
+    """Время эпохи из сохраненного значения; старые строки "ЧЧ:ММ:СС" относятся к сегодняшнему дню"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, TIME_FORMAT).time()
+    except ValueError:
+        return None
+    return datetime.combine(datetime.now().date(), parsed).timestamp()
+
+
+# ========== ЗАПИСИ ==========
+class Record:
+    """
+    Компактная запись со __slots__ вместо словаря.
+    Поддерживает обращение как к словарю (record['level'], get, update),
+    поэтому код хранилища и интерфейса работает с записями так же, как со словарями.
+    FIELDS - поля в порядке сериализации; неизвестные ключи в update игнорируются
+    (например, "combination" из старых баз).
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.FIELDS)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.FIELDS
+
+    def items(self) -> List[Tuple[str, object]]:
+        return [(key, getattr(self, key)) for key in self.FIELDS]
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def setdefault(self, key: str, default=None):
+        return self.get(key, default)
+
+    def update(self, other=(), **changes):
+        for key, value in dict(other, **changes).items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def to_json(value):
+    """default для json.dumps: записи сериализуются как словари"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+class GameBlock(Record):
+    """Игровой блок: элементы и угаданные элементы - коды ElementTable, время - эпоха"""
+
+    __slots__ = ("id", "spell_name", "level", "_elements", "_guessed", "attempts", "max_attempts",
+                 "is_active", "created_by", "created_at", "last_played", "version")
+    FIELDS = ("id", "spell_name", "level", "elements", "guessed", "attempts", "max_attempts",
+              "is_active", "created_by", "created_at", "last_played", "version")
+
+    def __init__(self, id: int, spell_name: str, level: int, elements: Iterable[str],
+                 guessed: Iterable[str] = (), attempts: int = 0, max_attempts: int = 1,
+                 is_active: bool = True, created_by: str = "", created_at: Optional[float] = None,
+                 last_played: Optional[float] = None, version: int = 0):
+        self.id = id
+        self.spell_name = spell_name
+        self.level = level
+        self.elements = elements
+        self.guessed = guessed
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.is_active = is_active
+        self.created_by = created_by
+        self.created_at = time.time() if created_at is None else created_at
+        self.last_played = last_played
+        self.version = version
+
+    @property
+    def elements(self) -> List[str]:
+        return ELEMENT_TABLE.decode(self._elements)
+
+    @elements.setter
+    def elements(self, names: Iterable[str]):
+        self._elements = ELEMENT_TABLE.encode(names)
+
+    @property
+    def guessed(self) -> List[str]:
+        return ELEMENT_TABLE.decode(self._guessed)
+
+    @guessed.setter
+    def guessed(self, names: Iterable[str]):
+        self._guessed = ELEMENT_TABLE.encode(names)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GameBlock":
+        return cls(data['id'], data['spell_name'], data['level'], data['elements'],
+                   data.get('guessed', ()), data.get('attempts', 0), data.get('max_attempts', 1),
+                   data.get('is_active', True), data.get('created_by', ""),
+                   parse_time(data.get('created_at')), parse_time(data.get('last_played')),
+                   data.get('version', 0))
+
+
+class ClientRequest(Record):
+    """Запрос игрока мастеру; timestamp - время эпохи"""
+
+    __slots__ = ("id", "user_name", "user_id", "spell_name", "level", "timestamp", "status", "type")
+    FIELDS = __slots__
+
+    def __init__(self, id: int, user_name: str, user_id: str, spell_name: str, level: int,
+                 timestamp: Optional[float], status: str, type: str):
+        self.id = id
+        self.user_name = user_name
+        self.user_id = user_id
+        self.spell_name = spell_name
+        self.level = level
+        self.timestamp = timestamp
+        self.status = status
+        self.type = type
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ClientRequest":
+        return cls(data['id'], data['user_name'], data['user_id'], data['spell_name'], data['level'],
+                   parse_time(data.get('timestamp')), data['status'], data['type'])
+
+
+class UserSession(Record):
+    """Сессия пользователя для PresenceTracker"""
+
+    __slots__ = ("name", "type", "last_active")
+    FIELDS = __slots__
+
+    def __init__(self, name: str, type: str, last_active: float):
+        self.name = name
+        self.type = type
+        self.last_active = last_active
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "UserSession":
+        return cls(data['name'], data['type'], data['last_active'])
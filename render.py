@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Tuple
+import threading
+
+# ========== СОСТОЯНИЯ КРУЖКА ЭЛЕМЕНТА ==========
+REVEALED = "revealed"            # игрок: угаданный элемент
+HIDDEN = "hidden"                # игрок: неизвестный элемент
+HOST_REVEALED = "host_revealed"  # мастер: угаданный элемент с подписью
+HOST_HIDDEN = "host_hidden"      # мастер: еще не угаданный элемент с подписью
+
+# Виды строки блока
+PLAYER_VIEW = "player"
+HOST_VIEW = "host"
+
+DEFAULT_COLOR = "#CCCCCC"
+DEFAULT_SYMBOL = "❓"
+
+CIRCLE_STYLE = ('background-color: {color}; padding: {padding}; border-radius: 50%; '
+                'width: 50px; height: 50px; display: flex; align-items: center; '
+                'justify-content: center; margin: 0 auto; {border}')
+CAPTION_STYLE = 'font-size: 0.8em; color: #888; margin-top: 4px;'
+CELL_STYLE = 'flex: 1 0 60px; text-align: center;'
+ROW_STYLE = 'display: flex; flex-wrap: wrap; gap: 8px; margin-bottom: 8px;'
+
+
+def _circle(color: str, padding: str, border: str, symbol: str, symbol_style: str,
+            caption: Optional[str] = None) -> str:
+    html = (f'<div style="{CIRCLE_STYLE.format(color=color, padding=padding, border=border)}">'
+            f'<span style="{symbol_style}">{symbol}</span></div>')
+    if caption is not None:
+        html += f'<div style="{CAPTION_STYLE}">{caption}</div>'
+    return f'<div style="{CELL_STYLE}">{html}</div>'
+
+
+# ========== КЭШ ОТРИСОВКИ ==========
+class BlockRenderer:
+    """
+    Готовый HTML для кружков элементов и целых строк игровых блоков.
+    Кружки для всех (элемент, состояние) строятся один раз при создании,
+    а строка блока кэшируется по (id блока, версия прогресса, вид):
+    неизменившиеся блоки не пересобираются.
+    """
+
+    def __init__(self, elements: List[str], symbols: Dict[str, str], colors: Dict[str, str],
+                 max_rows: int = 4096):
+        self._symbols = symbols
+        self._colors = colors
+        self._max_rows = max_rows
+        self._rows: Dict[Tuple[int, int, str], str] = {}
+        self._lock = threading.Lock()
+        self._circles: Dict[Tuple[Optional[str], str], str] = {(None, HIDDEN): _circle(
+            "#333", "12px", "border: 2px solid #666;", "?", "font-size: 1.3em; color: white;")}
+        for element in elements:
+            for state in (REVEALED, HOST_REVEALED, HOST_HIDDEN):
+                self._circles[(element, state)] = self._build_circle(element, state)
+
+    def _build_circle(self, element: str, state: str) -> str:
+        color = self._colors.get(element, DEFAULT_COLOR)
+        symbol = self._symbols.get(element, DEFAULT_SYMBOL)
+        if state == REVEALED:
+            return _circle(color, "12px", "border: 3px solid #06D6A0;", symbol, "font-size: 1.3em;")
+        if state == HOST_REVEALED:
+            return _circle(color, "10px", "border: 3px solid #06D6A0;", symbol, "font-size: 1.2em;",
+                           f"✓ {element}")
+        return _circle(color, "10px", "border: 2px dashed #666; opacity: 0.6;", symbol, "font-size: 1.2em;",
+                       f"? {element}")
+
+    def circle(self, element: Optional[str], state: str) -> str:
+        """HTML одного кружка; неизвестные элементы (например, '?') собираются на лету"""
+        if state == HIDDEN:
+            element = None
+        html = self._circles.get((element, state))
+        if html is None:
+            html = self._build_circle(element, state)
+        return html
+
+    def _build_row(self, block: Dict, view: str) -> str:
+        # Записи блоков отдают элементы списком, собранным из кодов, поэтому читаем их один раз
+        guessed, elements = block['guessed'], block['elements']
+        cells = []
+        for i in range(block['level']):
+            if i < len(guessed):
+                cells.append(self.circle(guessed[i], REVEALED if view == PLAYER_VIEW else HOST_REVEALED))
+            elif view == PLAYER_VIEW:
+                cells.append(self.circle(None, HIDDEN))
+            else:
+                cells.append(self.circle(elements[i], HOST_HIDDEN))
+        return f'<div style="{ROW_STYLE}">{"".join(cells)}</div>'
+
+    def block_row(self, block: Dict, view: str = PLAYER_VIEW) -> str:
+        """Строка кружков блока одним HTML-фрагментом, из кэша если блок не менялся"""
+        # Версию читаем до содержимого: в худшем случае под старым ключом окажется более новый HTML
+        key = (block['id'], block['version'], view)
+        html = self._rows.get(key)
+        if html is None:
+            html = self._build_row(block, view)
+            with self._lock:
+                if len(self._rows) >= self._max_rows:
+                    self._rows.clear()
+                self._rows[key] = html
+        return html
@@ -0,0 +1,86 @@
+from typing import Callable, Dict, List, Optional
+import os
+import secrets
+import threading
+import time
+
+from store import SharedStore
+
+# Комната по умолчанию - общий стол, как до появления комнат
+DEFAULT_ROOM = ""
+# Код комнаты: без похожих символов (0/O, 1/I)
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+CODE_LENGTH = 5
+
+
+def normalize_code(code: str) -> str:
+    """
+    Код комнаты в верхнем регистре. Код попадает в имя файла базы,
+    поэтому допускаются только CODE_LENGTH символов из CODE_ALPHABET (или пусто - общий стол);
+    иначе ValueError
+    """
+    code = code.strip().upper()
+    if code != DEFAULT_ROOM and (len(code) != CODE_LENGTH or any(c not in CODE_ALPHABET for c in code)):
+        raise ValueError(f"Код комнаты - {CODE_LENGTH} букв и цифр, например ABC23")
+    return code
+
+
+def room_db_path(db_path: str, code: str) -> str:
+    """Файл базы комнаты рядом с основной: dnd_state.sqlite3 → dnd_state.ABCDE.sqlite3"""
+    code = normalize_code(code)
+    if code == DEFAULT_ROOM:
+        return db_path
+    base, extension = os.path.splitext(db_path)
+    return f"{base}.{code}{extension}"
+
+
+# ========== КОМНАТЫ ==========
+class RoomRegistry:
+    """
+    Реестр комнат: у каждой комнаты свое хранилище SharedStore
+    со своими комбинациями, блоками, очередью, блокировками и индексами,
+    поэтому сессии разных столов не трогают данные друг друга.
+    Хранилище комнаты создается при первом обращении через factory(code);
+    exists(code) сообщает, сохранилась ли комната, еще не загруженная в этом процессе.
+    """
+
+    def __init__(self, factory: Callable[[str], SharedStore],
+                 exists: Optional[Callable[[str], bool]] = None):
+        self._factory = factory
+        self._exists = exists
+        self._lock = threading.Lock()
+        self._stores: Dict[str, SharedStore] = {}
+        self._info: Dict[str, Dict] = {}
+
+    def _open(self, code: str, host_name: Optional[str] = None) -> SharedStore:
+        store = self._stores.get(code)
+        if store is None:
+            store = self._stores[code] = self._factory(code)
+            self._info[code] = {"code": code, "host": host_name, "opened_at": time.time()}
+        return store
+
+    def get(self, code: str) -> Optional[SharedStore]:
+        """Хранилище комнаты или None, если такой комнаты нет; неверный код - ValueError"""
+        code = normalize_code(code)
+        store = self._stores.get(code)
+        if store is not None:
+            return store
+        if code != DEFAULT_ROOM and (self._exists is None or not self._exists(code)):
+            return None
+        with self._lock:
+            return self._open(code)
+
+    def create(self, host_name: str) -> str:
+        """Создает комнату с новым уникальным кодом и возвращает код"""
+        with self._lock:
+            while True:
+                code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+                if code not in self._stores and not (self._exists and self._exists(code)):
+                    break
+            self._open(code, host_name)
+        return code
+
+    def rooms(self) -> List[Dict]:
+        """Загруженные комнаты: код, мастер, время открытия"""
+        with self._lock:
+            return [dict(info) for info in self._info.values()]
@@ -0,0 +1,158 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ========== ПОЛИТИКА ==========
+@dataclass
+class CooldownPolicy:
+    """
+    Через сколько секунд после использованной попытки она возвращается автоматически.
+    Порядок: настройка блока (заклинания), затем уровня, затем общая.
+    None - только вручную, через запрос мастеру
+    """
+    default: Optional[float] = None
+    per_level: Dict[int, Optional[float]] = field(default_factory=dict)
+    per_block: Dict[str, Optional[float]] = field(default_factory=dict)
+
+    def cooldown(self, spell_name: str, level: int) -> Optional[float]:
+        if spell_name in self.per_block:
+            return self.per_block[spell_name]
+        if level in self.per_level:
+            return self.per_level[level]
+        return self.default
+
+    def to_dict(self) -> Dict:
+        """Для хранения в настройках стола (ключи уровней в JSON - строки)"""
+        return {"default": self.default,
+                "per_level": {str(level): seconds for level, seconds in self.per_level.items()},
+                "per_block": dict(self.per_block)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CooldownPolicy":
+        return cls(data.get("default"),
+                   {int(level): seconds for level, seconds in data.get("per_level", {}).items()},
+                   dict(data.get("per_block", {})))
+
+
+@dataclass
+class _Entry:
+    spell_name: str
+    level: int
+    used_at: float      # когда закончились попытки (время эпохи)
+    version: int        # версия блока в этот момент
+    due: float = 0.0
+
+
+# ========== ПЛАНИРОВЩИК ==========
+class RetryScheduler:
+    """
+    Один фоновый поток на хранилище вместо ожидания в каждой сессии.
+    Задания лежат в куче по времени срабатывания; поток спит до ближайшего
+    и вызывает grant(spell_name, version). Переназначенное или отмененное
+    задание остается в куче, но пропускается (ленивое удаление).
+    Версия блока передается в grant, чтобы попытка не вернулась,
+    если блок успел измениться (например, мастер уже вернул ее вручную).
+    """
+
+    def __init__(self, grant: Callable[[str, int], object], policy: Optional[CooldownPolicy] = None,
+                 clock: Callable[[], float] = time.time):
+        self._grant = grant
+        self.policy = policy or CooldownPolicy()
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._heap: List[Tuple[float, int, _Entry]] = []
+        self._entries: Dict[str, _Entry] = {}
+        self._order = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def _push(self, entry: _Entry) -> bool:
+        cooldown = self.policy.cooldown(entry.spell_name, entry.level)
+        if cooldown is None:
+            self._entries.pop(entry.spell_name, None)
+            return False
+        entry.due = entry.used_at + cooldown
+        self._entries[entry.spell_name] = entry
+        heapq.heappush(self._heap, (entry.due, next(self._order), entry))
+        return True
+
+    def schedule(self, spell_name: str, level: int, used_at: float, version: int) -> Optional[float]:
+        """
+        Планирует возврат попытки; возвращает время срабатывания или None, если политика - вручную.
+        Повторный вызов для той же версии блока ничего не меняет
+        """
+        with self._condition:
+            current = self._entries.get(spell_name)
+            if current is not None and current.version == version:
+                return current.due
+            entry = _Entry(spell_name, level, used_at, version)
+            if not self._push(entry):
+                return None
+            self._condition.notify()
+            return entry.due
+
+    def cancel(self, spell_name: str):
+        with self._condition:
+            self._entries.pop(spell_name, None)
+
+    def due(self, spell_name: str) -> Optional[float]:
+        entry = self._entries.get(spell_name)
+        return entry.due if entry is not None else None
+
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def set_policy(self, policy: CooldownPolicy):
+        """Новая политика применяется и к уже запланированным возвратам"""
+        with self._condition:
+            self.policy = policy
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._heap.clear()
+            for entry in entries:
+                self._push(entry)
+            self._condition.notify()
+
+    # ---------- Поток ----------
+    def _take_due(self) -> List[_Entry]:
+        """Ждет ближайшее задание и забирает все, чье время пришло"""
+        with self._condition:
+            while not self._stopped:
+                now = self._clock()
+                ready = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, entry = heapq.heappop(self._heap)
+                    if self._entries.get(entry.spell_name) is entry:
+                        del self._entries[entry.spell_name]
+                        ready.append(entry)
+                if ready:
+                    return ready
+                self._condition.wait(self._heap[0][0] - now if self._heap else None)
+            return []
+
+    def _run(self):
+        while not self._stopped:
+            for entry in self._take_due():
+                try:
+                    self._grant(entry.spell_name, entry.version)
+                except Exception:
+                    # Ошибка одного возврата не должна останавливать поток, но и пропасть молча не должна
+                    logger.exception("Не удалось вернуть попытку блоку %s", entry.spell_name)
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
@@ -0,0 +1,145 @@
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+import heapq
+import re
+import threading
+
+# Сколько результатов поиска возвращать по умолчанию
+DEFAULT_LIMIT = 50
+# Длина префиксов слов, которые хранятся в индексе для коротких запросов
+PREFIX_LENGTH = 2
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """
+    Приводит строку к виду для поиска: регистр (casefold),
+    ё → е, лишние пробелы. Буква й не превращается в и
+    """
+    return _SPACES.sub(" ", text.casefold().replace("ё", "е")).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# ========== ПОИСКОВЫЙ ИНДЕКС ==========
+class SearchIndex:
+    """
+    Индекс названий для быстрого поиска при каждом нажатии клавиши.
+    - запросы от 3 символов: пересечение списков по триграммам + проверка подстроки
+    - короткие запросы: поиск по началу слов
+    Результаты ранжируются: точное совпадение, начало названия,
+    начало слова, подстрока; внутри ранга короче и по алфавиту.
+    Каждый ключ может хранить уровень (для фильтра) и произвольные данные.
+    """
+
+    def __init__(self, items: Iterable[Tuple[Hashable, str, Optional[int]]] = ()):
+        self._lock = threading.Lock()
+        self._names: Dict[Hashable, str] = {}
+        self._normalized: Dict[Hashable, str] = {}
+        self._levels: Dict[Hashable, Optional[int]] = {}
+        self._payloads: Dict[Hashable, object] = {}
+        self._by_trigram: Dict[str, Set[Hashable]] = {}
+        self._by_prefix: Dict[str, Set[Hashable]] = {}
+        for key, name, level in items:
+            self.add(key, name, level)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._names
+
+    def _grams(self, normalized: str) -> Tuple[Set[str], Set[str]]:
+        prefixes = {word[:length] for word in normalized.split(" ")
+                    for length in range(1, min(PREFIX_LENGTH, len(word)) + 1)}
+        return trigrams(normalized), prefixes
+
+    def add(self, key: Hashable, name: str, level: Optional[int] = None, payload: object = None):
+        """Добавляет или обновляет запись"""
+        with self._lock:
+            if key in self._names:
+                self._remove(key)
+            normalized = normalize(name)
+            self._names[key] = name
+            self._normalized[key] = normalized
+            self._levels[key] = level
+            if payload is not None:
+                self._payloads[key] = payload
+            grams, prefixes = self._grams(normalized)
+            for gram in grams:
+                self._by_trigram.setdefault(gram, set()).add(key)
+            for prefix in prefixes:
+                self._by_prefix.setdefault(prefix, set()).add(key)
+
+    def _remove(self, key: Hashable):
+        normalized = self._normalized.pop(key)
+        del self._names[key]
+        self._levels.pop(key, None)
+        self._payloads.pop(key, None)
+        grams, prefixes = self._grams(normalized)
+        for index, values in ((self._by_trigram, grams), (self._by_prefix, prefixes)):
+            for value in values:
+                bucket = index.get(value)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del index[value]
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            if key in self._names:
+                self._remove(key)
+
+    def levels(self) -> List[int]:
+        """Все уровни, встречающиеся в индексе, по возрастанию"""
+        with self._lock:
+            return sorted({level for level in self._levels.values() if level is not None})
+
+    def get(self, key: Hashable):
+        """Данные, сохраненные для ключа (например, словарь заклинания)"""
+        return self._payloads.get(key)
+
+    def _rank(self, key: Hashable, query: str) -> Tuple[int, int, str]:
+        normalized = self._normalized[key]
+        if normalized == query:
+            rank = 0
+        elif normalized.startswith(query):
+            rank = 1
+        elif f" {query}" in normalized:
+            rank = 2
+        else:
+            rank = 3
+        return rank, len(normalized), normalized
+
+    def search(self, query: str, level: Optional[int] = None,
+               limit: Optional[int] = DEFAULT_LIMIT) -> List[Hashable]:
+        """
+        Ключи записей, подходящих под запрос, в порядке релевантности.
+        Пустой запрос возвращает записи в порядке добавления (с учетом фильтра уровня)
+        """
+        query = normalize(query)
+        with self._lock:
+            if not query:
+                keys = [k for k in self._names if level is None or self._levels[k] == level]
+                return keys[:limit] if limit is not None else keys
+
+            if len(query) >= 3:
+                buckets = [self._by_trigram.get(gram) for gram in trigrams(query)]
+                if not all(buckets):
+                    return []
+                buckets.sort(key=len)
+                candidates = set(buckets[0]).intersection(*buckets[1:])
+                # Триграммы могут совпасть в разном порядке - проверяем подстроку
+                matches = [k for k in candidates if query in self._normalized[k]]
+            else:
+                matches = list(self._by_prefix.get(query, ()))
+
+            if level is not None:
+                matches = [k for k in matches if self._levels[k] == level]
+            # Частичная сортировка: нужны только первые limit результатов
+            if limit is not None and len(matches) > limit:
+                return heapq.nsmallest(limit, matches, key=lambda k: self._rank(k, query))
+            matches.sort(key=lambda k: self._rank(k, query))
+        return matches
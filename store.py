@@ -0,0 +1,770 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import itertools
+import threading
+import time
+
+import metrics
+from metrics import DashboardMetrics
+from persistence import Persistence, WriteOp
+from presence import DEFAULT_HORIZON, ONLINE_WINDOW, PresenceSweeper, PresenceTracker
+from records import ClientRequest, GameBlock, UserSession
+from search import SearchIndex
+
+# ========== СТАТУСЫ ЗАПРОСОВ ==========
+STATUS_PENDING = "ожидает"
+STATUS_PROCESSED = "обработан"
+
+# ========== СОСТОЯНИЯ И ПОРЯДКИ БЛОКОВ ==========
+BLOCK_ACTIVE = "active"    # попытка доступна
+BLOCK_WAITING = "waiting"  # попытка использована
+BLOCK_SOLVED = "solved"    # все элементы угаданы
+BLOCK_STATUS_ORDER = (BLOCK_ACTIVE, BLOCK_WAITING, BLOCK_SOLVED)
+
+ORDER_CREATED = "created"
+ORDER_RECENT = "recent"
+ORDER_LEVEL = "level"
+ORDER_STATUS = "status"
+
+
+def block_status(block: Dict) -> str:
+    if len(block['guessed']) >= block['level']:
+        return BLOCK_SOLVED
+    if block['attempts'] < block['max_attempts']:
+        return BLOCK_ACTIVE
+    return BLOCK_WAITING
+
+# Время активности пишется в базу не чаще, чем раз в столько секунд:
+# иначе каждый rerun будил бы все остальные процессы
+USER_TOUCH_INTERVAL = 30
+
+# Сколько обработанных запросов держать в памяти; более старые остаются только в базе
+ARCHIVE_LIMIT = 1000
+
+
+def _sessions(users: Dict[str, Dict]) -> Dict[str, UserSession]:
+    return {user_id: UserSession.from_dict(user) for user_id, user in users.items()}
+
+
+# ========== ОБЩЕЕ ХРАНИЛИЩЕ ==========
+class SharedStore:
+    """
+    Общие данные для ВСЕХ пользователей.
+    Вместо линейных проходов по спискам держит словари-индексы:
+    - блоки по id и по названию заклинания
+    - запросы по id, по (user_id, spell_name, status), по статусу и по игроку
+    Все индексы обновляются только через методы хранилища.
+
+    Streamlit выполняет скрипт каждой сессии в своем потоке, поэтому
+    изменения защищены отдельными блокировками:
+    - _combos_lock — комбинации
+    - _blocks_lock — реестр блоков, плюс отдельная блокировка на каждый блок
+    - _queue_lock — очередь запросов
+    - _users_lock — пользователи (внутри еще блокировка PresenceTracker)
+    При захвате нескольких блокировок порядок всегда такой же, как в списке.
+
+    Если передан persistence, изменения копятся в наборе "грязных" записей
+    и сбрасываются одной транзакцией через flush() в конце каждого rerun.
+    Запросы разделены на очередь ожидающих (FIFO по id) и архив обработанных.
+    Архив ограничен archive_limit записями: старые вытесняются из памяти,
+    но остаются в базе. Обработанные запросы загружаются только при первом обращении.
+
+    Если persistence.shared, хранилище разделяют несколько процессов:
+    id выделяет база, изменения блоков сразу пишутся в базу с проверкой версии,
+    а sync() перечитывает состояние, когда другой процесс что-то изменил.
+
+    version растет при каждом изменении общих данных (кроме отметок активности):
+    сессии сравнивают его с версией, которую показали, и перерисовываются только при отличии.
+
+    Счетчики для панели мастера (metrics) обновляются в тех же методах,
+    что меняют данные, поэтому их чтение не перебирает коллекции.
+
+    Пользователи хранятся в PresenceTracker: сессии, неактивные дольше
+    presence_horizon, вытесняются фоновым потоком (start_sweeper).
+
+    Блоки, запросы и пользователи хранятся компактными записями records
+    (GameBlock, ClientRequest, UserSession); словари, пришедшие из базы
+    или от вызывающего кода, приводятся к записям при добавлении.
+    """
+
+    def __init__(self, persistence: Optional[Persistence] = None,
+                 presence_horizon: float = DEFAULT_HORIZON, archive_limit: int = ARCHIVE_LIMIT,
+                 lock_factory: Optional[Callable[[str], threading.Lock]] = None):
+        # lock_factory(имя) позволяет подменить блокировки, например для замера ожидания
+        self._new_lock = lock_factory or (lambda name: threading.Lock())
+        self.spell_combinations: Dict[str, Dict] = {}
+        # Настройки стола (имя → словарь); при sync() словарь заменяется целиком
+        self.settings: Dict[str, Dict] = {}
+        self.presence = PresenceTracker(presence_horizon)
+        self._sweeper: Optional[PresenceSweeper] = None
+        self.last_global_update = time.time()
+
+        self.version = 0
+        self._version_lock = self._new_lock("version")
+
+        self._persistence = persistence
+        self._dirty: Dict[Tuple[str, object], Optional[Dict]] = {}
+        self._dirty_lock = self._new_lock("dirty")
+        self._history_loaded = persistence is None
+
+        self._combos_lock = self._new_lock("combos")
+        self._blocks_lock = self._new_lock("blocks")
+        self._queue_lock = self._new_lock("queue")
+        self._users_lock = self._new_lock("users")
+
+        # next() у itertools.count атомарен, но счетчики читаются и для
+        # отображения, поэтому последнее выданное значение храним рядом
+        self._block_ids = itertools.count(1)
+        self._request_ids = itertools.count(1)
+        self._ids_lock = self._new_lock("ids")
+        self.last_block_id = 0
+        self.last_request_id = 0
+
+        # Словари сохраняют порядок вставки, поэтому порядок вывода не меняется
+        self._blocks: Dict[int, Dict] = {}
+        self._block_by_spell: Dict[str, Dict] = {}
+        self._block_locks: Dict[int, threading.Lock] = {}
+
+        # Порядки вывода блоков поддерживаются при каждом изменении,
+        # чтобы не сортировать весь список на каждом rerun
+        self._order_lock = self._new_lock("order")
+        self._blocks_by_activity: "OrderedDict[int, Dict]" = OrderedDict()
+        self._blocks_by_level: Dict[int, Dict[int, Dict]] = {}
+        self._blocks_by_status: Dict[str, Dict[int, Dict]] = {status: {} for status in BLOCK_STATUS_ORDER}
+        self._block_status: Dict[int, str] = {}
+        # Попытки, с которыми блок был решен: нужны, чтобы откатить среднее
+        self._solved_attempts: Dict[int, int] = {}
+
+        self.metrics = DashboardMetrics()
+
+        # Поисковые индексы по названиям заклинаний
+        self.combo_index = SearchIndex()
+        self.block_index = SearchIndex()
+
+        self._requests: Dict[int, Dict] = {}
+        self._requests_by_key: Dict[Tuple[str, str, str], Dict[int, Dict]] = {}
+        self._requests_by_status: Dict[str, Dict[int, Dict]] = {}
+        self._requests_by_user: Dict[Tuple[str, str], Dict[int, Dict]] = {}
+        self._requests_by_spell: Dict[str, Dict[int, Dict]] = {}
+        # Обработанные запросы в порядке обработки
+        self._archive: "OrderedDict[int, Dict]" = OrderedDict()
+        self.archive_limit = archive_limit
+
+        if persistence is not None:
+            self._load(persistence.load_state(STATUS_PENDING))
+
+    # ---------- Долговременное хранение ----------
+    def _load(self, state: Dict):
+        self.spell_combinations.update(state["spell_combinations"])
+        self.settings = dict(state.get("settings", {}))
+        for spell_name, combo in state["spell_combinations"].items():
+            self.combo_index.add(spell_name, spell_name, len(combo["elements"]))
+        self.presence.replace_all(_sessions(state["users"]))
+        for block in state["game_blocks"]:
+            self._add_block(block)
+        for req in map(ClientRequest.from_dict, state["client_requests"]):
+            self._requests[req['id']] = req
+            self._index_request(req)
+        self.metrics.set(metrics.COMBOS, len(self.spell_combinations))
+        self.metrics.set(metrics.PENDING, len(state["client_requests"]))
+        self.metrics.set(metrics.PROCESSED, state["processed_requests"])
+        self.last_block_id = state["last_block_id"]
+        self.last_request_id = state["last_request_id"]
+        self._block_ids = itertools.count(self.last_block_id + 1)
+        self._request_ids = itertools.count(self.last_request_id + 1)
+
+    def sync(self) -> bool:
+        """
+        Перечитывает состояние, если другой процесс записал изменения.
+        Возвращает True, если данные обновились.
+        """
+        if self._persistence is None or not self._persistence.shared:
+            return False
+        if not self._persistence.has_changes():
+            return False
+        self.flush()
+        state = self._persistence.load_state(STATUS_PENDING)
+        with self._combos_lock, self._blocks_lock, self._queue_lock, self._users_lock:
+            self.spell_combinations.clear()
+            self.spell_combinations.update(state["spell_combinations"])
+            self.combo_index = SearchIndex(
+                (name, name, len(combo["elements"])) for name, combo in self.spell_combinations.items())
+            self.presence.replace_all(_sessions(state["users"]))
+            self.settings = dict(state.get("settings", {}))
+
+            # Существующие словари блоков обновляем на месте: на них могут ссылаться сессии
+            fresh_ids = set()
+            for fresh in state["game_blocks"]:
+                fresh_ids.add(fresh['id'])
+                block = self._blocks.get(fresh['id'])
+                if block is None:
+                    self._add_block(fresh)
+                else:
+                    with self._block_locks[block['id']]:
+                        block.update(fresh)
+                    self._reorder_block(block)
+            for block in [b for b in self._blocks.values() if b['id'] not in fresh_ids]:
+                self._remove_block(block['spell_name'])
+
+            self._requests.clear()
+            self._requests_by_key.clear()
+            self._requests_by_status.clear()
+            self._requests_by_user.clear()
+            self._requests_by_spell.clear()
+            self._archive.clear()
+            for req in map(ClientRequest.from_dict, state["client_requests"]):
+                self._requests[req['id']] = req
+                self._index_request(req)
+            self.metrics.set(metrics.COMBOS, len(self.spell_combinations))
+            self.metrics.set(metrics.PENDING, len(state["client_requests"]))
+            self.metrics.set(metrics.PROCESSED, state["processed_requests"])
+            self._history_loaded = False
+
+            self.last_block_id = state["last_block_id"]
+            self.last_request_id = state["last_request_id"]
+        self._bump()
+        return True
+
+    def _bump(self):
+        """Увеличивает версию общих данных"""
+        with self._version_lock:
+            self.version += 1
+            self.last_global_update = time.time()
+
+    def _changed(self, kind: str, key, data: Optional[Dict]):
+        """Изменение общих данных: новая версия и запись при ближайшем flush()"""
+        self._bump()
+        self._mark(kind, key, data)
+
+    def _mark(self, kind: str, key, data: Optional[Dict]):
+        """Запоминает изменение до ближайшего flush(); повторные изменения схлопываются"""
+        if self._persistence is None:
+            return
+        with self._dirty_lock:
+            # Переставляем ключ в конец, чтобы порядок операций в пакете сохранялся
+            self._dirty.pop((kind, key), None)
+            self._dirty[(kind, key)] = data
+
+    def flush(self):
+        """Записывает все накопленные изменения одной транзакцией"""
+        if self._persistence is None:
+            return
+        with self._dirty_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+        ops: List[WriteOp] = [(kind, key, data) for (kind, key), data in dirty.items()]
+        try:
+            self._persistence.write_batch(ops)
+        except Exception:
+            # Возвращаем изменения, чтобы не потерять их при следующем flush()
+            with self._dirty_lock:
+                for key, data in dirty.items():
+                    self._dirty.setdefault(key, data)
+            raise
+
+    def _ensure_history(self):
+        """Догружает обработанные запросы при первом обращении к истории"""
+        if self._history_loaded:
+            return
+        self.flush()
+        history = self._persistence.load_history(STATUS_PENDING, self.archive_limit)
+        with self._queue_lock:
+            if self._history_loaded:
+                return
+            # Запросы, обработанные в этом процессе до загрузки, новее истории из базы
+            recent = list(self._archive.values())
+            self._archive.clear()
+            for req in map(ClientRequest.from_dict, history):
+                if req['id'] not in self._requests:
+                    self._requests[req['id']] = req
+                    self._index_request(req)
+                    self._archive[req['id']] = req
+            for req in recent:
+                self._archive[req['id']] = req
+            self._trim_archive()
+            self._history_loaded = True
+
+    # ---------- Идентификаторы ----------
+    def next_block_id(self) -> int:
+        """Атомарно выделяет id блока"""
+        if self._persistence is not None and self._persistence.shared:
+            self.last_block_id = self._persistence.allocate_id("block")
+            return self.last_block_id
+        with self._ids_lock:
+            self.last_block_id = next(self._block_ids)
+            return self.last_block_id
+
+    def next_request_id(self) -> int:
+        """Атомарно выделяет id запроса"""
+        if self._persistence is not None and self._persistence.shared:
+            self.last_request_id = self._persistence.allocate_id("request")
+            return self.last_request_id
+        with self._ids_lock:
+            self.last_request_id = next(self._request_ids)
+            return self.last_request_id
+
+    # ---------- Настройки ----------
+    def get_setting(self, name: str, fresh: bool = False) -> Optional[Dict]:
+        """
+        Настройка стола или None. С fresh в общем режиме значение читается прямо из базы:
+        так фоновый поток видит изменение из другого процесса, не дожидаясь sync()
+        """
+        if fresh and self._persistence is not None and self._persistence.shared:
+            data = self._persistence.load_setting(name)
+            settings = dict(self.settings)
+            if data is None:
+                settings.pop(name, None)
+            else:
+                settings[name] = data
+            self.settings = settings
+            return data
+        return self.settings.get(name)
+
+    def set_setting(self, name: str, data: Dict):
+        """В общем режиме настройка пишется в базу сразу, чтобы get_setting(fresh=True) не прочитал старую"""
+        if self._persistence is not None and self._persistence.shared:
+            self._persistence.write_batch([("setting", name, data)])
+        settings = dict(self.settings)
+        settings[name] = data
+        self.settings = settings
+        if self._persistence is not None and self._persistence.shared:
+            self._bump()
+        else:
+            self._changed("setting", name, data)
+
+    # ---------- Пользователи ----------
+    def register_user(self, user_id: str, name: str, user_type: str, overwrite: bool = True):
+        with self._users_lock:
+            if user_id not in self.presence:
+                self.metrics.adjust(metrics.USERS_SEEN)
+            elif not overwrite:
+                return
+            user = UserSession(name, user_type, time.time())
+            self.presence.put(user_id, user)
+            self._changed("user", user_id, user)
+
+    def touch_user(self, user_id: str):
+        now = time.time()
+        previous = self.presence.touch(user_id, now)
+        if previous is not None and now - previous >= USER_TOUCH_INTERVAL:
+            self._mark("user", user_id, self.presence.get(user_id))
+
+    def remove_user(self, user_id: str):
+        with self._users_lock:
+            self.presence.remove(user_id)
+            self._changed("user", user_id, None)
+
+    def online_counts(self, window: float = ONLINE_WINDOW) -> Dict[str, int]:
+        """Число активных пользователей по типу, без перебора всех сессий"""
+        return self.presence.online_counts(window)
+
+    def _evict_users(self, user_ids: List[str]):
+        # Вытеснение не меняет того, что видят игроки, поэтому версия не растет
+        self.metrics.adjust(metrics.USERS_EVICTED, len(user_ids))
+        self.metrics.forget_users(user_ids)
+        for user_id in user_ids:
+            self._mark("user", user_id, None)
+
+    def start_sweeper(self, interval: float = 60):
+        """Запускает фоновое вытеснение неактивных сессий (один раз на хранилище)"""
+        with self._users_lock:
+            if self._sweeper is None:
+                self._sweeper = PresenceSweeper(self.presence, interval, self._evict_users)
+                self._sweeper.start()
+
+    # ---------- Игровые блоки ----------
+    def blocks(self) -> List[Dict]:
+        """Все игровые блоки в порядке создания"""
+        with self._blocks_lock:
+            return list(self._blocks.values())
+
+    def block_count(self) -> int:
+        return len(self._blocks)
+
+    def get_block(self, spell_name: str) -> Optional[Dict]:
+        """Блок по названию заклинания за O(1)"""
+        return self._block_by_spell.get(spell_name)
+
+    def block_lock(self, block: Dict) -> threading.Lock:
+        return self._block_locks[block['id']]
+
+    def get_or_create_block(self, spell_name: str, factory: Callable[[int], Dict]) -> Dict:
+        """
+        Возвращает существующий блок или атомарно создает новый.
+        factory получает выделенный id и возвращает GameBlock или словарь блока.
+        """
+        with self._blocks_lock:
+            block = self._block_by_spell.get(spell_name)
+            if block:
+                return block
+            block = factory(self.next_block_id())
+            if self._persistence is not None and self._persistence.shared:
+                # Другой процесс мог успеть создать блок для этого заклинания
+                block = self._add_block(self._persistence.insert_block(block))
+                self._bump()
+            else:
+                block = self._add_block(block)
+                self._changed("block", block['id'], block)
+            return block
+
+    def _add_block(self, block: Dict) -> GameBlock:
+        if not isinstance(block, GameBlock):
+            block = GameBlock.from_dict(block)
+        self._blocks[block['id']] = block
+        self._block_by_spell[block['spell_name']] = block
+        self._block_locks[block['id']] = self._new_lock("block")
+        self.metrics.adjust(metrics.BLOCKS)
+        with self._order_lock:
+            self._blocks_by_level.setdefault(block['level'], {})[block['id']] = block
+        self._reorder_block(block)
+        self.block_index.add(block['spell_name'], block['spell_name'], block['level'])
+        return block
+
+    def _remove_block(self, spell_name: str):
+        block = self._block_by_spell.pop(spell_name, None)
+        if block:
+            del self._blocks[block['id']]
+            self._block_locks.pop(block['id'], None)
+            self.block_index.remove(spell_name)
+            self.metrics.adjust(metrics.BLOCKS, -1)
+            with self._order_lock:
+                self._blocks_by_activity.pop(block['id'], None)
+                self._blocks_by_level.get(block['level'], {}).pop(block['id'], None)
+                status = self._block_status.pop(block['id'], None)
+                if status:
+                    self._blocks_by_status[status].pop(block['id'], None)
+                if block['id'] in self._solved_attempts:
+                    self.metrics.block_unsolved(self._solved_attempts.pop(block['id']))
+            self._changed("block", block['id'], None)
+
+    def _reorder_block(self, block: Dict):
+        """Поднимает блок в порядке активности и переносит между корзинами статусов"""
+        with self._order_lock:
+            if block['id'] not in self._blocks:
+                return
+            self._blocks_by_activity[block['id']] = block
+            self._blocks_by_activity.move_to_end(block['id'])
+            status = block_status(block)
+            previous = self._block_status.get(block['id'])
+            if previous != status:
+                if previous:
+                    self._blocks_by_status[previous].pop(block['id'], None)
+                self._blocks_by_status[status][block['id']] = block
+                self._block_status[block['id']] = status
+                if previous == BLOCK_SOLVED:
+                    self.metrics.block_unsolved(self._solved_attempts.pop(block['id']))
+                if status == BLOCK_SOLVED:
+                    self._solved_attempts[block['id']] = block['attempts']
+                    self.metrics.block_solved(block['attempts'])
+
+    def iter_blocks(self, order: str = ORDER_CREATED) -> Iterator[Dict]:
+        """
+        Блоки в нужном порядке без сортировки всего списка:
+        по созданию, по недавней активности, по уровню или по статусу.
+        Порядок берется из индексов; итерация идет по снимку, безопасному для потоков.
+        """
+        with self._order_lock:
+            if order == ORDER_RECENT:
+                snapshot = list(self._blocks_by_activity.values())
+                snapshot.reverse()
+            elif order == ORDER_LEVEL:
+                snapshot = [block for level in sorted(self._blocks_by_level)
+                            for block in self._blocks_by_level[level].values()]
+            elif order == ORDER_STATUS:
+                snapshot = [block for status in BLOCK_STATUS_ORDER
+                            for block in self._blocks_by_status[status].values()]
+            else:
+                snapshot = list(self._blocks.values())
+        return iter(snapshot)
+
+    def blocks_with_status(self, status: str) -> List[Dict]:
+        """Блоки одной корзины статуса (BLOCK_ACTIVE, BLOCK_WAITING, BLOCK_SOLVED)"""
+        with self._order_lock:
+            return list(self._blocks_by_status[status].values())
+
+    # ---------- Изменение блока (compare-and-swap) ----------
+    def compare_and_set(self, block: Dict, expected_version: int, changes: Dict) -> bool:
+        """
+        Применяет changes, только если блок не менялся с версии expected_version.
+        Значения заменяются целиком, поэтому читатели всегда видят согласованное состояние.
+        В общем режиме версия проверяется и в базе: при конфликте с другим
+        процессом блок перечитывается, а вызов возвращает False.
+        Если другой процесс блок удалил, он удаляется и здесь, как в sync().
+        """
+        lock = self._block_locks.get(block['id'])
+        if lock is None:
+            return False
+        shared = self._persistence is not None and self._persistence.shared
+        with lock:
+            if block['version'] != expected_version:
+                return False
+            updated = dict(block, **changes, version=expected_version + 1) if shared else None
+            if shared and not self._persistence.cas_block(updated, expected_version):
+                fresh = self._persistence.load_block(block['id'])
+                if fresh:
+                    block.update(fresh)
+                    return False
+                deleted = True
+            else:
+                block.update(changes)
+                block['version'] = expected_version + 1
+                deleted = False
+        if deleted:
+            # Реестр блоков захватывается раньше блокировки блока, поэтому удаляем после нее
+            with self._blocks_lock:
+                if self._blocks.get(block['id']) is block:
+                    self._remove_block(block['spell_name'])
+            return False
+        self._reorder_block(block)
+        # Версию поднимаем после изменения, чтобы опрос не увидел ее раньше данных
+        if shared:
+            self._bump()
+        else:
+            self._changed("block", block['id'], block)
+        return True
+
+    def compare_and_set_progress(self, block: Dict, expected_version: int,
+                                 guessed: List[str], attempts: int,
+                                 last_played: Optional[float] = None) -> bool:
+        """Записывает прогресс, только если блок не менялся с версии expected_version"""
+        changes = {"guessed": guessed, "attempts": attempts}
+        if last_played is not None:
+            changes["last_played"] = last_played
+        return self.compare_and_set(block, expected_version, changes)
+
+    def update_block(self, block: Dict, update: Callable[[Dict], Dict]) -> Optional[Dict]:
+        """
+        Повторяет compare-and-swap, пока обновление не применится.
+        update получает блок и возвращает словарь изменений;
+        пустой словарь означает "ничего не менять" и не увеличивает версию.
+        Возвращает примененные изменения или None, если блок удален (в том числе другим процессом).
+        """
+        block_id = block['id']
+        while True:
+            current = self._blocks.get(block_id)
+            if current is None:
+                return None
+            version = current['version']
+            changes = update(current)
+            if not changes:
+                return changes
+            if self.compare_and_set(current, version, changes):
+                return changes
+
+    def update_progress(self, block: Dict, update: Callable[[List[str], int], Tuple[List[str], int]],
+                        last_played: Optional[float] = None) -> Tuple[List[str], int]:
+        """
+        Повторяет compare-and-swap прогресса, пока обновление не применится.
+        update получает (guessed, attempts) и возвращает новые значения.
+        """
+        def changes(current: Dict) -> Dict:
+            guessed, attempts = update(list(current['guessed']), current['attempts'])
+            result = {"guessed": guessed, "attempts": attempts}
+            if last_played is not None:
+                result["last_played"] = last_played
+            return result
+
+        applied = self.update_block(block, changes)
+        if applied is None:
+            return list(block['guessed']), block['attempts']
+        return applied["guessed"], applied["attempts"]
+
+    def reset_progress(self, block: Dict):
+        self.update_progress(block, lambda guessed, attempts: ([], 0))
+
+    # ---------- Запросы ----------
+    def _request_indexes(self, req: Dict):
+        return (
+            (self._requests_by_key, (req['user_id'], req['spell_name'], req['status'])),
+            (self._requests_by_status, req['status']),
+            (self._requests_by_user, (req['user_id'], req['status'])),
+            (self._requests_by_spell, req['spell_name']),
+        )
+
+    def _index_request(self, req: Dict):
+        for index, key in self._request_indexes(req):
+            index.setdefault(key, {})[req['id']] = req
+
+    def _unindex_request(self, req: Dict):
+        for index, key in self._request_indexes(req):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(req['id'], None)
+                if not bucket:
+                    del index[key]
+
+    def _trim_archive(self):
+        """Вытесняет из памяти самые старые обработанные запросы сверх archive_limit"""
+        while len(self._archive) > self.archive_limit:
+            _, req = self._archive.popitem(last=False)
+            self._requests.pop(req['id'], None)
+            self._unindex_request(req)
+
+    def get_request(self, request_id: int) -> Optional[Dict]:
+        return self._requests.get(request_id)
+
+    def create_request(self, fields: Dict, unique: bool = False) -> Optional[Dict]:
+        """
+        Атомарно выделяет id и добавляет запрос в очередь.
+        С unique запрос не создается (None), если у игрока уже ожидает
+        запрос того же типа по тому же заклинанию: проверка и добавление идут под одной блокировкой
+        """
+        with self._queue_lock:
+            if unique and self._pending_of_type(fields['user_id'], fields['spell_name'], fields['type']):
+                return None
+            req = ClientRequest.from_dict(dict(fields, id=self.next_request_id()))
+            self._requests[req['id']] = req
+            self._index_request(req)
+            self.metrics.request_created()
+            self._changed("request", req['id'], req)
+            return req
+
+    def import_request(self, fields: Dict) -> Dict:
+        """
+        Добавляет запрос из импорта с его собственным статусом. В отличие от create_request
+        не считается новым запросом: поток запросов в минуту не растет,
+        обработанный запрос сразу попадает в архив и счетчик обработанных
+        """
+        with self._queue_lock:
+            req = ClientRequest.from_dict(dict(fields, id=self.next_request_id()))
+            self._requests[req['id']] = req
+            self._index_request(req)
+            if req['status'] == STATUS_PENDING:
+                self.metrics.adjust(metrics.PENDING)
+            else:
+                self._archive[req['id']] = req
+                self.metrics.adjust(metrics.PROCESSED)
+            self._changed("request", req['id'], req)
+            self._trim_archive()
+            return req
+
+    def _pending_of_type(self, user_id: str, spell_name: str, request_type: str) -> Optional[Dict]:
+        pending = self._requests_by_key.get((user_id, spell_name, STATUS_PENDING), {})
+        return next((req for req in pending.values() if req['type'] == request_type), None)
+
+    def has_pending_request(self, user_id: str, spell_name: str, request_type: str) -> bool:
+        """Ожидает ли уже запрос игрока этого типа по заклинанию"""
+        with self._queue_lock:
+            return self._pending_of_type(user_id, spell_name, request_type) is not None
+
+    def find_request(self, user_id: str, spell_name: str, status: str = STATUS_PENDING) -> Optional[Dict]:
+        """Первый запрос игрока по заклинанию с нужным статусом за O(1)"""
+        if status != STATUS_PENDING:
+            self._ensure_history()
+        with self._queue_lock:
+            found = self._requests_by_key.get((user_id, spell_name, status))
+            return next(iter(found.values())) if found else None
+
+    def requests_with_status(self, status: str = STATUS_PENDING) -> List[Dict]:
+        """Запросы со статусом; ожидающие - в порядке поступления"""
+        if status != STATUS_PENDING:
+            self._ensure_history()
+        with self._queue_lock:
+            return list(self._requests_by_status.get(status, {}).values())
+
+    def count_requests(self, status: str = STATUS_PENDING) -> int:
+        """Число ожидающих за O(1); для обработанных - только те, что в архиве в памяти"""
+        if status != STATUS_PENDING:
+            self._ensure_history()
+        return len(self._requests_by_status.get(status, {}))
+
+    def request_counters(self) -> Dict[str, int]:
+        """Счетчики для метрик мастера без перебора запросов"""
+        return {
+            "pending": self.metrics.get(metrics.PENDING),
+            "processed": self.metrics.get(metrics.PROCESSED),
+            "archived": len(self._archive),
+        }
+
+    def iter_request_history(self) -> Iterator[Dict]:
+        """
+        Все обработанные запросы по возрастанию id: из базы порциями, без загрузки в архив;
+        без базы - архив в памяти
+        """
+        if self._persistence is None:
+            yield from sorted(self.requests_with_status(STATUS_PROCESSED), key=lambda req: req['id'])
+            return
+        self.flush()
+        yield from map(ClientRequest.from_dict, self._persistence.iter_history(STATUS_PENDING))
+
+    def user_requests(self, user_id: str, status: str = STATUS_PENDING) -> List[Dict]:
+        if status != STATUS_PENDING:
+            self._ensure_history()
+        with self._queue_lock:
+            return list(self._requests_by_user.get((user_id, status), {}).values())
+
+    def set_request_status(self, req: Dict, status: str):
+        """Меняет статус запроса с переносом между индексами"""
+        with self._queue_lock:
+            if req['id'] not in self._requests:
+                return
+            was_pending = req['status'] == STATUS_PENDING
+            self._unindex_request(req)
+            req['status'] = status
+            self._index_request(req)
+            if status == STATUS_PENDING:
+                if self._archive.pop(req['id'], None) is not None:
+                    self.metrics.adjust(metrics.PROCESSED, -1)
+                    self.metrics.adjust(metrics.PENDING)
+            else:
+                self._archive[req['id']] = req
+                self._archive.move_to_end(req['id'])
+                if was_pending:
+                    self.metrics.adjust(metrics.PROCESSED)
+                    self.metrics.adjust(metrics.PENDING, -1)
+            self._changed("request", req['id'], req)
+            # Вытесненные из памяти запросы уже помечены к записи в базу
+            self._trim_archive()
+
+    def _delete_request(self, request_id: int):
+        req = self._requests.pop(request_id, None)
+        if req:
+            self._unindex_request(req)
+            if self._archive.pop(request_id, None) is not None:
+                self.metrics.adjust(metrics.PROCESSED, -1)
+            elif req['status'] == STATUS_PENDING:
+                self.metrics.adjust(metrics.PENDING, -1)
+            self._changed("request", request_id, None)
+
+    def delete_request(self, request_id: int):
+        with self._queue_lock:
+            self._delete_request(request_id)
+
+    # ---------- Комбинации ----------
+    def save_combination(self, spell_name: str, elements: List[str], combination: str):
+        """Сохраняет комбинацию и обновляет элементы существующего блока"""
+        self.save_combinations({spell_name: (elements, combination)})
+
+    def save_combinations(self, combos: Dict[str, Tuple[List[str], str]]):
+        """
+        Сохраняет пакет комбинаций {название: (элементы, строка комбинации)}
+        под одной блокировкой и с одним увеличением версии; блоки получают новые элементы
+        """
+        with self._combos_lock:
+            for spell_name, (elements, combination) in combos.items():
+                if spell_name not in self.spell_combinations:
+                    self.metrics.adjust(metrics.COMBOS)
+                self.spell_combinations[spell_name] = {
+                    "combination": combination,
+                    "elements": elements
+                }
+                self.combo_index.add(spell_name, spell_name, len(elements))
+                self._mark("combo", spell_name, self.spell_combinations[spell_name])
+                block = self._block_by_spell.get(spell_name)
+                if block:
+                    self.update_block(block, lambda current, elements=elements: {"elements": elements})
+            self._bump()
+
+    def delete_spell(self, spell_name: str):
+        """Удаляет комбинацию, блок и все запросы по заклинанию"""
+        with self._combos_lock, self._blocks_lock, self._queue_lock:
+            if self.spell_combinations.pop(spell_name, None) is not None:
+                self.metrics.adjust(metrics.COMBOS, -1)
+            self.combo_index.remove(spell_name)
+            self._changed("combo", spell_name, None)
+            self._remove_block(spell_name)
+            for request_id in list(self._requests_by_spell.get(spell_name, {})):
+                self._delete_request(request_id)
+            # Обработанные запросы могут быть еще не загружены из хранилища
+            self._changed("spell_requests", spell_name, None)
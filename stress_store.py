@@ -0,0 +1,220 @@
+"""
+Нагрузочная проверка SharedStore из множества потоков.
+
+Запуск: python stress_store.py [потоков] [операций_на_поток]
+        python stress_store.py --shared [процессов] [операций_на_процесс]
+        python stress_store.py --journal [потоков] [операций_на_поток]
+
+Проверяет инварианты, которые ломались без блокировок:
+- id запросов и блоков уникальны
+- на одно заклинание создается ровно один блок
+- ни одна попытка и ни один угаданный элемент не теряются
+- счетчики очереди и панели мастера сходятся с пересчетом, архив обработанных ограничен
+С --shared то же проверяется для нескольких процессов над одним файлом SQLite.
+С --journal потоки пишут в журнал событий (с частыми снимками), после чего
+состояние восстанавливается из снимка и хвоста журнала, в том числе
+с оборванной последней строкой, и сравнивается с исходным.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from journal import JournalPersistence
+from persistence import SQLitePersistence
+from store import SharedStore, STATUS_PENDING, STATUS_PROCESSED
+
+ELEMENTS = ["Огонь", "Вода", "Земля", "Молния", "Лед", "Жизнь", "Смерть", "Щит"]
+SPELLS = [f"Заклинание {i}" for i in range(20)]
+
+
+def make_block(spell_name: str, elements):
+    return lambda block_id: {
+        "id": block_id,
+        "spell_name": spell_name,
+        "level": len(elements),
+        "combination": "",
+        "elements": elements,
+        "guessed": [],
+        "attempts": 0,
+        "max_attempts": 1,
+        "is_active": True,
+        "created_by": "stress",
+        "created_at": "",
+        "last_played": None,
+        "version": 0
+    }
+
+
+def run(threads: int = 32, ops: int = 2000, store: SharedStore = None):
+    store = store or SharedStore()
+    rng = random.Random(0)
+    combos = {name: [rng.choice(ELEMENTS) for _ in range(8)] for name in SPELLS}
+    barrier = threading.Barrier(threads)
+    submitted = {name: 0 for name in SPELLS}
+    submitted_lock = threading.Lock()
+    request_ids = []
+
+    def worker(seed: int):
+        local_rng = random.Random(seed)
+        user_id = f"user_{seed}"
+        my_ids = []
+        my_submits = {name: 0 for name in SPELLS}
+        barrier.wait()
+        for _ in range(ops):
+            spell = local_rng.choice(SPELLS)
+            action = local_rng.random()
+            if action < 0.3:
+                req = store.create_request({
+                    "user_name": user_id, "user_id": user_id, "spell_name": spell,
+                    "level": 8, "timestamp": "", "status": STATUS_PENDING, "type": "новый"
+                })
+                my_ids.append(req['id'])
+            elif action < 0.4:
+                req = store.find_request(user_id, spell)
+                if req:
+                    store.set_request_status(req, STATUS_PROCESSED)
+            elif action < 0.6:
+                store.get_or_create_block(spell, make_block(spell, combos[spell]))
+            else:
+                block = store.get_or_create_block(spell, make_block(spell, combos[spell]))
+                guess = local_rng.choice(ELEMENTS)
+
+                def apply(guessed, attempts):
+                    remaining = block['elements'][len(guessed):]
+                    hit = [guess] if guess in remaining and len(guessed) < block['level'] else []
+                    return guessed + hit, attempts + 1
+
+                store.update_progress(block, apply)
+                my_submits[spell] += 1
+            if local_rng.random() < 0.2:
+                # Как сброс изменений в конце rerun
+                store.flush()
+        with submitted_lock:
+            request_ids.extend(my_ids)
+            for name, count in my_submits.items():
+                submitted[name] += count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    assert len(request_ids) == len(set(request_ids)), "дублирующиеся id запросов"
+    assert store.last_request_id == len(request_ids), "счетчик запросов разошелся"
+    blocks = store.blocks()
+    assert len(blocks) == len({b['spell_name'] for b in blocks}), "несколько блоков на заклинание"
+    assert len({b['id'] for b in blocks}) == len(blocks), "дублирующиеся id блоков"
+    for block in blocks:
+        assert block['attempts'] == submitted[block['spell_name']], f"потеряны попытки: {block['spell_name']}"
+        assert len(block['guessed']) <= block['level'], f"лишние элементы: {block['spell_name']}"
+        assert block['version'] == block['attempts'], f"потеряны обновления: {block['spell_name']}"
+    pending = store.requests_with_status(STATUS_PENDING)
+    processed = store.requests_with_status(STATUS_PROCESSED)
+    counters = store.request_counters()
+    assert len(pending) == counters["pending"], "индексы очереди разошлись"
+    assert counters["pending"] + counters["processed"] == len(request_ids), "счетчики очереди разошлись"
+    assert len(processed) <= store.archive_limit, "архив обработанных не ограничен"
+    solved = [b for b in blocks if len(b['guessed']) >= b['level']]
+    assert store.metrics.get("blocks") == len(blocks), "счетчик блоков разошелся"
+    assert store.metrics.get("solved") == len(solved), "счетчик решенных разошелся"
+
+    total = threads * ops
+    print(f"OK: {threads} потоков × {ops} операций = {total} за {elapsed:.2f} с "
+          f"({total / elapsed:,.0f} оп/с), запросов {len(request_ids)}, блоков {len(blocks)}")
+    return store
+
+
+def _state(store: SharedStore):
+    # Архив обработанных догружается лениво и по id, а не по порядку обработки, поэтому сравниваем счетчики
+    counters = store.request_counters()
+    return (store.spell_combinations, store.blocks(), store.requests_with_status(STATUS_PENDING),
+            store.last_block_id, store.last_request_id, counters["pending"], counters["processed"])
+
+
+def run_journal(threads: int = 8, ops: int = 2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = JournalPersistence(tmp, snapshot_every=500)
+        store = run(threads, ops, SharedStore(journal))
+        store.flush()
+        journal.close()
+        expected = _state(store)
+        events = sum(1 for _ in journal.events())
+
+        started = time.perf_counter()
+        recovered = SharedStore(JournalPersistence(tmp))
+        elapsed = time.perf_counter() - started
+        assert _state(recovered) == expected, "состояние после восстановления разошлось"
+
+        # Сбой посреди записи: последняя строка сегмента оборвана
+        last_segment = sorted(name for name in os.listdir(tmp) if name.startswith("journal."))[-1]
+        with open(os.path.join(tmp, last_segment), "a", encoding="utf-8") as f:
+            f.write('{"type": "block_saved", "key": 1, "seq"')
+        torn = JournalPersistence(tmp)
+        assert _state(SharedStore(torn)) == expected, "оборванная строка испортила восстановление"
+        torn.write_batch([("combo", "Проверка", {"combination": "x", "elements": ["Огонь"]})])
+        torn.close()
+        assert "Проверка" in SharedStore(JournalPersistence(tmp)).spell_combinations, "дозапись после обрыва потеряна"
+
+    print(f"OK: журнал {events} событий, восстановление из снимка и хвоста за {elapsed * 1000:.0f} мс")
+
+
+def _shared_worker(path: str, seed: int, ops: int, combos):
+    store = SharedStore(SQLitePersistence(path, shared=True))
+    rng = random.Random(seed)
+    request_ids = []
+    submits = {name: 0 for name in SPELLS}
+    for _ in range(ops):
+        spell = rng.choice(SPELLS)
+        store.sync()
+        if rng.random() < 0.3:
+            req = store.create_request({
+                "user_name": str(seed), "user_id": str(seed), "spell_name": spell,
+                "level": 8, "timestamp": "", "status": STATUS_PENDING, "type": "новый"
+            })
+            request_ids.append(req['id'])
+        else:
+            block = store.get_or_create_block(spell, make_block(spell, combos[spell]))
+            store.update_progress(block, lambda guessed, attempts: (guessed, attempts + 1))
+            submits[spell] += 1
+        store.flush()
+    return request_ids, submits
+
+
+def run_shared(processes: int = 4, ops: int = 300):
+    rng = random.Random(0)
+    combos = {name: [rng.choice(ELEMENTS) for _ in range(8)] for name in SPELLS}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.sqlite3")
+        SQLitePersistence(path).close()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_shared_worker, [path] * processes, range(processes),
+                                    [ops] * processes, [combos] * processes))
+        elapsed = time.perf_counter() - started
+
+        request_ids = [rid for ids, _ in results for rid in ids]
+        submitted = {name: sum(s[name] for _, s in results) for name in SPELLS}
+        store = SharedStore(SQLitePersistence(path))
+        assert len(request_ids) == len(set(request_ids)), "дублирующиеся id запросов между процессами"
+        assert store.count_requests(STATUS_PENDING) == len(request_ids), "потеряны запросы"
+        blocks = store.blocks()
+        assert len(blocks) == len({b['spell_name'] for b in blocks}), "несколько блоков на заклинание"
+        for block in blocks:
+            assert block['attempts'] == submitted[block['spell_name']], f"потеряны попытки: {block['spell_name']}"
+
+    total = processes * ops
+    print(f"OK: {processes} процессов × {ops} операций = {total} за {elapsed:.2f} с "
+          f"({total / elapsed:,.0f} оп/с), запросов {len(request_ids)}, блоков {len(blocks)}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--shared"]:
+        run_shared(*[int(a) for a in sys.argv[2:4]])
+    elif sys.argv[1:2] == ["--journal"]:
+        run_journal(*[int(a) for a in sys.argv[2:4]])
+    else:
+        run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,297 @@
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import csv
+import io
+import json
+import tempfile
+
+from catalog import SpellCatalog
+from engine import GameEngine, REQUEST_NEW, REQUEST_REPEAT, UNKNOWN_ELEMENT
+from records import GameBlock, parse_time, to_json
+from store import SharedStore, STATUS_PENDING, STATUS_PROCESSED
+
+# ========== ФОРМАТ ==========
+KIND_COMBO = "combo"
+KIND_BLOCK = "block"
+KIND_REQUEST = "request"
+KINDS = (KIND_COMBO, KIND_BLOCK, KIND_REQUEST)
+
+# Колонки CSV для каждого вида записей (в одном CSV - один вид)
+CSV_FIELDS = {
+    KIND_COMBO: ("spell_name", "elements"),
+    KIND_BLOCK: ("spell_name", "level", "elements", "guessed", "attempts", "max_attempts",
+                 "created_by", "created_at", "last_played"),
+    KIND_REQUEST: ("id", "user_name", "user_id", "spell_name", "level", "timestamp", "status", "type"),
+}
+CSV_INTS = {"id", "level", "attempts", "max_attempts"}
+CSV_FLOATS = {"created_at", "last_played", "timestamp"}
+CSV_LISTS = {"elements", "guessed"}
+# Разделитель элементов в ячейке CSV
+LIST_SEPARATOR = "|"
+
+# Изменения сбрасываются в базу каждые столько записей, чтобы набор грязных записей не рос
+IMPORT_BATCH = 1000
+# Сколько ошибок проверки запоминать в отчете
+MAX_ERRORS = 50
+
+
+# ========== ЭКСПОРТ ==========
+def export_records(store: SharedStore, kinds: Sequence[str] = KINDS) -> Iterator[Dict]:
+    """
+    Записи по одной: комбинации, блоки, ожидающие и обработанные запросы.
+    Таблица не останавливается: каждая запись читается целиком как есть на момент чтения,
+    история запросов читается из базы порциями
+    """
+    if KIND_COMBO in kinds:
+        for spell_name in list(store.spell_combinations):
+            combo = store.spell_combinations.get(spell_name)
+            if combo is not None:
+                yield {"kind": KIND_COMBO, "spell_name": spell_name, "elements": list(combo['elements'])}
+    if KIND_BLOCK in kinds:
+        for block in store.iter_blocks():
+            yield dict(block.to_dict(), kind=KIND_BLOCK)
+    if KIND_REQUEST in kinds:
+        for req in store.requests_with_status(STATUS_PENDING):
+            yield dict(req.to_dict(), kind=KIND_REQUEST)
+        for req in store.iter_request_history():
+            yield dict(req.to_dict(), kind=KIND_REQUEST)
+
+
+def to_jsonl(records: Iterable[Dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, default=to_json) + "\n"
+
+
+def _csv_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return LIST_SEPARATOR.join(value)
+    return value
+
+
+def to_csv(records: Iterable[Dict], kind: str) -> Iterator[str]:
+    """Строки CSV для записей одного вида; записи других видов пропускаются"""
+    fields = CSV_FIELDS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    for record in records:
+        if record["kind"] != kind:
+            continue
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_csv_cell(record.get(name)) for name in fields])
+        yield buffer.getvalue()
+
+
+def spool(chunks: Iterable[str]) -> BinaryIO:
+    """
+    Записывает строки выгрузки во временный файл по мере получения и возвращает его
+    открытым на начале: вся выгрузка не собирается в памяти одной строкой
+    """
+    spooled = tempfile.TemporaryFile()
+    for chunk in chunks:
+        spooled.write(chunk.encode("utf-8"))
+    spooled.seek(0)
+    return spooled
+
+
+# ========== ЧТЕНИЕ ==========
+def read_jsonl(lines: Iterable[str]) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """(номер строки, запись); строка, которая не является JSON, дает None"""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError:
+            yield number, None
+
+
+def _csv_value(name: str, value: str):
+    if name in CSV_LISTS:
+        return value.split(LIST_SEPARATOR) if value else []
+    if value == "" and name not in CSV_INTS:
+        return None
+    try:
+        if name in CSV_INTS:
+            return int(value)
+        if name in CSV_FLOATS:
+            return float(value)
+    except ValueError:
+        # Неверное число останется строкой, его отклонит проверка
+        return value
+    return value
+
+
+def read_csv(lines: Iterable[str], kind: str) -> Iterator[Tuple[int, Dict]]:
+    """(номер строки, запись) из CSV одного вида; номера считаются с заголовком"""
+    for number, row in enumerate(csv.DictReader(lines), start=2):
+        record = {name: _csv_value(name, value or "") for name, value in row.items() if name}
+        record["kind"] = kind
+        yield number, record
+
+
+# ========== ПРОВЕРКА ==========
+class RecordValidator:
+    """Проверяет записи перед импортом: элементы - из ELEMENTS, заклинания и уровни - по каталогу"""
+
+    def __init__(self, elements: Sequence[str], catalog: SpellCatalog):
+        self._elements = set(elements)
+        self._block_elements = self._elements | {UNKNOWN_ELEMENT}
+        self._catalog = catalog
+
+    def _level(self, record: Dict) -> int:
+        """Уровень по каталогу; если в записи уровня нет, он берется из каталога"""
+        level = self._catalog.level_of(record.get("spell_name"))
+        if level is None:
+            raise ValueError(f"заклинания {record.get('spell_name')!r} нет в каталоге")
+        if record.get("level") is None:
+            record["level"] = level
+        elif record["level"] != level:
+            raise ValueError(f"уровень {record['level']!r}, а в каталоге {level}")
+        return level
+
+    @staticmethod
+    def _time(record: Dict, name: str):
+        """Время - число эпохи, строка "ЧЧ:ММ:СС" или пусто"""
+        value = record.get(name)
+        if value is None or value == "":
+            return
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)) or parse_time(value) is None:
+            raise ValueError(f"{name} - неверное время {value!r}")
+
+    def _element_list(self, record: Dict, name: str, allowed: set) -> List[str]:
+        elements = record.get(name)
+        if not isinstance(elements, list):
+            raise ValueError(f"{name} - не список")
+        unknown = [e for e in elements if e not in allowed]
+        if unknown:
+            raise ValueError(f"неизвестные элементы в {name}: {', '.join(map(str, unknown))}")
+        return elements
+
+    @staticmethod
+    def _count(record: Dict, name: str, default: int) -> int:
+        value = record.get(name, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name} должно быть неотрицательным целым, а не {value!r}")
+        return value
+
+    def validate(self, record: Optional[Dict]) -> str:
+        """Возвращает вид записи или бросает ValueError с причиной"""
+        if not isinstance(record, dict):
+            raise ValueError("ожидался JSON-объект")
+        kind = record.get("kind")
+        if kind == KIND_COMBO:
+            level = self._level(record)
+            elements = self._element_list(record, "elements", self._elements)
+            if len(elements) != level:
+                raise ValueError(f"элементов {len(elements)}, а уровень заклинания {level}")
+        elif kind == KIND_BLOCK:
+            level = self._level(record)
+            elements = self._element_list(record, "elements", self._block_elements)
+            guessed = self._element_list(record, "guessed", self._elements)
+            if len(elements) != level or len(guessed) > level:
+                raise ValueError(f"элементов {len(elements)}, угадано {len(guessed)} при уровне {level}")
+            self._count(record, "attempts", 0)
+            self._count(record, "max_attempts", 1)
+            self._time(record, "created_at")
+            self._time(record, "last_played")
+        elif kind == KIND_REQUEST:
+            self._level(record)
+            if record.get("status") not in (STATUS_PENDING, STATUS_PROCESSED):
+                raise ValueError(f"неизвестный статус {record.get('status')!r}")
+            if record.get("type") not in (REQUEST_NEW, REQUEST_REPEAT):
+                raise ValueError(f"неизвестный тип запроса {record.get('type')!r}")
+            if not record.get("user_id") or not record.get("user_name"):
+                raise ValueError("нужны user_id и user_name")
+            self._time(record, "timestamp")
+        else:
+            raise ValueError(f"неизвестный вид записи {kind!r}")
+        return kind
+
+
+# ========== ИМПОРТ ==========
+@dataclass
+class ImportReport:
+    imported: Dict[str, int] = field(default_factory=lambda: {kind: 0 for kind in KINDS})
+    rejected: int = 0
+    errors: List[str] = field(default_factory=list)    # первые MAX_ERRORS причин
+
+    def reject(self, message: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+
+def _import_block(store: SharedStore, record: Dict):
+    """Создает блок заклинания или переносит прогресс в существующий"""
+    progress = {
+        "elements": record["elements"],
+        "guessed": record.get("guessed", []),
+        "attempts": record.get("attempts", 0),
+        "max_attempts": record.get("max_attempts", 1),
+    }
+    created = []
+
+    def factory(block_id: int) -> GameBlock:
+        created.append(block_id)
+        return GameBlock.from_dict(dict(record, id=block_id, version=0))
+
+    block = store.get_or_create_block(record["spell_name"], factory)
+    if not created:
+        store.update_block(block, lambda current: progress)
+
+
+def _import_request(store: SharedStore, record: Dict):
+    """Добавляет запрос с новым id; ожидающий запрос, который уже есть у игрока, не дублируется"""
+    if record["status"] == STATUS_PENDING and store.find_request(record["user_id"], record["spell_name"]):
+        return
+    store.import_request({name: record.get(name) for name in CSV_FIELDS[KIND_REQUEST] if name != "id"})
+
+
+def import_records(engine: GameEngine, records: Iterable[Tuple[int, Optional[Dict]]],
+                   validator: RecordValidator, source: str = "импорт") -> ImportReport:
+    """
+    Импортирует записи по одной, не держа файл в памяти.
+    Комбинации сохраняются пакетами по IMPORT_BATCH одним обновлением хранилища,
+    изменения сбрасываются в базу через каждые IMPORT_BATCH записей.
+    Неверные записи пропускаются и попадают в отчет
+    """
+    store = engine.store
+    report = ImportReport()
+    combos: Dict[str, Tuple[List[str], str]] = {}
+    for line, record in records:
+        try:
+            kind = validator.validate(record)
+        except ValueError as error:
+            report.reject(f"{source}: запись {line}: {error}")
+            continue
+        if kind == KIND_COMBO:
+            combos[record["spell_name"]] = (record["elements"], engine.display(record["elements"]))
+            if len(combos) >= IMPORT_BATCH:
+                store.save_combinations(combos)
+                combos = {}
+        elif kind == KIND_BLOCK:
+            _import_block(store, record)
+        else:
+            _import_request(store, record)
+        report.imported[kind] += 1
+        if sum(report.imported.values()) % IMPORT_BATCH == 0:
+            store.flush()
+    if combos:
+        store.save_combinations(combos)
+    store.flush()
+    return report
+
+
+def read_file(lines: Iterable[str], file_name: str, kind: Optional[str] = None) -> Iterator[Tuple[int, Optional[Dict]]]:
+    """Записи файла по расширению: .csv (нужен kind) или JSON Lines"""
+    if file_name.lower().endswith(".csv"):
+        if kind not in KINDS:
+            raise ValueError("Для CSV нужно указать вид записей: combo, block или request")
+        return read_csv(lines, kind)
+    return read_jsonl(lines)
+